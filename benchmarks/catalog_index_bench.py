@@ -0,0 +1,183 @@
+"""
+Benchmark del índice del catálogo en memoria (CatalogIndex) con un catálogo sintético grande.
+
+Genera títulos con acentos y nombres alternativos, carga el índice desde el almacén Mongo
+en memoria y mide el tiempo de carga, la memoria, la búsqueda por prefijo, la búsqueda
+tolerante a erratas (con su tasa de aciertos) y el coste de upsert/remove.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.catalog_index_bench
+    python -m benchmarks.catalog_index_bench --titles 50000 --queries 2000 --json indice.json
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import statistics
+import time
+import tracemalloc
+import unicodedata
+
+from benchmarks.fake_mongo import FakeMongoClient
+from benchmarks.run_benchmarks import percentile
+
+WORDS = [
+    "el", "la", "los", "las", "de", "del", "noche", "día", "última", "misión", "corazón", "ciudad",
+    "sombra", "río", "camión", "lágrimas", "héroe", "ángel", "guerra", "océano", "dragón", "fantasma",
+    "verano", "invierno", "jardín", "tiburón", "leyenda", "película", "reino", "pájaro", "canción",
+    "secreto", "tormenta", "silencio", "vampiro", "montaña", "huida", "destino", "planeta", "espía",
+    "último", "perdido", "oscuro", "dorado", "salvaje", "eterno", "rojo", "azul", "frío", "mágico",
+]
+SYLLABLES = ["ka", "ra", "mi", "lo", "te", "san", "vel", "dor", "ni", "xa", "bru", "quen", "tí", "lú", "mar", "go", "pe", "zor"]
+ENGLISH_WORDS = [
+    "night", "day", "last", "mission", "heart", "city", "shadow", "river", "truck", "tears", "hero",
+    "angel", "war", "ocean", "dragon", "ghost", "summer", "winter", "garden", "shark", "legend",
+    "kingdom", "bird", "song", "secret", "storm", "silence", "vampire", "mountain", "escape", "fate",
+]
+
+
+def invented_word(rng):
+    """Nombres propios inventados para que el vocabulario no se reduzca a unas pocas palabras."""
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+
+def synthetic_movie(movie_id, rng):
+    words = [rng.choice(WORDS) for _ in range(rng.randint(1, 4))]
+    words.insert(rng.randint(0, len(words)), invented_word(rng))
+    title = " ".join(words)
+    title = title[0].upper() + title[1:]
+    if rng.random() < 0.3:
+        title += f" {rng.randint(2, 4)}"
+    original_title = " ".join(rng.choice(ENGLISH_WORDS) for _ in range(rng.randint(1, 4))).title()
+    return {
+        "id": movie_id,
+        "title": title,
+        "original_title": original_title,
+        "names": [original_title, title.upper()] if rng.random() < 0.5 else [],
+        "link": f"https://example.com/ver/{movie_id}",
+        "poster_path": f"/poster_{movie_id}.jpg",
+        "added_at": f"2025-01-01T00:00:{movie_id % 60:02d}",
+    }
+
+
+def add_typo(text, rng):
+    """Una errata al azar (cambio, borrado, inserción o trasposición) y sin acentos ni mayúsculas."""
+    text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c)).lower()
+    letters = [i for i, c in enumerate(text) if c.isalpha()]
+    if not letters:
+        return text
+    i = rng.choice(letters)
+    kind = rng.choice(("replace", "delete", "insert", "swap"))
+    if kind == "replace":
+        return text[:i] + rng.choice("abcdefghijklmnopqrstuvwxyz") + text[i + 1:]
+    if kind == "delete":
+        return text[:i] + text[i + 1:]
+    if kind == "insert":
+        return text[:i] + rng.choice("abcdefghijklmnopqrstuvwxyz") + text[i:]
+    if i + 1 < len(text):
+        return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+    return text
+
+
+def timed(samples, function, *args, **kwargs):
+    started = time.perf_counter()
+    result = function(*args, **kwargs)
+    samples.append(time.perf_counter() - started)
+    return result
+
+
+def summary(samples):
+    return {
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p95_ms": percentile(samples, 0.95) * 1000,
+    }
+
+
+async def main(args):
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+    bot_module = importlib.import_module("bot")
+    rng = random.Random(args.seed)
+
+    mongo = FakeMongoClient()
+    bot_module.mongo_client = mongo
+    collection = mongo["movies_database"]["movies_collection"]
+    movies = [synthetic_movie(movie_id, rng) for movie_id in range(1, args.titles + 1)]
+    await collection.insert_many(movies)
+
+    # La memoria se mide en una carga aparte: tracemalloc ralentiza mucho la carga cronometrada
+    tracemalloc.start()
+    measured = bot_module.CatalogIndex()
+    await measured.reload()
+    memory_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del measured
+
+    index = bot_module.CatalogIndex()
+    started = time.perf_counter()
+    await index.reload()
+    load_seconds = time.perf_counter() - started
+
+    targets = [rng.choice(movies) for _ in range(args.queries)]
+
+    prefix_samples = []
+    for movie in targets:
+        words = movie["title"].split()
+        query = " ".join(words[:2])[:rng.randint(3, 12)]
+        timed(prefix_samples, index.search_prefix, query, 50)
+
+    fuzzy_samples, fuzzy_hits = [], 0
+    for movie in targets:
+        query = add_typo(movie["title"], rng)
+        found = timed(fuzzy_samples, index.search_fuzzy, query, 3)
+        fuzzy_hits += any(index.movies[tmdb_id]["title"] == movie["title"] for tmdb_id in found)
+
+    upsert_samples, remove_samples = [], []
+    for offset in range(args.updates):
+        movie = synthetic_movie(args.titles + 1 + offset, rng)
+        timed(upsert_samples, index.upsert, movie)
+    for offset in range(args.updates):
+        timed(remove_samples, index.remove, args.titles + 1 + offset)
+
+    results = {
+        "titles": args.titles,
+        "load_seconds": load_seconds,
+        "memory_mb": memory_bytes / 1024 / 1024,
+        "sorted_keys": len(index._keys),
+        "trigrams": len(index._trigrams),
+        "prefix": summary(prefix_samples),
+        "fuzzy": summary(fuzzy_samples),
+        "fuzzy_recall": fuzzy_hits / len(targets),
+        "upsert": summary(upsert_samples),
+        "remove": summary(remove_samples),
+    }
+
+    print(f"Títulos: {args.titles} · carga {load_seconds:.2f}s · memoria {results['memory_mb']:.1f} MB · "
+          f"{results['sorted_keys']} claves · {results['trigrams']} trigramas")
+    for name in ("prefix", "fuzzy", "upsert", "remove"):
+        stats = results[name]
+        print(f"{name:<8} media {stats['mean_ms']:8.3f} ms  p50 {stats['p50_ms']:8.3f} ms  p95 {stats['p95_ms']:8.3f} ms")
+    print(f"Aciertos con una errata: {results['fuzzy_recall']:.1%}")
+
+    await bot_module.bot.session.close()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"seed": args.seed, "results": results}, f, indent=2)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark del índice del catálogo en memoria.")
+    parser.add_argument("--titles", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--updates", type=int, default=200, help="Películas añadidas y borradas al final")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--json", help="Guarda los resultados en este fichero JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
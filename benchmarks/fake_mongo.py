@@ -0,0 +1,414 @@
+"""
+Sustituto en proceso de MongoDB/motor para los benchmarks.
+
+Implementa solo el subconjunto de la API de motor que usa bot.py (consultas por igualdad,
+$or/$and, comparaciones, $in, $exists, $regex y los operadores de actualización $set,
+$unset, $inc, $setOnInsert, $addToSet y $push). Cada operación puede simular latencia.
+"""
+import asyncio
+import copy
+import re
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+_MISSING = object()
+
+
+def _get_path(document, path):
+    value = document
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return _MISSING
+    return value
+
+
+def _set_path(document, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def _unset_path(document, path):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(parts[-1], None)
+
+
+def _comparable(value):
+    # Mongo compara fechas con y sin zona horaria como UTC
+    if hasattr(value, "tzinfo") and getattr(value, "tzinfo", None) is not None:
+        return value.replace(tzinfo=None) - value.utcoffset()
+    return value
+
+
+def _match_condition(value, condition):
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        for operator, operand in condition.items():
+            if operator == "$options":
+                continue
+            if operator == "$exists":
+                if (value is not _MISSING) != bool(operand):
+                    return False
+            elif operator == "$in":
+                if not any(_match_condition(value, item) for item in operand):
+                    return False
+            elif operator == "$nin":
+                if any(_match_condition(value, item) for item in operand):
+                    return False
+            elif operator == "$ne":
+                if _match_condition(value, operand):
+                    return False
+            elif operator == "$regex":
+                flags = re.IGNORECASE if "i" in condition.get("$options", "") else 0
+                values = value if isinstance(value, list) else [value]
+                if not any(isinstance(v, str) and re.search(operand, v, flags) for v in values):
+                    return False
+            elif operator in ("$lt", "$lte", "$gt", "$gte"):
+                if value is _MISSING or value is None:
+                    return False
+                left, right = _comparable(value), _comparable(operand)
+                try:
+                    ok = {
+                        "$lt": left < right, "$lte": left <= right,
+                        "$gt": left > right, "$gte": left >= right,
+                    }[operator]
+                except TypeError:
+                    return False
+                if not ok:
+                    return False
+            else:
+                raise NotImplementedError(f"Operador no soportado por FakeCollection: {operator}")
+        return True
+
+    if value is _MISSING:
+        return condition is None
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return value == condition
+
+
+def matches(document, query):
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(document, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(document, sub) for sub in condition):
+                return False
+        elif not _match_condition(_get_path(document, key), condition):
+            return False
+    return True
+
+
+def _project(document, projection):
+    if not projection:
+        return copy.deepcopy(document)
+    included = {key for key, flag in projection.items() if flag}
+    if included:
+        result = {key: copy.deepcopy(document[key]) for key in included if key in document}
+        if projection.get("_id", 1) and "_id" in document:
+            result["_id"] = document["_id"]
+        return result
+    result = copy.deepcopy(document)
+    for key, flag in projection.items():
+        if not flag:
+            result.pop(key, None)
+    return result
+
+
+def _apply_update(document, update, inserting):
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            if operator == "$set":
+                _set_path(document, path, copy.deepcopy(value))
+            elif operator == "$setOnInsert":
+                if inserting:
+                    _set_path(document, path, copy.deepcopy(value))
+            elif operator == "$unset":
+                _unset_path(document, path)
+            elif operator == "$inc":
+                current = _get_path(document, path)
+                _set_path(document, path, (0 if current is _MISSING else current) + value)
+            elif operator in ("$addToSet", "$push"):
+                current = _get_path(document, path)
+                items = current if isinstance(current, list) else []
+                new_items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                for item in new_items:
+                    if operator == "$push" or item not in items:
+                        items.append(copy.deepcopy(item))
+                _set_path(document, path, items)
+            else:
+                raise NotImplementedError(f"Operador de actualización no soportado: {operator}")
+
+
+class FakeCursor:
+    def __init__(self, collection, query, projection):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction=1):
+        if isinstance(key, list):
+            self._sort.extend(key)
+        else:
+            self._sort.append((key, direction))
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def _results(self):
+        documents = [d for d in self._collection._documents.values() if matches(d, self._query)]
+        for key, direction in reversed(self._sort):
+            documents.sort(
+                key=lambda d: (_get_path(d, key) is _MISSING or _get_path(d, key) is None, _comparable(_get_path(d, key)) if _get_path(d, key) not in (_MISSING, None) else 0),
+                reverse=direction < 0
+            )
+        documents = documents[self._skip:]
+        if self._limit:
+            documents = documents[:self._limit]
+        return [_project(d, self._projection) for d in documents]
+
+    async def to_list(self, length=None):
+        await self._collection._delay()
+        results = self._results()
+        return results if length is None else results[:length]
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        await self._collection._delay()
+        for document in self._results():
+            yield document
+
+
+class InsertOneResult:
+    def __init__(self, inserted_id):
+        self.inserted_id = inserted_id
+
+
+class UpdateResult:
+    def __init__(self, matched_count, modified_count, upserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+
+
+class BulkWriteResult:
+    def __init__(self):
+        self.inserted_count = 0
+        self.matched_count = 0
+        self.modified_count = 0
+        self.deleted_count = 0
+        self.upserted_count = 0
+
+
+class DeleteResult:
+    def __init__(self, deleted_count):
+        self.deleted_count = deleted_count
+
+
+class FakeCollection:
+    def __init__(self, name, latency=0.0):
+        self.name = name
+        self.latency = latency
+        self.operations = 0
+        self._documents = {}
+
+    async def _delay(self):
+        self.operations += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def _find_first(self, query):
+        for document in self._documents.values():
+            if matches(document, query):
+                return document
+        return None
+
+    def _insert(self, document):
+        document.setdefault("_id", ObjectId())
+        if document["_id"] in self._documents:
+            raise DuplicateKeyError(f"E11000 duplicate key error: {document['_id']!r}")
+        self._documents[document["_id"]] = document
+        return document
+
+    def _upsert_document(self, query, update):
+        document = {k: copy.deepcopy(v) for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+        _apply_update(document, update, inserting=True)
+        return self._insert(document)
+
+    async def create_index(self, *args, **kwargs):
+        return "fake_index"
+
+    async def find_one(self, query=None, projection=None):
+        await self._delay()
+        document = self._find_first(query or {})
+        return _project(document, projection) if document is not None else None
+
+    def find(self, query=None, projection=None):
+        return FakeCursor(self, query or {}, projection)
+
+    async def count_documents(self, query):
+        await self._delay()
+        return sum(1 for d in self._documents.values() if matches(d, query))
+
+    async def distinct(self, key, query=None):
+        await self._delay()
+        values = []
+        for document in self._documents.values():
+            value = _get_path(document, key)
+            if value is not _MISSING and matches(document, query or {}) and value not in values:
+                values.append(value)
+        return values
+
+    async def insert_one(self, document):
+        await self._delay()
+        return InsertOneResult(self._insert(copy.deepcopy(document))["_id"])
+
+    async def insert_many(self, documents, ordered=True):
+        for document in documents:
+            await self.insert_one(document)
+
+    async def update_one(self, query, update, upsert=False):
+        await self._delay()
+        document = self._find_first(query)
+        if document is not None:
+            _apply_update(document, update, inserting=False)
+            return UpdateResult(1, 1)
+        if upsert:
+            return UpdateResult(0, 0, self._upsert_document(query, update)["_id"])
+        return UpdateResult(0, 0)
+
+    async def update_many(self, query, update, upsert=False):
+        await self._delay()
+        matched = [d for d in self._documents.values() if matches(d, query)]
+        for document in matched:
+            _apply_update(document, update, inserting=False)
+        if not matched and upsert:
+            self._upsert_document(query, update)
+        return UpdateResult(len(matched), len(matched))
+
+    async def replace_one(self, query, replacement, upsert=False):
+        await self._delay()
+        document = self._find_first(query)
+        if document is not None:
+            replacement = copy.deepcopy(replacement)
+            replacement["_id"] = document["_id"]
+            self._documents[document["_id"]] = replacement
+            return UpdateResult(1, 1)
+        if upsert:
+            return UpdateResult(0, 0, self._insert(copy.deepcopy(replacement))["_id"])
+        return UpdateResult(0, 0)
+
+    async def find_one_and_update(self, query, update, projection=None, upsert=False, return_document=ReturnDocument.BEFORE, **kwargs):
+        await self._delay()
+        document = self._find_first(query)
+        if document is None:
+            if not upsert:
+                return None
+            document = self._upsert_document(query, update)
+            return _project(document, projection) if return_document == ReturnDocument.AFTER else None
+        before = _project(document, projection)
+        _apply_update(document, update, inserting=False)
+        return _project(document, projection) if return_document == ReturnDocument.AFTER else before
+
+    async def find_one_and_delete(self, query, projection=None):
+        await self._delay()
+        document = self._find_first(query)
+        if document is None:
+            return None
+        del self._documents[document["_id"]]
+        return _project(document, projection)
+
+    async def delete_one(self, query):
+        await self._delay()
+        document = self._find_first(query)
+        if document is None:
+            return DeleteResult(0)
+        del self._documents[document["_id"]]
+        return DeleteResult(1)
+
+    async def delete_many(self, query):
+        await self._delay()
+        matched = [d["_id"] for d in self._documents.values() if matches(d, query)]
+        for document_id in matched:
+            del self._documents[document_id]
+        return DeleteResult(len(matched))
+
+    async def bulk_write(self, operations, ordered=True):
+        await self._delay()
+        latency, self.latency = self.latency, 0.0
+        operations_before = self.operations
+        summary = BulkWriteResult()
+        try:
+            for operation in operations:
+                kind = type(operation).__name__
+                if kind in ("UpdateOne", "UpdateMany", "ReplaceOne"):
+                    method = {"UpdateOne": self.update_one, "UpdateMany": self.update_many, "ReplaceOne": self.replace_one}[kind]
+                    result = await method(operation._filter, operation._doc, upsert=bool(operation._upsert))
+                    summary.matched_count += result.matched_count
+                    summary.modified_count += result.modified_count
+                    summary.upserted_count += result.upserted_id is not None or (kind == "UpdateMany" and not result.matched_count and bool(operation._upsert))
+                elif kind == "InsertOne":
+                    await self.insert_one(operation._doc)
+                    summary.inserted_count += 1
+                elif kind in ("DeleteOne", "DeleteMany"):
+                    method = self.delete_one if kind == "DeleteOne" else self.delete_many
+                    summary.deleted_count += (await method(operation._filter)).deleted_count
+                else:
+                    raise NotImplementedError(f"Operación bulk no soportada: {kind}")
+        finally:
+            self.latency = latency
+            # Un bulk_write es un único viaje a la base de datos
+            self.operations = operations_before
+        return summary
+
+
+class FakeDatabase:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(name, self.latency)
+        return self._collections[name]
+
+    async def command(self, name, *args, **kwargs):
+        return {"ok": 1.0}
+
+    @property
+    def operations(self):
+        return sum(collection.operations for collection in self._collections.values())
+
+
+class FakeMongoClient:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self._databases = {}
+
+    def __getitem__(self, name):
+        if name not in self._databases:
+            self._databases[name] = FakeDatabase(self.latency)
+        return self._databases[name]
+
+    def close(self):
+        pass
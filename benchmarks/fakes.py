@@ -0,0 +1,295 @@
+"""
+Servicios falsos para los benchmarks: TMDB, Trakt, NewsAPI, Reddit y la Bot API de Telegram.
+
+Cada servicio es una aplicación aiohttp en su propio puerto efímero de 127.0.0.1, de modo
+que las métricas por servicio de bot.py (que se agrupan por host:puerto) siguen separadas.
+Todos cuentan las peticiones recibidas y pueden simular latencia.
+"""
+import asyncio
+import collections
+import datetime
+import itertools
+import json
+import random
+import time
+
+from aiohttp import web
+
+GENRES = [28, 12, 16, 35, 80, 18, 14, 27, 10749, 878, 53]
+
+
+def fake_movie(movie_id):
+    rng = random.Random(movie_id)
+    year = rng.randint(1980, 2025)
+    return {
+        "id": movie_id,
+        "title": f"Película de prueba {movie_id}",
+        "original_title": f"Test movie {movie_id}",
+        "overview": "Una sinopsis sintética para los benchmarks. " * rng.randint(1, 6),
+        "release_date": f"{year}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+        "poster_path": f"/poster_{movie_id}.jpg",
+        "backdrop_path": f"/backdrop_{movie_id}.jpg",
+        "vote_average": round(rng.uniform(4, 9), 1),
+        "vote_count": rng.randint(50, 20000),
+        "popularity": round(rng.uniform(1, 500), 3),
+        "genre_ids": rng.sample(GENRES, 2),
+        "genres": [{"id": g, "name": f"Género {g}"} for g in rng.sample(GENRES, 2)],
+        "runtime": rng.randint(80, 180),
+        "original_language": "en",
+    }
+
+
+class FakeService:
+    """Base común: arranque en un puerto libre, latencia simulada y contadores por ruta."""
+
+    name = "fake"
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = collections.Counter()
+        self.app = web.Application(middlewares=[self._middleware])
+        self.runner = None
+        self.base_url = None
+        self.setup_routes(self.app.router)
+
+    def setup_routes(self, router):
+        raise NotImplementedError
+
+    @web.middleware
+    async def _middleware(self, request, handler):
+        self.requests[request.match_info.route.resource.canonical if request.match_info.route.resource else request.path] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    @property
+    def total_requests(self):
+        return sum(self.requests.values())
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.base_url = f"http://127.0.0.1:{port}"
+        return self.base_url
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+
+class FakeTMDB(FakeService):
+    name = "tmdb"
+
+    def setup_routes(self, router):
+        router.add_get("/3/search/movie", self.search_movie)
+        router.add_get("/3/movie/popular", self.movie_list)
+        router.add_get("/3/movie/changes", self.movie_changes)
+        router.add_get("/3/discover/movie", self.movie_list)
+        router.add_get("/3/movie/{movie_id:\\d+}", self.movie_details)
+        router.add_get("/3/search/person", self.search_person)
+        router.add_get("/3/person/{person_id:\\d+}/movie_credits", self.movie_credits)
+
+    async def search_movie(self, request):
+        query = request.query.get("query", "")
+        page = int(request.query.get("page", 1))
+        seed = sum(map(ord, query)) * 1000 + page
+        results = [fake_movie(seed + i) for i in range(20)]
+        return web.json_response({"page": page, "results": results, "total_pages": 5, "total_results": 100})
+
+    async def movie_list(self, request):
+        page = int(request.query.get("page", 1))
+        results = [fake_movie(page * 100 + i) for i in range(20)]
+        return web.json_response({"page": page, "results": results, "total_pages": 50, "total_results": 1000})
+
+    async def movie_changes(self, request):
+        # Cada día de la ventana "cambia" un bloque fijo de 150 IDs (dos páginas de 100)
+        start = datetime.date.fromisoformat(request.query["start_date"])
+        end = datetime.date.fromisoformat(request.query["end_date"])
+        page = int(request.query.get("page", 1))
+        changed = [
+            day * 1000 + i
+            for day in range(start.toordinal() % 1000, end.toordinal() % 1000 + 1)
+            for i in range(150)
+        ]
+        total_pages = max(1, -(-len(changed) // 100))
+        results = [{"id": movie_id, "adult": False} for movie_id in changed[(page - 1) * 100:page * 100]]
+        return web.json_response({"page": page, "results": results, "total_pages": total_pages, "total_results": len(changed)})
+
+    async def movie_details(self, request):
+        return web.json_response(fake_movie(int(request.match_info["movie_id"])))
+
+    async def search_person(self, request):
+        return web.json_response({"results": [{"id": 4242, "name": request.query.get("query", "")}]})
+
+    async def movie_credits(self, request):
+        return web.json_response({"cast": [fake_movie(5000 + i) for i in range(40)]})
+
+
+class FakeTrakt(FakeService):
+    name = "trakt"
+
+    def setup_routes(self, router):
+        router.add_get("/search/movie", self.search_movie)
+
+    async def search_movie(self, request):
+        query = request.query.get("query", "")
+        return web.json_response([{"type": "movie", "movie": {"title": query, "ids": {"tmdb": sum(map(ord, query))}}}])
+
+
+class FakeNewsAPI(FakeService):
+    name = "newsapi"
+
+    def setup_routes(self, router):
+        router.add_get("/v2/everything", self.everything)
+
+    async def everything(self, request):
+        page_size = int(request.query.get("pageSize", 5))
+        bucket = int(time.time() // 60)
+        articles = [
+            {
+                "title": f"Noticia de cine {bucket}-{i}",
+                "description": "Resumen sintético de la noticia.",
+                "url": f"https://news.example/{bucket}/{i}",
+                "urlToImage": None,
+                "publishedAt": "2025-01-01T00:00:00Z",
+                "source": {"name": "Fake News"},
+            }
+            for i in range(page_size)
+        ]
+        return web.json_response({"status": "ok", "totalResults": page_size, "articles": articles})
+
+
+class FakeReddit(FakeService):
+    name = "reddit"
+
+    def setup_routes(self, router):
+        router.add_get("/r/memesenespanol/.json", self.listing)
+        router.add_route("*", "/i/{name}", self.image)
+
+    async def listing(self, request):
+        children = [
+            {"data": {"title": f"Meme {i}", "url_overridden_by_dest": f"{self.base_url}/i/{i}.jpg"}}
+            for i in range(int(request.query.get("limit", 50)))
+        ]
+        return web.json_response({"data": {"children": children}})
+
+    async def image(self, request):
+        return web.Response(body=b"\xff\xd8\xff" + b"\0" * 1024, content_type="image/jpeg")
+
+
+class FakeLinkHost(FakeService):
+    """
+    Host de descargas al estilo terabox para probar la comprobación de enlaces. El prefijo del
+    código decide la respuesta: ok (200), dead (404), gone (redirige a /sharing/error),
+    nohead (HEAD 405 y GET 200) y flaky (503). Registra el máximo de peticiones simultáneas.
+    """
+
+    name = "links"
+
+    def __init__(self, latency=0.0):
+        # La latencia se simula dentro del handler para que cuente en las peticiones simultáneas
+        super().__init__()
+        self.response_latency = latency
+        self.methods = collections.Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def setup_routes(self, router):
+        router.add_route("*", "/s/{code}", self.share)
+        router.add_get("/sharing/error", self.error_page)
+
+    async def share(self, request):
+        self.methods[request.method] += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            if self.response_latency:
+                await asyncio.sleep(self.response_latency)
+            code = request.match_info["code"]
+            if code.startswith("dead"):
+                return web.Response(status=404, text="Not found")
+            if code.startswith("gone"):
+                raise web.HTTPFound("/sharing/error")
+            if code.startswith("nohead") and request.method == "HEAD":
+                return web.Response(status=405)
+            if code.startswith("flaky"):
+                return web.Response(status=503)
+            return web.Response(text="<html>Compartido</html>", content_type="text/html")
+        finally:
+            self.in_flight -= 1
+
+    async def error_page(self, request):
+        return web.Response(text="<html>El enlace ha caducado</html>", content_type="text/html")
+
+
+class FakeBotAPI(FakeService):
+    """
+    Bot API mínima: responde a los métodos send*/edit* con un Message válido y al resto con True.
+    Guarda el nombre de cada método llamado para poder contar llamadas salientes por operación.
+    """
+
+    name = "telegram"
+
+    MESSAGE_METHODS = ("send", "edit", "forward", "copy")
+
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.message_ids = itertools.count(1)
+        self.methods = collections.Counter()
+
+    def setup_routes(self, router):
+        router.add_post("/bot{token}/{method}", self.call)
+
+    async def call(self, request):
+        method = request.match_info["method"]
+        self.methods[method] += 1
+        form = await request.post()
+        if method.lower().startswith(self.MESSAGE_METHODS):
+            chat_id = form.get("chat_id", "0")
+            try:
+                chat_id = int(chat_id)
+            except ValueError:
+                chat_id = 0
+            result = {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "channel" if chat_id < 0 else "private"},
+            }
+            if method == "sendPhoto":
+                result["photo"] = [{"file_id": "photo", "file_unique_id": "photo", "width": 500, "height": 750}]
+                result["caption"] = form.get("caption") or ""
+            else:
+                result["text"] = form.get("text") or form.get("caption") or ""
+        elif method == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "bench", "username": "bench_bot"}
+        else:
+            result = True
+        return web.Response(text=json.dumps({"ok": True, "result": result}), content_type="application/json")
+
+
+async def start_fakes(latency=0.0, telegram_latency=0.0):
+    """Arranca todos los servicios y devuelve un dict nombre -> servicio."""
+    services = {
+        "tmdb": FakeTMDB(latency),
+        "trakt": FakeTrakt(latency),
+        "newsapi": FakeNewsAPI(latency),
+        "reddit": FakeReddit(latency),
+        "telegram": FakeBotAPI(telegram_latency),
+    }
+    for service in services.values():
+        await service.start()
+    return services
+
+
+def environment_for(services):
+    """Variables de entorno que apuntan bot.py a los servicios falsos."""
+    return {
+        "TMDB_BASE_URL": f"{services['tmdb'].base_url}/3",
+        "TRAKT_BASE_URL": services["trakt"].base_url,
+        "NEWS_API_URL": f"{services['newsapi'].base_url}/v2/everything",
+        "REDDIT_MEMES_URL": f"{services['reddit'].base_url}/r/memesenespanol/.json?limit=50",
+        "TELEGRAM_API_URL": services["telegram"].base_url,
+    }
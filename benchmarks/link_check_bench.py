@@ -0,0 +1,113 @@
+"""
+Benchmark de la comprobación de enlaces del catálogo contra hosts de descargas locales.
+
+Arranca varios FakeLinkHost (cada uno en su puerto, es decir, un host distinto), llena el
+almacén Mongo en memoria con películas cuyos enlaces mezclan respuestas correctas, 404,
+redirecciones a página de error, hosts sin HEAD y errores 503, y recorre el catálogo con
+check_catalog_links. Comprueba la clasificación y el límite de peticiones simultáneas por host.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.link_check_bench
+    python -m benchmarks.link_check_bench --movies 2000 --hosts 4 --latency 0.05 --per-host 4
+"""
+import argparse
+import asyncio
+import collections
+import importlib
+import json
+import os
+import random
+import time
+
+from benchmarks.fake_mongo import FakeMongoClient
+from benchmarks.fakes import FakeLinkHost
+
+KINDS = {"ok": 0.7, "dead": 0.1, "gone": 0.05, "nohead": 0.1, "flaky": 0.05}
+EXPECTED = {"ok": "ok", "dead": "dead", "gone": "dead", "nohead": "ok", "flaky": "error"}
+
+
+async def main(args):
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+    bot_module = importlib.import_module("bot")
+    rng = random.Random(args.seed)
+
+    hosts = [FakeLinkHost(args.latency) for _ in range(args.hosts)]
+    for host in hosts:
+        await host.start()
+
+    mongo = FakeMongoClient()
+    bot_module.mongo_client = mongo
+    collection = mongo["movies_database"]["movies_collection"]
+    expected = {}
+    movies = []
+    for movie_id in range(1, args.movies + 1):
+        kind = rng.choices(list(KINDS), weights=list(KINDS.values()))[0]
+        host = rng.choice(hosts)
+        movies.append({"id": movie_id, "title": f"Película {movie_id}", "link": f"{host.base_url}/s/{kind}{movie_id}"})
+        expected[movie_id] = EXPECTED[kind]
+    await collection.insert_many(movies)
+
+    checker = bot_module.LinkChecker(concurrency=args.concurrency, per_host=args.per_host)
+    started = time.perf_counter()
+    batches = 0
+    while True:
+        checked, _ = await bot_module.check_catalog_links(collection, args.batch_size, checker)
+        if not checked:
+            break
+        batches += 1
+    elapsed = time.perf_counter() - started
+
+    statuses = collections.Counter()
+    mismatches = 0
+    for movie in await collection.find({}, {"id": 1, "link_status": 1}).to_list(None):
+        statuses[movie.get("link_status")] += 1
+        mismatches += movie.get("link_status") != expected[movie["id"]]
+
+    methods = collections.Counter()
+    for host in hosts:
+        methods.update(host.methods)
+    results = {
+        "movies": args.movies,
+        "hosts": args.hosts,
+        "batches": batches,
+        "seconds": elapsed,
+        "links_per_second": args.movies / elapsed if elapsed else None,
+        "statuses": dict(statuses),
+        "misclassified": mismatches,
+        "requests": dict(methods),
+        "max_in_flight_per_host": max(host.max_in_flight for host in hosts),
+        "per_host_limit": args.per_host,
+    }
+
+    print(f"{args.movies} enlaces en {args.hosts} hosts: {elapsed:.2f}s ({results['links_per_second']:.0f} enlaces/s, {batches} lotes)")
+    print("Resultados: " + ", ".join(f"{status}={count}" for status, count in statuses.most_common()))
+    print(f"Mal clasificados: {mismatches} · peticiones: {dict(methods)}")
+    print(f"Máximo simultáneo por host: {results['max_in_flight_per_host']} (límite {args.per_host})")
+
+    for host in hosts:
+        await host.stop()
+    if bot_module.shared_http_session is not None:
+        await bot_module.shared_http_session.close()
+    await bot_module.bot.session.close()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"seed": args.seed, "results": results}, f, indent=2)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark de la comprobación de enlaces del catálogo.")
+    parser.add_argument("--movies", type=int, default=1000)
+    parser.add_argument("--hosts", type=int, default=3, help="Hosts de descargas falsos (uno por puerto)")
+    parser.add_argument("--latency", type=float, default=0.02, help="Latencia de cada respuesta de los hosts")
+    parser.add_argument("--concurrency", type=int, default=16, help="Peticiones simultáneas en total")
+    parser.add_argument("--per-host", type=int, default=2, help="Peticiones simultáneas por host")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--json", help="Guarda los resultados en este fichero JSON")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
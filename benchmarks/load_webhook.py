@@ -0,0 +1,404 @@
+"""
+Generador de carga para el webhook del bot.
+
+Envía payloads de Update realistas a /webhook con un ritmo (updates/s) y una concurrencia
+controlados, y mide cuándo se dispara la latencia. Dos fuentes de tráfico:
+
+* synthetic: mezcla de /start, botones del menú, búsquedas por texto y callback queries.
+* replay: un JSONL grabado en producción con UPDATE_RECORD_PATH (updates ya anonimizados).
+
+Contra una instancia en marcha:
+
+    python -m benchmarks.load_webhook --url http://127.0.0.1:8080 --rate 50 --duration 60
+
+O todo en local (servicios falsos + bot en este mismo proceso, sin red ni credenciales):
+
+    python -m benchmarks.load_webhook --local --rate 100 --count 2000
+    python -m benchmarks.load_webhook --local --mode replay --replay updates.jsonl --speed 5
+
+La latencia se mide desde el instante en que el update *debía* enviarse, de modo que la
+espera en cola cuenta (sin "coordinated omission"). Los errores incluyen los fallos HTTP y las
+excepciones de handlers que el webhook oculta tras su 200, leídas de /metrics. La amplificación
+es el número de llamadas a TMDB/Telegram/Mongo por update, calculada con deltas de /metrics.
+En modo --local el generador comparte el event loop con el bot: sirve para comparar cambios,
+no como cifra absoluta de capacidad.
+"""
+import argparse
+import asyncio
+import collections
+import importlib
+import itertools
+import json
+import logging
+import os
+import random
+import socket
+import time
+
+import aiohttp
+
+MENU_TEXTS = ["🔍 Buscar película", "🎞️ Estrenos", "✨ Recomiéndame", "📰 Noticias", "📌 Pedir película", "📋 Ver catálogo"]
+SEARCH_QUERIES = ["matrix", "el padrino", "interstellar", "coco", "titanic", "avatar", "joker", "dune", "alien", "up"]
+CALLBACK_TEMPLATES = [
+    "estrenos_page:{page}", "recomendar_page:{page}", "genre:28", "genre:35", "genre_page:28:{page}",
+    "request_movie_by_id:{movie}", "catalog_page:0",
+]
+# Peso de cada tipo de escenario en el modo sintético
+SCENARIO_WEIGHTS = {"start": 15, "menu": 35, "search": 20, "callback": 30}
+
+
+class SyntheticUpdates:
+    """Genera escenarios por usuario; una búsqueda son dos updates (botón + texto) en orden."""
+
+    def __init__(self, seed, users, admin_id):
+        self.rng = random.Random(seed)
+        self.users = users
+        self.admin_id = admin_id
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+
+    def _user(self, user_id):
+        return {"id": user_id, "is_bot": False, "first_name": "Usuario", "language_code": "es"}
+
+    def _message(self, user_id, text):
+        return {
+            "update_id": next(self.update_ids),
+            "message": {
+                "message_id": next(self.message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": self._user(user_id),
+                "text": text,
+                **({"entities": [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]} if text.startswith("/") else {}),
+            },
+        }
+
+    def _callback(self, user_id, data):
+        return {
+            "update_id": next(self.update_ids),
+            "callback_query": {
+                "id": str(next(self.update_ids)),
+                "from": self._user(user_id),
+                "chat_instance": "load",
+                "data": data,
+                "message": {
+                    "message_id": next(self.message_ids),
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "menú",
+                },
+            },
+        }
+
+    def scenario(self):
+        kind = self.rng.choices(list(SCENARIO_WEIGHTS), weights=SCENARIO_WEIGHTS.values())[0]
+        user_id = 10_000 + self.rng.randrange(self.users)
+        if kind == "start":
+            return [self._message(user_id, "/start")]
+        if kind == "menu":
+            text = self.rng.choice(MENU_TEXTS)
+            if text == "📋 Ver catálogo" and self.admin_id:
+                user_id = self.admin_id
+            return [self._message(user_id, text)]
+        if kind == "search":
+            return [self._callback(user_id, "search_by_name"), self._message(user_id, self.rng.choice(SEARCH_QUERIES))]
+        data = self.rng.choice(CALLBACK_TEMPLATES).format(page=self.rng.randint(1, 5), movie=self.rng.randint(1, 50_000))
+        return [self._callback(user_id, data)]
+
+    def updates(self, count):
+        """Devuelve (user_id, update, offset) con offset None: el ritmo lo marca --rate."""
+        produced = 0
+        while produced < count:
+            for update in self.scenario():
+                yield user_of(update), update, None
+                produced += 1
+
+
+def user_of(update):
+    for key in ("message", "callback_query", "inline_query", "edited_message"):
+        if key in update:
+            return update[key].get("from", {}).get("id") or update[key].get("chat", {}).get("id")
+    return None
+
+
+def replace_id(node, old, new):
+    if isinstance(node, dict):
+        return {k: replace_id(v, old, new) for k, v in node.items()}
+    if isinstance(node, list):
+        return [replace_id(v, old, new) for v in node]
+    if node == old and isinstance(node, int):
+        return new
+    if isinstance(node, str):
+        return node.replace(str(old), str(new))
+    return node
+
+
+def replay_updates(path, admin_id, loop_forever=False):
+    """Lee un JSONL de UPDATE_RECORD_PATH. El offset conserva la cadencia original."""
+    records = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                records.append(json.loads(line))
+    if not records:
+        raise SystemExit(f"{path} no contiene updates.")
+    # Cada worker vuelca sus updates por lotes: se reordenan por hora de llegada
+    records.sort(key=lambda record: record.get("t", 0))
+    first = records[0].get("t", 0)
+    lap_length = records[-1].get("t", first) - first + 1.0
+    update_ids = itertools.count(1)
+    for lap in itertools.count():
+        for record in records:
+            update = record["update"]
+            if admin_id and record.get("admin_id"):
+                update = replace_id(update, record["admin_id"], admin_id)
+            update = dict(update, update_id=next(update_ids))
+            yield user_of(update), update, record.get("t", first) - first + lap * lap_length
+        if not loop_forever:
+            return
+
+
+def parse_metrics(text):
+    """Suma los valores de /metrics por nombre de métrica y por (nombre, etiquetas)."""
+    totals = collections.Counter()
+    for line in text.splitlines():
+        if not line or line.startswith("#"):
+            continue
+        name_and_labels, _, value = line.rpartition(" ")
+        name, _, labels = name_and_labels.partition("{")
+        try:
+            number = float(value)
+        except ValueError:
+            continue
+        totals[name] += number
+        if labels:
+            totals[f"{name}{{{labels}"] += number
+    return totals
+
+
+class LoadRunner:
+    def __init__(self, base_url, concurrency, metrics_token=None, extra_counters=None):
+        self.base_url = base_url.rstrip("/")
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.metrics_token = metrics_token
+        self.extra_counters = extra_counters
+        self.user_locks = collections.defaultdict(asyncio.Lock)
+        self.latencies = []
+        self.transport_errors = 0
+        self.sent = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def scrape(self, session):
+        headers = {"Authorization": f"Bearer {self.metrics_token}"} if self.metrics_token else {}
+        try:
+            async with session.get(f"{self.base_url}/metrics", headers=headers) as response:
+                metrics = parse_metrics(await response.text()) if response.status == 200 else collections.Counter()
+        except aiohttp.ClientError:
+            metrics = collections.Counter()
+        if self.extra_counters:
+            metrics.update(self.extra_counters())
+        return metrics
+
+    async def send(self, session, user_id, update, scheduled_at):
+        # El lock por usuario mantiene el orden de sus updates (p. ej. botón de búsqueda + texto)
+        async with self.user_locks[user_id]:
+            async with self.semaphore:
+                self.in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+                try:
+                    async with session.post(f"{self.base_url}/webhook", json=update) as response:
+                        await response.read()
+                        if response.status != 200:
+                            self.transport_errors += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    self.transport_errors += 1
+                finally:
+                    self.in_flight -= 1
+                    self.sent += 1
+                    self.latencies.append(time.perf_counter() - scheduled_at)
+
+    async def run(self, updates, rate, speed, duration):
+        timeout = aiohttp.ClientTimeout(total=60)
+        connector = aiohttp.TCPConnector(limit=0)
+        async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+            before = await self.scrape(session)
+            started = time.perf_counter()
+            tasks = []
+            closed_loop = None
+            for index, (user_id, update, offset) in enumerate(updates):
+                if rate:
+                    scheduled_at = started + index / rate
+                elif offset is not None and speed:
+                    scheduled_at = started + offset / speed
+                else:
+                    closed_loop = closed_loop or asyncio.Semaphore(self.concurrency)
+                    scheduled_at = time.perf_counter()
+                if duration and scheduled_at - started >= duration:
+                    break
+                delay = scheduled_at - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                if closed_loop:
+                    # Sin ritmo fijo: lazo cerrado, nunca más de `concurrency` updates pendientes
+                    await closed_loop.acquire()
+                    scheduled_at = time.perf_counter()
+                task = asyncio.create_task(self.send(session, user_id, update, scheduled_at))
+                if closed_loop:
+                    task.add_done_callback(lambda _: closed_loop.release())
+                tasks.append(task)
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - started
+            after = await self.scrape(session)
+        return self.report(before, after, elapsed)
+
+    def report(self, before, after, elapsed):
+        delta = collections.Counter({key: after[key] - before.get(key, 0) for key in after})
+        sent = max(self.sent, 1)
+        ordered = sorted(self.latencies)
+
+        def pct(fraction):
+            return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000 if ordered else 0.0
+
+        handler_errors = delta.get("bot_handler_errors_total", 0)
+        amplification = {
+            "telegram": delta.get("bot_telegram_request_duration_seconds_count", 0) / sent,
+            "mongo": (delta.get("bot_mongo_command_duration_seconds_count", 0) + delta.get("fake_mongo_operations", 0)) / sent,
+        }
+        for key, value in delta.items():
+            if key.startswith("bot_external_request_duration_seconds_count{") and value:
+                service = key.split('service="', 1)[1].split('"', 1)[0]
+                amplification[service] = value / sent
+        return {
+            "updates": self.sent,
+            "elapsed_s": elapsed,
+            "throughput_per_s": self.sent / elapsed if elapsed else 0.0,
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "p99_ms": pct(0.99),
+            "max_ms": ordered[-1] * 1000 if ordered else 0.0,
+            "max_in_flight": self.max_in_flight,
+            "transport_errors": self.transport_errors,
+            "handler_errors": handler_errors,
+            "error_rate": (self.transport_errors + handler_errors) / sent,
+            "calls_per_update": {key: round(value, 3) for key, value in amplification.items()},
+            "updates_by_type": {
+                key.split('type="', 1)[1].split('"', 1)[0]: int(value)
+                for key, value in delta.items() if key.startswith("bot_updates_total{") and value
+            },
+        }
+
+
+def print_report(report):
+    print(f"updates enviados:   {report['updates']} en {report['elapsed_s']:.1f}s ({report['throughput_per_s']:.1f}/s)")
+    print(f"latencia ms:        p50={report['p50_ms']:.1f}  p95={report['p95_ms']:.1f}  p99={report['p99_ms']:.1f}  max={report['max_ms']:.1f}")
+    print(f"en vuelo (máx):     {report['max_in_flight']}")
+    print(f"errores:            {report['transport_errors']} HTTP + {int(report['handler_errors'])} en handlers ({report['error_rate']:.2%})")
+    calls = ", ".join(f"{key}={value:.2f}" for key, value in sorted(report["calls_per_update"].items()))
+    print(f"llamadas/update:    {calls}")
+    if report["updates_by_type"]:
+        print(f"por tipo:           {report['updates_by_type']}")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def start_local_bot(args):
+    """Servicios falsos + bot.py con Mongo en memoria, sirviendo el webhook en un puerto libre."""
+    from benchmarks.fake_mongo import FakeMongoClient
+    from benchmarks.fakes import environment_for, start_fakes
+
+    services = await start_fakes(latency=args.upstream_latency, telegram_latency=args.telegram_latency)
+    port = free_port()
+    os.environ.update(environment_for(services))
+    os.environ.update({"PORT": str(port), "PUBLIC_FORWARD_DELAY_SECONDS": "0", "ADMIN_ID": str(args.admin_id)})
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:loadtest")
+    # Pocos usuarios sintéticos con muchas peticiones: el limitador por usuario descartaría casi toda la carga
+    os.environ.setdefault("THROTTLE_RATE", "0")
+    for key in ("TMDB_API_KEY", "TRAKT_CLIENT_ID", "NEWS_API_KEY"):
+        os.environ.setdefault(key, "loadtest")
+    os.environ.pop("RENDER_EXTERNAL_URL", None)
+    os.environ.pop("METRICS_TOKEN", None)
+
+    bot_module = importlib.import_module("bot")
+    logging.getLogger().setLevel(args.log_level)
+    mongo = FakeMongoClient(latency=args.mongo_latency)
+    bot_module.mongo_client = mongo
+    runner = await bot_module.start_webhook_server()
+
+    async def stop():
+        await runner.cleanup()
+        await bot_module.update_recorder.close()
+        await bot_module.bot.session.close()
+        if bot_module.shared_http_session is not None and not bot_module.shared_http_session.closed:
+            await bot_module.shared_http_session.close()
+        for service in services.values():
+            await service.stop()
+
+    def extra_counters():
+        # El Mongo en memoria no pasa por el CommandListener de motor: se cuenta aparte
+        return {"fake_mongo_operations": mongo["movies_database"].operations}
+
+    return f"http://127.0.0.1:{port}", stop, extra_counters
+
+
+async def main(args):
+    stop, extra_counters = None, None
+    base_url = args.url
+    if args.local:
+        base_url, stop, extra_counters = await start_local_bot(args)
+
+    count = args.count if args.count else (10**9 if args.duration else 1000)
+    if args.mode == "replay":
+        source = replay_updates(args.replay, args.admin_id, loop_forever=bool(args.duration))
+        updates = itertools.islice(source, count)
+    else:
+        updates = SyntheticUpdates(args.seed, args.users, args.admin_id).updates(count)
+
+    runner = LoadRunner(base_url, args.concurrency, args.metrics_token, extra_counters)
+    try:
+        report = await runner.run(updates, args.rate, args.speed, args.duration)
+    finally:
+        if stop:
+            await stop()
+
+    report.update({"mode": args.mode, "rate": args.rate, "concurrency": args.concurrency, "seed": args.seed})
+    print_report(report)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Pruebas de carga del webhook con updates sintéticos o grabados.")
+    parser.add_argument("--url", default="http://127.0.0.1:8080", help="URL base de la instancia (sin /webhook)")
+    parser.add_argument("--local", action="store_true", help="Arranca servicios falsos y el bot en este proceso")
+    parser.add_argument("--mode", choices=("synthetic", "replay"), default="synthetic")
+    parser.add_argument("--replay", help="JSONL grabado con UPDATE_RECORD_PATH")
+    parser.add_argument("--rate", type=float, default=0.0, help="Updates por segundo (0 = lazo cerrado / cadencia grabada)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Multiplicador de la cadencia grabada en modo replay")
+    parser.add_argument("--concurrency", type=int, default=50, help="Máximo de peticiones en vuelo")
+    parser.add_argument("--count", type=int, default=0, help="Número de updates a enviar")
+    parser.add_argument("--duration", type=float, default=0.0, help="Duración máxima en segundos")
+    parser.add_argument("--users", type=int, default=500, help="Usuarios distintos en el modo sintético")
+    parser.add_argument("--admin-id", type=int, default=1, help="ID de administrador de la instancia objetivo")
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--metrics-token", default=os.getenv("METRICS_TOKEN"))
+    parser.add_argument("--upstream-latency", type=float, default=0.0, help="Solo --local: latencia de TMDB/Trakt/etc. (s)")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="Solo --local: latencia de la Bot API (s)")
+    parser.add_argument("--mongo-latency", type=float, default=0.0, help="Solo --local: latencia por operación de Mongo (s)")
+    parser.add_argument("--json", help="Guarda el informe en este fichero JSON")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+    if args.mode == "replay" and not args.replay:
+        parser.error("--mode replay necesita --replay FICHERO")
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,266 @@
+"""
+Suite de benchmarks offline del bot.
+
+Arranca TMDB, Trakt, NewsAPI, Reddit y la Bot API de Telegram como servicios falsos locales,
+sustituye MongoDB por un almacén en memoria y hace pasar Updates sintéticos por el Dispatcher
+real de bot.py. No necesita red ni credenciales.
+
+Uso (desde la raíz del repositorio):
+
+    python -m benchmarks.run_benchmarks
+    python -m benchmarks.run_benchmarks --iterations 500 --concurrency 20 --flows search,request
+    python -m benchmarks.run_benchmarks --upstream-latency 0.02 --json resultados.json
+
+Por cada flujo se informa la latencia (media, p50, p95), las operaciones por segundo y el
+número de llamadas salientes (TMDB, Telegram, Mongo...) por operación.
+"""
+import argparse
+import asyncio
+import datetime
+import importlib
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import time
+
+from benchmarks.fake_mongo import FakeMongoClient
+from benchmarks.fakes import environment_for, fake_movie, start_fakes
+
+ADMIN_USER_ID = 1
+CATALOG_SIZE = 300
+FLOWS = ("search", "request", "publish", "catalog", "cleanup")
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class BenchmarkContext:
+    def __init__(self, bot_module, services, mongo, rng):
+        self.bot_module = bot_module
+        self.services = services
+        self.mongo = mongo
+        self.rng = rng
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.user_ids = itertools.count(1000)
+
+    @property
+    def movies(self):
+        return self.mongo["movies_database"]["movies_collection"]
+
+    def outbound_snapshot(self):
+        snapshot = {name: service.total_requests for name, service in self.services.items()}
+        snapshot["mongo"] = self.mongo["movies_database"].operations
+        return snapshot
+
+    def user(self, user_id):
+        types = self.bot_module.types
+        return types.User(id=user_id, is_bot=False, first_name=f"Usuario {user_id}", username=f"user{user_id}")
+
+    def message_update(self, user_id, text):
+        types = self.bot_module.types
+        message = types.Message(
+            message_id=next(self.message_ids),
+            date=datetime.datetime.now(),
+            chat=types.Chat(id=user_id, type="private"),
+            from_user=self.user(user_id),
+            text=text,
+        )
+        return types.Update(update_id=next(self.update_ids), message=message)
+
+    def callback_update(self, user_id, data):
+        types = self.bot_module.types
+        message = types.Message(
+            message_id=next(self.message_ids),
+            date=datetime.datetime.now(),
+            chat=types.Chat(id=user_id, type="private"),
+            text="menú",
+        )
+        callback_query = types.CallbackQuery(
+            id=str(next(self.update_ids)),
+            from_user=self.user(user_id),
+            chat_instance="bench",
+            message=message,
+            data=data,
+        )
+        return types.Update(update_id=next(self.update_ids), callback_query=callback_query)
+
+    async def feed(self, update):
+        await self.bot_module.dp.feed_update(self.bot_module.bot, update)
+
+
+async def seed_catalog(context, size):
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for movie_id in range(1, size + 1):
+        movie = fake_movie(movie_id)
+        movie.update({
+            "link": f"https://example.com/ver/{movie_id}",
+            "added_at": (now - datetime.timedelta(minutes=movie_id)).isoformat(),
+            "last_message_id": movie_id,
+            "last_message_id_public": movie_id,
+            "last_posted_at": now.isoformat(),
+        })
+        await context.movies.insert_one(movie)
+
+
+# --- Flujos ---
+
+async def flow_search(context, iteration):
+    user_id = next(context.user_ids)
+    bot_module = context.bot_module
+    state = bot_module.dp.fsm.get_context(bot=bot_module.bot, chat_id=user_id, user_id=user_id)
+    await state.set_state(bot_module.MovieRequestStates.waiting_for_search_query)
+    await context.feed(context.message_update(user_id, f"matrix {iteration % 50}"))
+
+
+async def flow_request(context, iteration):
+    user_id = next(context.user_ids)
+    tmdb_id = CATALOG_SIZE + 1 + context.rng.randrange(10_000)
+    await context.feed(context.callback_update(user_id, context.bot_module.callback_data("request_movie", tmdb_id, user_id)))
+
+
+async def flow_publish(context, iteration):
+    tmdb_id = context.rng.randint(1, CATALOG_SIZE)
+    await context.feed(context.callback_update(ADMIN_USER_ID, context.bot_module.callback_data("publish_now_admin", tmdb_id)))
+
+
+async def flow_catalog(context, iteration):
+    await context.feed(context.callback_update(ADMIN_USER_ID, context.bot_module.callback_data("catalog_page", 0)))
+
+
+async def prepare_cleanup(context):
+    # Cada pasada encuentra 25 posts caducados dentro del catálogo completo
+    stale = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=3)).isoformat()
+    for movie_id in context.rng.sample(range(1, CATALOG_SIZE + 1), 25):
+        context.movies._find_first({"id": movie_id}).update({
+            "last_message_id": movie_id,
+            "last_message_id_public": movie_id,
+            "last_posted_at": stale,
+        })
+
+
+async def flow_cleanup(context, iteration):
+    await context.bot_module.cleanup_old_movie_posts(context.movies, 2)
+
+
+FLOW_FUNCTIONS = {
+    "search": (flow_search, None),
+    "request": (flow_request, None),
+    "publish": (flow_publish, None),
+    "catalog": (flow_catalog, None),
+    "cleanup": (flow_cleanup, prepare_cleanup),
+}
+
+
+async def run_flow(context, name, iterations, concurrency, warmup):
+    flow, prepare = FLOW_FUNCTIONS[name]
+    for iteration in range(warmup):
+        if prepare:
+            await prepare(context)
+        await flow(context, iteration)
+
+    samples = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def timed(iteration):
+        async with semaphore:
+            if prepare:
+                await prepare(context)
+            started = time.perf_counter()
+            await flow(context, iteration)
+            samples.append(time.perf_counter() - started)
+
+    before = context.outbound_snapshot()
+    started = time.perf_counter()
+    await asyncio.gather(*(timed(i) for i in range(iterations)))
+    elapsed = time.perf_counter() - started
+    after = context.outbound_snapshot()
+
+    return {
+        "flow": name,
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "mean_ms": statistics.fmean(samples) * 1000,
+        "p50_ms": percentile(samples, 0.50) * 1000,
+        "p95_ms": percentile(samples, 0.95) * 1000,
+        "ops_per_second": iterations / elapsed if elapsed else 0.0,
+        "calls_per_op": {key: (after[key] - before[key]) / iterations for key in after if after[key] != before[key]},
+    }
+
+
+def print_results(results):
+    print(f"{'flujo':<10}{'n':>7}{'media ms':>11}{'p50 ms':>10}{'p95 ms':>10}{'ops/s':>10}  llamadas por op")
+    for result in results:
+        calls = ", ".join(f"{key}={value:.1f}" for key, value in sorted(result["calls_per_op"].items()))
+        print(
+            f"{result['flow']:<10}{result['iterations']:>7}{result['mean_ms']:>11.2f}{result['p50_ms']:>10.2f}"
+            f"{result['p95_ms']:>10.2f}{result['ops_per_second']:>10.1f}  {calls}"
+        )
+
+
+async def main(args):
+    random.seed(args.seed)
+    services = await start_fakes(latency=args.upstream_latency, telegram_latency=args.telegram_latency)
+    os.environ.update(environment_for(services))
+    os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123456:benchmark")
+    os.environ["ADMIN_ID"] = str(ADMIN_USER_ID)
+    os.environ["PUBLIC_FORWARD_DELAY_SECONDS"] = "0"
+    for key in ("TMDB_API_KEY", "TRAKT_CLIENT_ID", "NEWS_API_KEY"):
+        os.environ.setdefault(key, "benchmark")
+
+    bot_module = importlib.import_module("bot")
+    logging.getLogger().setLevel(args.log_level)
+    mongo = FakeMongoClient(latency=args.mongo_latency)
+    bot_module.mongo_client = mongo
+
+    context = BenchmarkContext(bot_module, services, mongo, random.Random(args.seed))
+    await seed_catalog(context, CATALOG_SIZE)
+
+    results = []
+    try:
+        for name in args.flows:
+            results.append(await run_flow(context, name, args.iterations, args.concurrency, args.warmup))
+    finally:
+        await bot_module.bot.session.close()
+        session = bot_module.shared_http_session
+        if session is not None and not session.closed:
+            await session.close()
+        for service in services.values():
+            await service.stop()
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"seed": args.seed, "results": results}, f, indent=2)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks offline de los flujos principales del bot.")
+    parser.add_argument("--flows", default=",".join(FLOWS), type=lambda value: [f for f in value.split(",") if f])
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=1234)
+    parser.add_argument("--upstream-latency", type=float, default=0.0, help="Latencia simulada de TMDB/Trakt/NewsAPI/Reddit (s)")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="Latencia simulada de la Bot API (s)")
+    parser.add_argument("--mongo-latency", type=float, default=0.0, help="Latencia simulada por operación de Mongo (s)")
+    parser.add_argument("--json", help="Guarda los resultados en este fichero JSON")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+    unknown = set(args.flows) - set(FLOWS)
+    if unknown:
+        parser.error(f"Flujos desconocidos: {', '.join(sorted(unknown))}")
+    return args
+
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
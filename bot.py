@@ -1,2066 +1,5659 @@
-import asyncio
-import logging
-import re
-import os
-import random
-from collections import deque
-import datetime
-import aiohttp
-import motor.motor_asyncio
-from aiogram import Bot, Dispatcher, types, F, html
-from aiogram.enums import ParseMode
-from aiogram.filters import Command
-from aiogram.client.default import DefaultBotProperties
-from aiogram.fsm.context import FSMContext
-from aiogram.fsm.state import State, StatesGroup
-from aiohttp import web
-from aiogram.types import Update, InputMediaPhoto
-from bs4 import BeautifulSoup
-import lxml
-
-# --- VARIABLES DE ENTORNO ---
-TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
-TMDB_API_KEY = os.getenv("TMDB_API_KEY")
-TRAKT_CLIENT_ID = os.getenv("TRAKT_CLIENT_ID")
-TRAKT_CLIENT_SECRET = os.getenv("TRAKT_CLIENT_SECRET")
-ADMIN_ID = os.getenv("ADMIN_ID")
-DATABASE_URL = os.getenv("DATABASE_URL")
-NEWS_API_KEY = os.getenv("NEWS_API_KEY")
-# ----------------------------------------
-
-# Canal ID
-TELEGRAM_MAIN_CHANNEL_ID = -1002240787394
-TELEGRAM_PUBLIC_CHANNEL_ID = -1001945286271
-
-BASE_TMDB_URL = "https://api.themoviedb.org/3"
-POSTER_BASE_URL = "https://image.tmdb.org/t/p/w500"
-TRAKT_BASE_URL = "https://api.trakt.tv"
-WELCOME_IMAGE_URL = "https://i.imgur.com/DJSUzQh.jpeg"
-
-# Enlace de invitación del canal principal
-MAIN_CHANNEL_INVITE_LINK = "https://t.me/click_para_ver"
-MAIN_CHANNEL_USERNAME = "click_para_ver"
-
-# Storage for scheduled posts and recent posts
-scheduled_posts = asyncio.Queue()
-recent_posts = deque(maxlen=20)
-user_requests = {}
-admin_data = {}
-user_message_ids = {}
-ongoing_tasks = {}
-daily_requests = {}
-REQUEST_LIMIT = 3
-USER_REQUEST_LIMIT = 5
-user_daily_requests = {}
-
-# Géneros de TMDB
-GENRES = {
-    "Acción": 28, "Aventura": 12, "Animación": 16, "Comedia": 35, "Crimen": 80,
-    "Documental": 99, "Drama": 18, "Familia": 10751, "Fantasía": 14, "Historia": 36,
-    "Terror": 27, "Música": 10402, "Misterio": 9648, "Romance": 10749, "Ciencia ficción": 878,
-    "Película de TV": 10770, "Suspense": 53, "Guerra": 10752, "Western": 37
-}
-
-# Logging configuration
-logging.basicConfig(level=logging.INFO)
-
-# Bot, dispatcher, and database initialization
-bot = Bot(token=TELEGRAM_BOT_TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
-dp = Dispatcher()
-
-AUTO_POST_COUNT = 8 # Valor por defecto
-NEWS_POST_COUNT = 4 # Variable para controlar la cantidad de noticias por día
-
-MOVIES_PER_PAGE = 5
-SEARCH_RESULTS_PER_PAGE = 5
-RECOMENDACIONES_PER_PAGE = 5
-ESTRENOS_PER_PAGE = 5
-
-# New states for the state machine
-class MovieUploadStates(StatesGroup):
-    waiting_for_movie_info = State()
-    waiting_for_requested_movie_link = State()
-    waiting_for_admin_movie_name = State()
-    waiting_for_admin_movie_link = State()
-
-class MovieRequestStates(StatesGroup):
-    waiting_for_movie_name = State()
-    waiting_for_actor_name = State()
-    waiting_for_confirmation = State()
-    waiting_for_search_query = State()
-    waiting_for_movie_name_to_request = State()
-
-class AdminStates(StatesGroup):
-    waiting_for_auto_post_count = State()
-    waiting_for_manual_movie_info = State()
-    waiting_for_edit_movie_info = State()
-    waiting_for_catalog_search_query = State()
-    waiting_for_news_post_count = State() # NUEVO ESTADO PARA NOTICIAS
-
-
-class SupportStates(StatesGroup):
-    waiting_for_support_message = State()
-
-# --- Funciones de Base de Datos (Motor - Asíncrono) ---
-
-def get_mongo_db_collection():
-    try:
-        connection_string = os.getenv("DATABASE_URL")
-        if not connection_string:
-            logging.error("DATABASE_URL no está configurada. No se puede conectar a la base de datos.")
-            return None
-
-        client = motor.motor_asyncio.AsyncIOMotorClient(connection_string)
-        db = client["movies_database"]
-        collection = db["movies_collection"]
-        return collection
-    except Exception as e:
-        logging.error(f"Error al conectar con MongoDB: {e}")
-        return None
-
-async def save_movie_to_db(movie_data):
-    collection = get_mongo_db_collection()
-    if collection is None:
-        return
-
-    try:
-        movie_id = movie_data.get("id")
-        
-        await collection.update_one(
-            {"id": movie_id},
-            {"$set": movie_data},
-            upsert=True
-        )
-        logging.info(f"Película '{movie_data.get('title')}' guardada/actualizada en MongoDB.")
-    except Exception as e:
-        logging.error(f"Error al guardar la película en MongoDB: {e}")
-
-async def get_movie_by_tmdb_id(tmdb_id):
-    collection = get_mongo_db_collection()
-    if collection is None:
-        return None
-
-    try:
-        movie_document = await collection.find_one({"id": tmdb_id})
-        return movie_document
-    except Exception as e:
-        logging.error(f"Error al obtener la película de MongoDB: {e}")
-        return None
-
-async def find_movie_in_db_by_name(title_to_find):
-    collection = get_mongo_db_collection()
-    if collection is None:
-        return None
-
-    try:
-        movie_document = await collection.find_one({
-            "$or": [
-                {"title": {"$regex": title_to_find, "$options": "i"}},
-                {"names": {"$regex": title_to_find, "$options": "i"}}
-            ]
-        })
-        return movie_document
-    except Exception as e:
-        logging.error(f"Error al buscar película por nombre en MongoDB: {e}")
-        return None
-
-async def get_all_movies():
-    collection = get_mongo_db_collection()
-    if collection is None:
-        return []
-    
-    try:
-        movies_list = await collection.find({}).sort("added_at", -1).to_list(None)
-        return movies_list
-    except Exception as e:
-        logging.error(f"Error al obtener todas las películas de MongoDB: {e}")
-        return []
-
-async def delete_movie_from_db(movie_id):
-    collection = get_mongo_db_collection()
-    if collection is None:
-        return
-
-    try:
-        await collection.delete_one({"id": movie_id})
-        logging.info(f"Película con ID {movie_id} eliminada de MongoDB.")
-    except Exception as e:
-        logging.error(f"Error al eliminar la película de MongoDB: {e}")
-
-
-# --- Funciones de TMDB y Trakt (aiohttp - Asíncrono) ---
-
-async def get_movie_results_by_title(title, page=1):
-    url = f"{BASE_TMDB_URL}/search/movie"
-    params = {"api_key": TMDB_API_KEY, "query": title, "language": "es-ES", "page": page}
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as response:
-                response.raise_for_status()
-                data = await response.json()
-                return data.get("results", []), data.get("total_pages", 1)
-    except aiohttp.ClientError as e:
-        logging.error(f"Error al buscar película en TMDB por título: {e}")
-        return [], 1
-
-async def get_movie_details(movie_id):
-    url = f"{BASE_TMDB_URL}/movie/{movie_id}"
-    params = {"api_key": TMDB_API_KEY, "language": "es-ES"}
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as response:
-                response.raise_for_status()
-                return await response.json()
-    except aiohttp.ClientError as e:
-        logging.error(f"Error al conectar con la API de TMDB: {e}")
-        return None
-
-async def get_popular_movies(page=1):
-    url = f"{BASE_TMDB_URL}/movie/popular"
-    params = {"api_key": TMDB_API_KEY, "language": "es-ES", "page": page}
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as response:
-                response.raise_for_status()
-                data = await response.json()
-                return data.get("results", []), data.get("total_pages", 1)
-    except aiohttp.ClientError as e:
-        logging.error(f"Error al obtener películas populares de TMDB: {e}")
-        return [], 1
-
-async def get_movies_by_genre(genre_id, page=1):
-    url = f"{BASE_TMDB_URL}/discover/movie"
-    params = {"api_key": TMDB_API_KEY, "language": "es-ES", "with_genres": genre_id, "sort_by": "popularity.desc", "page": page}
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as response:
-                response.raise_for_status()
-                data = await response.json()
-                return data.get("results", []), data.get("total_pages", 1)
-    except aiohttp.ClientError as e:
-        logging.error(f"Error al buscar películas por género: {e}")
-        return [], 1
-
-async def get_upcoming_movies(page=1):
-    url = f"{BASE_TMDB_URL}/discover/movie"
-    current_year = datetime.datetime.now().year
-    params = {
-        "api_key": TMDB_API_KEY,
-        "language": "es-ES",
-        "sort_by": "popularity.desc",
-        "primary_release_date.gte": f"{current_year}-01-01",
-        "vote_count.gte": 50,
-        "page": page,
-    }
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as response:
-                response.raise_for_status()
-                data = await response.json()
-                return data.get("results", []), data.get("total_pages", 1)
-    except aiohttp.ClientError as e:
-        logging.error(f"Error al obtener próximos estrenos de TMDB: {e}")
-        return [], 1
-
-async def get_movies_by_actor(actor_name):
-    url = f"{BASE_TMDB_URL}/search/person"
-    params = {"api_key": TMDB_API_KEY, "query": actor_name, "language": "es-ES"}
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as response:
-                response.raise_for_status()
-                actor = (await response.json()).get("results")[0] if (await response.json()).get("results") else None
-                if not actor:
-                    return [], 1
-                
-                person_id = actor.get("id")
-                url = f"{BASE_TMDB_URL}/person/{person_id}/movie_credits"
-                params = {"api_key": TMDB_API_KEY, "language": "es-ES"}
-                async with session.get(url, params=params) as response:
-                    response.raise_for_status()
-                    movies = sorted((await response.json()).get("cast", []), key=lambda x: x.get("popularity", 0), reverse=True)
-                    total_pages = (len(movies) + SEARCH_RESULTS_PER_PAGE - 1) // SEARCH_RESULTS_PER_PAGE
-                    return movies, total_pages
-    except aiohttp.ClientError as e:
-        logging.error(f"Error al buscar películas por actor: {e}")
-        return [], 1
-
-async def trakt_api_search_movie(title):
-    headers = {
-        "Content-Type": "application/json",
-        "trakt-api-version": "2",
-        "trakt-api-key": TRAKT_CLIENT_ID
-    }
-    url = f"{TRAKT_BASE_URL}/search/movie"
-    params = {"query": title}
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers, params=params) as response:
-                response.raise_for_status()
-                results = await response.json()
-                if results:
-                    for result in results:
-                        tmdb_id = result.get("movie", {}).get("ids", {}).get("tmdb")
-                        if tmdb_id:
-                            return tmdb_id
-                return None
-    except aiohttp.ClientError as e:
-        logging.error(f"Error al buscar película en Trakt.tv: {e}")
-        return None
-
-# --- NUEVAS FUNCIONES PARA NOTICIAS Y MEMES ---
-async def get_latest_news():
-    url = "https://newsapi.org/v2/everything"
-    params = {
-        "q": "cine",
-        "sortBy": "publishedAt",
-        "language": "es",
-        "apiKey": NEWS_API_KEY,
-        "pageSize": 5,
-    }
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, params=params) as response:
-                response.raise_for_status()
-                data = await response.json()
-                return data.get("articles", [])
-    except aiohttp.ClientError as e:
-        logging.error(f"Error al obtener noticias de NewsAPI: {e}")
-        return []
-
-async def get_random_meme():
-    url = "https://www.reddit.com/r/memesenespanol/.json?limit=50"
-    headers = {"User-Agent": "MyBot/0.1"}
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, headers=headers) as response:
-                response.raise_for_status()
-                data = await response.json()
-                posts = data['data']['children']
-                image_posts = [p for p in posts if p['data'].get('url_overridden_by_dest') and p['data']['url_overridden_by_dest'].endswith(('.jpg', '.png'))]
-                if image_posts:
-                    random_post = random.choice(image_posts)
-                    meme_url = random_post['data']['url_overridden_by_dest']
-                    meme_caption = random_post['data']['title']
-                    return meme_url, meme_caption
-    except aiohttp.ClientError as e:
-        logging.error(f"Error al hacer scraping de memes: {e}")
-    except KeyError:
-        logging.error("Error al procesar la respuesta de Reddit.")
-    return None, "¡Aquí tienes un meme divertido!"
-
-
-def get_movie_poster_url(poster_path):
-    if poster_path:
-        return f"{POSTER_BASE_URL}{poster_path}"
-    return None
-
-def create_movie_message(movie_data, movie_link=None, from_channel=False):
-    title = movie_data.get("title", "Título no disponible")
-    overview = movie_data.get("overview", "Sinopsis no disponible")
-    release_date = movie_data.get("release_date", "Fecha no disponible")
-    vote_average = movie_data.get("vote_average", 0)
-    poster_path = movie_data.get("poster_path")
-
-    if not overview.strip():
-        overview = "Sinopsis no disponible."
-    
-    if len(overview) > 250:
-        overview = overview[:250] + "..."
-
-    text = (
-        f"<b>🎬 {title}</b>\n\n"
-        f"<i>Sinopsis:</i> {overview}\n\n"
-        f"📅 <b>Fecha de estreno:</b> {release_date}\n"
-        f"⭐ <b>Puntuación:</b> {vote_average:.1f}/10"
-    )
-
-    if from_channel:
-        post_keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(text="🎬 Ver ahora", url=movie_link)],
-            [types.InlineKeyboardButton(text="✨ Pedir otra película", url="https://t.me/sdmin_dy_bot?start=request")]
-        ])
-    elif movie_link:
-        post_keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(text="🎬 Ver ahora", url=movie_link)],
-            [types.InlineKeyboardButton(text="📽️ Pedir otra película", url="https://t.me/sdmin_dy_bot?start=request")]
-        ])
-    else:
-        post_keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(text="🎬 ¿Quieres pedir una película? Pídela aquí 👇", url="https://t.me/sdmin_dy_bot?start=request")]
-        ])
-
-    poster_url = f"{POSTER_BASE_URL}{poster_path}" if poster_path and not poster_path.startswith("http") else poster_path
-
-    return text, poster_url, post_keyboard
-
-# --- Functions for managing messages on the channel
-async def delete_old_post(movie_id_tmdb):
-    movie_data = await get_movie_by_tmdb_id(movie_id_tmdb)
-    if movie_data:
-        old_message_id_main = movie_data.get("last_message_id")
-        old_message_id_public = movie_data.get("last_message_id_public")
-        
-        # Eliminar del canal principal
-        if old_message_id_main is not None:
-            try:
-                await bot.delete_message(chat_id=TELEGRAM_MAIN_CHANNEL_ID, message_id=int(old_message_id_main))
-                logging.info(f"Mensaje {old_message_id_main} eliminado del canal principal.")
-            except Exception as e:
-                logging.error(f"Error al intentar borrar el mensaje {old_message_id_main} del canal principal: {e}")
-        
-        # Eliminar del canal público
-        if old_message_id_public is not None:
-            try:
-                await bot.delete_message(chat_id=TELEGRAM_PUBLIC_CHANNEL_ID, message_id=int(old_message_id_public))
-                logging.info(f"Mensaje {old_message_id_public} eliminado del canal público.")
-            except Exception as e:
-                logging.error(f"Error al intentar borrar el mensaje {old_message_id_public} del canal público: {e}")
-
-
-async def forward_post_to_public_channel(original_message: types.Message, movie_data):
-    if not TELEGRAM_PUBLIC_CHANNEL_ID:
-        logging.warning("TELEGRAM_PUBLIC_CHANNEL_ID no está configurado. No se puede reenviar el post.")
-        return
-
-    try:
-        # Enlace al post específico en el canal principal usando el nombre de usuario
-        post_link = f"https://t.me/{MAIN_CHANNEL_USERNAME}/{original_message.message_id}"
-        
-        # Obtener la sinopsis y acortarla
-        sinopsis = movie_data.get("overview", "Sinopsis no disponible.")
-        if len(sinopsis) > 250:
-            sinopsis = sinopsis[:250] + "..."
-            
-        caption_text = (
-            f"🎬 **¡Nueva película disponible!**\n\n"
-            f"🍿 **{movie_data.get('title')}**\n\n"
-            f"📝 {sinopsis}\n\n"
-            f"Presiona el botón 'Ver Película' para acceder al post original."
-        )
-
-        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(text="🎬 Ver Película", url=post_link)],
-            [types.InlineKeyboardButton(text="➡️ Ir al Canal", url=MAIN_CHANNEL_INVITE_LINK)],
-            [types.InlineKeyboardButton(text="✨ Pedir una película", url="https://t.me/sdmin_dy_bot?start=request")]
-        ])
-
-        poster_url = get_movie_poster_url(movie_data.get("poster_path"))
-        
-        public_message = None
-        if poster_url:
-            public_message = await bot.send_photo(
-                chat_id=TELEGRAM_PUBLIC_CHANNEL_ID,
-                photo=poster_url,
-                caption=caption_text,
-                reply_markup=keyboard,
-                parse_mode=ParseMode.MARKDOWN
-            )
-        else:
-            public_message = await bot.send_message(
-                chat_id=TELEGRAM_PUBLIC_CHANNEL_ID,
-                text=caption_text,
-                reply_markup=keyboard,
-                parse_mode=ParseMode.MARKDOWN,
-                disable_web_page_preview=True
-            )
-            
-        logging.info(f"Enlace al post {original_message.message_id} reenviado al canal público.")
-        return public_message.message_id
-
-    except Exception as e:
-        logging.error(f"Error al reenviar el post al canal público: {e}")
-        return None
-
-async def send_movie_post(chat_id, movie_data, movie_link, post_keyboard, user_id_to_notify=None):
-    text, poster_url, _ = create_movie_message(movie_data, movie_link, from_channel=True)
-
-    try:
-        if poster_url and (poster_url.startswith('http://') or poster_url.startswith('https://')):
-            message = await bot.send_photo(
-                chat_id=chat_id,
-                photo=poster_url,
-                caption=text,
-                reply_markup=post_keyboard
-            )
-        else:
-            message = await bot.send_message(
-                chat_id=chat_id,
-                text=text,
-                reply_markup=post_keyboard
-            )
-
-        if chat_id == TELEGRAM_MAIN_CHANNEL_ID:
-            # --- MODIFICACIÓN 1: Añadir timestamp de publicación ---
-            movie_data["last_message_id"] = message.message_id
-            movie_data["last_posted_at"] = datetime.datetime.now().isoformat() # <-- NUEVA LÍNEA
-            
-            await asyncio.sleep(5)
-            public_message_id = await forward_post_to_public_channel(message, movie_data)
-            
-            if public_message_id:
-                movie_data["last_message_id_public"] = public_message_id
-            
-            await save_movie_to_db(movie_data) # <-- Esto ahora guarda el timestamp
-
-        if user_id_to_notify:
-            notification_message = (
-                f"🎉 ¡Tu película solicitada, **{movie_data.get('title')}**, ya está disponible en el canal!\n\n"
-                f"Haz clic en el botón de abajo para verla."
-            )
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="🎬 Ver ahora", url=f"https://t.me/{MAIN_CHANNEL_USERNAME}/{message.message_id}")],
-                [types.InlineKeyboardButton(text="➡️ Ir al Canal", url=MAIN_CHANNEL_INVITE_LINK)],
-                [types.InlineKeyboardButton(text="✨ Pedir otra película", url="https://t.me/sdmin_dy_bot?start=request")]
-            ])
-            await bot.send_message(user_id_to_notify, notification_message, reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
-
-        return True, message.message_id
-    except Exception as e:
-        logging.error(f"Error al enviar la publicación: {e}")
-        return False, None
-
-@dp.message(F.text == "🆘 Soporte")
-async def start_support_handler(message: types.Message, state: FSMContext):
-    await state.set_state(SupportStates.waiting_for_support_message)
-    await message.reply("Escribe tu mensaje para el equipo de soporte. Te responderán lo antes posible.")
-
-@dp.message(SupportStates.waiting_for_support_message)
-async def process_support_message(message: types.Message, state: FSMContext):
-    user_info = message.from_user
-    support_message = f"<b>Nuevo mensaje de soporte:</b>\n\n" \
-                      f"<b>De:</b> {user_info.full_name} (@{user_info.username if user_info.username else 'N/A'})\n" \
-                      f"<b>ID:</b> <code>{user_info.id}</code>\n" \
-                      f"<b>Mensaje:</b>\n" \
-                      f"{message.text}"
-    
-    try:
-        await bot.send_message(chat_id=ADMIN_ID, text=support_message, parse_mode=ParseMode.HTML)
-        await message.reply("✅ Tu mensaje ha sido enviado. Gracias por contactarnos.")
-    except Exception as e:
-        await message.reply("❌ Hubo un error al enviar tu mensaje. Por favor, inténtalo de nuevo más tarde.")
-        logging.error(f"Error al reenviar mensaje de soporte al administrador: {e}")
-    finally:
-        await state.clear()
-
-@dp.message(Command("start"))
-async def start_command(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
-    chat_id = message.chat.id
-    
-    await state.clear()
-    
-    if str(user_id) == ADMIN_ID:
-        keyboard = types.ReplyKeyboardMarkup(
-            keyboard=[
-                [types.KeyboardButton(text="➕ Agregar película"), types.KeyboardButton(text="📋 Ver catálogo")],
-                [types.KeyboardButton(text="⚙️ Configuración auto-publicación"), types.KeyboardButton(text="📰 Configurar noticias")] # NUEVO: Botón para configurar noticias
-            ],
-            resize_keyboard=True
-        )
-        sent_message = await message.reply(
-            "¡Hola, Administrador! Elige una opción:",
-            reply_markup=keyboard,
-        )
-        user_message_ids[user_id] = [sent_message.message_id]
-
-    else:
-        if user_id in user_message_ids:
-            for msg_id in user_message_ids[user_id]:
-                try:
-                    await bot.delete_message(chat_id=chat_id, message_id=msg_id)
-                except Exception:
-                    pass
-        user_message_ids[user_id] = []
-        
-        user_keyboard = types.ReplyKeyboardMarkup(
-            keyboard=[
-                [types.KeyboardButton(text="🔍 Buscar película"), types.KeyboardButton(text="🎞️ Estrenos")],
-                [types.KeyboardButton(text="✨ Recomiéndame"), types.KeyboardButton(text="📌 Pedir película")],
-                [types.KeyboardButton(text="🆘 Soporte")]
-            ],
-            resize_keyboard=True
-        )
-        
-        caption = "¡Hola! Soy un bot que te ayuda a encontrar tus películas favoritas. ¡Usa el menú de abajo para empezar!"
-        
-        sent_message = await bot.send_photo(
-            chat_id=message.chat.id,
-            photo=WELCOME_IMAGE_URL,
-            caption=caption,
-            reply_markup=user_keyboard,
-            parse_mode=ParseMode.MARKDOWN
-        )
-        user_message_ids[user_id].append(sent_message.message_id)
-
-
-@dp.message(F.text.contains("ordershunter.ru"))
-async def delete_spam_message(message: types.Message):
-    try:
-        await message.delete()
-    except Exception as e:
-        logging.error(f"No se pudo eliminar el mensaje de spam: {e}")
-
-# --- CORRECCIÓN DE FLUJO DE AGREGAR PELÍCULA ---
-@dp.message(F.text == "➕ Agregar película")
-async def add_movie_start_by_text(message: types.Message, state: FSMContext):
-    if str(message.from_user.id) != ADMIN_ID:
-        await message.reply("No tienes permiso para esta acción.")
-        return
-    await state.clear()
-    await message.reply(
-        "Por favor, escribe el nombre completo de la película que quieres agregar. Puedes incluir el año para un resultado más preciso."
-    )
-    await state.set_state(MovieUploadStates.waiting_for_admin_movie_name)
-
-@dp.message(MovieUploadStates.waiting_for_admin_movie_name)
-async def admin_search_movie_to_add(message: types.Message, state: FSMContext):
-    search_query = message.text.strip()
-    await message.reply(f"Buscando '{search_query}'...")
-
-    tmdb_results, _ = await get_movie_results_by_title(search_query)
-
-    if not tmdb_results:
-        await message.reply(
-            "No se encontraron resultados. Por favor, intenta con un nombre o año diferente."
-        )
-        return
-    
-    for movie in tmdb_results[:SEARCH_RESULTS_PER_PAGE]:
-        tmdb_id = movie.get("id")
-        tmdb_data = await get_movie_details(tmdb_id)
-        if not tmdb_data:
-            continue
-            
-        text, poster_url, _ = create_movie_message(tmdb_data)
-
-        # AQUI ESTA EL CAMBIO: VERIFICA SI LA PELICULA YA EXISTE EN LA DB
-        movie_in_db = await get_movie_by_tmdb_id(tmdb_id)
-
-        if movie_in_db:
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="✅ Película ya en el catálogo", callback_data="movie_exists_dummy")],
-                [types.InlineKeyboardButton(text="📌 Publicar ahora", callback_data=f"publish_now_admin:{tmdb_id}")]
-            ])
-        else:
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="Agregar esta película", callback_data=f"admin_add_movie:{tmdb_id}")]
-            ])
-            
-        try:
-            if poster_url:
-                await bot.send_photo(
-                    chat_id=message.chat.id,
-                    photo=poster_url,
-                    caption=text,
-                    reply_markup=keyboard,
-                    parse_mode=ParseMode.HTML
-                )
-            else:
-                await bot.send_message(
-                    chat_id=message.chat.id,
-                    text=text,
-                    reply_markup=keyboard,
-                    parse_mode=ParseMode.HTML
-                )
-        except Exception as e:
-            logging.error(f"Error al enviar el resultado de búsqueda del administrador: {e}")
-
-    await state.set_state(MovieUploadStates.waiting_for_admin_movie_name)
-
-@dp.callback_query(F.data == "movie_exists_dummy")
-async def dummy_callback_handler(callback_query: types.CallbackQuery):
-    await bot.answer_callback_query(callback_query.id, "Esta película ya está en el catálogo.", show_alert=True)
-
-@dp.callback_query(F.data.startswith("admin_add_movie:"))
-async def admin_add_movie_callback(callback_query: types.CallbackQuery, state: FSMContext):
-    await bot.answer_callback_query(callback_query.id)
-    tmdb_id = int(callback_query.data.split(':')[-1])
-    
-    tmdb_data = await get_movie_details(tmdb_id)
-    if not tmdb_data:
-        await bot.send_message(callback_query.message.chat.id, "Error al obtener la información de la película.")
-        return
-
-    await state.update_data(tmdb_data=tmdb_data, tmdb_id=tmdb_id)
-    await state.set_state(MovieUploadStates.waiting_for_admin_movie_link)
-    
-    await bot.send_message(
-        callback_query.message.chat.id,
-        f"Has seleccionado **{tmdb_data.get('title')}**. Por favor, envía el enlace de la película.",
-        parse_mode=ParseMode.MARKDOWN
-    )
-
-@dp.message(MovieUploadStates.waiting_for_admin_movie_link)
-async def admin_process_movie_link(message: types.Message, state: FSMContext):
-    movie_link = message.text.strip()
-    user_data = await state.get_data()
-    tmdb_data = user_data.get('tmdb_data')
-
-    if not tmdb_data:
-        await message.reply("Ocurrió un error. Por favor, reinicia el proceso.")
-        await state.clear()
-        return
-
-    names = [tmdb_data.get('title')]
-    if tmdb_data.get('original_title') and tmdb_data.get('original_title') != tmdb_data.get('title'):
-        names.append(tmdb_data.get("original_title"))
-
-    movie_data = {
-        "id": tmdb_data.get("id"),
-        "title": tmdb_data.get("title"),
-        "names": ", ".join(names),
-        "link": movie_link,
-        "last_message_id": None,
-        "last_message_id_public": None, # Asegurarse que exista
-        "last_posted_at": None, # Asegurarse que exista
-        "added_at": datetime.datetime.now().isoformat()
-    }
-    
-    await save_movie_to_db(movie_data)
-
-    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-        [types.InlineKeyboardButton(text="📌 Publicar ahora", callback_data=f"publish_now_admin:{movie_data['id']}")],
-        [types.InlineKeyboardButton(text="➕ Agregar otra película", callback_data="add_another_movie")],
-        [types.InlineKeyboardButton(text="⏰ Publicar con temporizador", callback_data=f"schedule_movie_{movie_data['id']}")]
-    ])
-    
-    await message.reply(
-        f"✅ La película **{tmdb_data.get('title')}** se agregó correctamente. ¿Qué deseas hacer ahora?", 
-        reply_markup=keyboard, 
-        parse_mode=ParseMode.MARKDOWN
-    )
-    await state.clear()
-
-
-@dp.callback_query(F.data.startswith("publish_now_admin:"))
-async def publish_now_admin(callback_query: types.CallbackQuery):
-    await bot.answer_callback_query(callback_query.id, "Publicando la película...")
-    movie_id = int(callback_query.data.split(':')[-1])
-    movie_info = await get_movie_by_tmdb_id(movie_id)
-
-    if not movie_info:
-        await bot.send_message(callback_query.message.chat.id, "Error: película no encontrada en la base de datos.")
-        await callback_query.answer()
-        return
-
-    tmdb_data = await get_movie_details(movie_id)
-    if not tmdb_data:
-        await bot.send_message(callback_query.message.chat.id, "Error: no se pudo obtener información de TMDB.")
-        return
-
-    await delete_old_post(movie_id)
-
-    post_keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-        [types.InlineKeyboardButton(text="🎬 Ver ahora", url=movie_info.get("link"))],
-        [types.InlineKeyboardButton(text="✨ Pedir otra película", url="https://t.me/sdmin_dy_bot?start=request")]
-    ])
-
-    success, _ = await send_movie_post(TELEGRAM_MAIN_CHANNEL_ID, tmdb_data, movie_info.get("link"), post_keyboard)
-
-    if success:
-        await bot.send_message(callback_query.message.chat.id, "✅ Película publicada con éxito.")
-    else:
-        await bot.send_message(callback_query.message.chat.id, "Ocurrió un error al publicar la película.")
-
-    await callback_query.answer()
-
-@dp.callback_query(F.data == "add_another_movie")
-async def handle_add_another_movie(callback_query: types.CallbackQuery, state: FSMContext):
-    await bot.answer_callback_query(callback_query.id)
-    await state.clear()
-    await bot.send_message(callback_query.message.chat.id, "Por favor, escribe el nombre completo de la siguiente película.")
-    await state.set_state(MovieUploadStates.waiting_for_admin_movie_name)
-
-
-# --- INICIO DEL NUEVO FLUJO DE CATÁLOGO ---
-
-@dp.message(F.text == "📋 Ver catálogo")
-async def view_catalog_by_text(message: types.Message, state: FSMContext):
-    await state.clear()
-    if str(message.from_user.id) != ADMIN_ID:
-        await message.reply("No tienes permiso para esta acción.")
-        return
-    
-    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-        [types.InlineKeyboardButton(text="🔍 Buscar en catálogo", callback_data="admin_search_catalog")],
-        [types.InlineKeyboardButton(text="➡️ Ver todo el catálogo", callback_data="admin_view_all_catalog")]
-    ])
-    
-    await message.reply(
-        "Elige una opción para gestionar el catálogo:",
-        reply_markup=keyboard
-    )
-
-
-@dp.callback_query(F.data == "admin_search_catalog")
-async def admin_search_catalog_start(callback_query: types.CallbackQuery, state: FSMContext):
-    await bot.answer_callback_query(callback_query.id)
-    await state.set_state(AdminStates.waiting_for_catalog_search_query)
-    await bot.send_message(
-        callback_query.message.chat.id,
-        "Por favor, escribe el **nombre** de la película que deseas buscar en tu catálogo.",
-        parse_mode=ParseMode.MARKDOWN
-    )
-    
-@dp.message(AdminStates.waiting_for_catalog_search_query)
-async def admin_process_catalog_search(message: types.Message, state: FSMContext):
-    search_query = message.text.strip()
-    await message.reply(f"Buscando '{search_query}' en el catálogo...")
-    
-    movie_data = await find_movie_in_db_by_name(search_query)
-    
-    if not movie_data:
-        await message.reply("❌ No se encontró una película con ese nombre en tu catálogo. Intenta con un nombre diferente.")
-    else:
-        title = movie_data.get("title") if movie_data.get("title") else "Título desconocido"
-        tmdb_id = movie_data.get("id")
-        
-        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(text="📌 Publicar en el canal", callback_data=f"publish_now_admin:{tmdb_id}")],
-            [types.InlineKeyboardButton(text="✏️ Editar película", callback_data=f"edit_movie:{tmdb_id}"),
-             types.InlineKeyboardButton(text="🗑️ Eliminar película", callback_data=f"delete_movie:{tmdb_id}")]
-        ])
-        
-        message_text = (
-            f"✅ **Película Encontrada:**\n"
-            f"**Título:** {title}\n"
-            f"**ID:** `{tmdb_id}`\n"
-            f"**Enlace:** <a href='{movie_data.get('link', 'No disponible')}'>Click para ver el enlace</a>"
-        )
-        
-        await message.reply(
-            message_text,
-            reply_markup=keyboard,
-            parse_mode=ParseMode.HTML,
-            disable_web_page_preview=True
-        )
-        
-    await state.clear()
-
-
-@dp.callback_query(F.data == "admin_view_all_catalog")
-async def admin_view_all_catalog_callback(callback_query: types.CallbackQuery):
-    await bot.answer_callback_query(callback_query.id)
-    all_movies = await get_all_movies()
-    if not all_movies:
-        await bot.send_message(callback_query.message.chat.id, "Aún no hay películas en la base de datos.")
-        return
-    
-    # Se borra el mensaje de opciones (Buscar/Ver todo) para iniciar el catálogo
-    try:
-        await bot.delete_message(chat_id=callback_query.message.chat.id, message_id=callback_query.message.message_id)
-    except Exception:
-        pass
-        
-    await send_catalog_page(callback_query.message.chat.id, 0)
-
-
-async def send_catalog_page(chat_id, page):
-    movie_items = await get_all_movies()
-    start = page * MOVIES_PER_PAGE
-    end = start + MOVIES_PER_PAGE
-    page_movies = movie_items[start:end]
-    total_movies = len(movie_items)
-    total_pages = (total_movies + MOVIES_PER_PAGE - 1) // MOVIES_PER_PAGE
-    
-    # Si no hay películas para la página actual, regresar o notificar.
-    if not page_movies and total_movies > 0 and page > 0:
-        await bot.send_message(chat_id, "No hay más películas en esta página.")
-        return
-    
-    text = f"**Catálogo de Películas** (Página {page + 1}/{total_pages})\n\n"
-    
-    await bot.send_message(chat_id, text, parse_mode=ParseMode.MARKDOWN)
-
-    for data in page_movies:
-        title = data.get("title") if data.get("title") else "Título desconocido"
-        tmdb_id = data.get("id")
-        
-        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(text="📌 Publicar en el canal", callback_data=f"publish_now_admin:{tmdb_id}")],
-            [types.InlineKeyboardButton(text="✏️ Editar película", callback_data=f"edit_movie:{tmdb_id}"),
-            types.InlineKeyboardButton(text="🗑️ Eliminar película", callback_data=f"delete_movie:{tmdb_id}")]
-        ])
-        
-        message_text = f"**{title}**\nID: `{tmdb_id}`"
-        
-        await bot.send_message(
-            chat_id, 
-            message_text,
-            reply_markup=keyboard,
-            parse_mode=ParseMode.MARKDOWN
-        )
-
-    pagination_buttons = []
-    if page > 0:
-        pagination_buttons.append(types.InlineKeyboardButton(text="⬅️ Anterior", callback_data=f"catalog_page:{page-1}"))
-    if page + 1 < total_pages:
-        pagination_buttons.append(types.InlineKeyboardButton(text="Siguiente ➡️", callback_data=f"catalog_page:{page+1}"))
-    
-    if pagination_buttons:
-        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[pagination_buttons])
-        await bot.send_message(chat_id, "Navegación:", reply_markup=keyboard)
-
-
-@dp.callback_query(F.data.startswith("catalog_page:"))
-async def navigate_catalog(callback_query: types.CallbackQuery):
-    page = int(callback_query.data.split(':')[-1])
-    try:
-        await bot.delete_message(chat_id=callback_query.message.chat.id, message_id=callback_query.message.message_id)
-    except Exception as e:
-        logging.error(f"Error al borrar mensaje de catálogo: {e}")
-    await send_catalog_page(callback_query.message.chat.id, page)
-
-@dp.callback_query(F.data.startswith("edit_movie:"))
-async def handle_edit_movie(callback_query: types.CallbackQuery):
-    await bot.answer_callback_query(callback_query.id)
-    await bot.send_message(callback_query.message.chat.id, "La función de edición está en desarrollo. ¡Pronto estará disponible!")
-
-@dp.callback_query(F.data.startswith("delete_movie:"))
-async def handle_delete_movie(callback_query: types.CallbackQuery):
-    await bot.answer_callback_query(callback_query.id)
-    movie_id = int(callback_query.data.split(':')[-1])
-    
-    movie_to_delete = await get_movie_by_tmdb_id(movie_id)
-    if movie_to_delete:
-        # Usar la función de borrado de post que borra de AMBOS canales
-        await delete_old_post(movie_id)
-        
-        await delete_movie_from_db(movie_id)
-        await bot.send_message(callback_query.message.chat.id, f"✅ La película **{movie_to_delete.get('title')}** ha sido eliminada del catálogo y del canal.", parse_mode=ParseMode.MARKDOWN)
-    else:
-        await bot.send_message(callback_query.message.chat.id, "No se encontró la película para eliminar.")
-
-@dp.callback_query(F.data.startswith("publish_from_catalog:"))
-async def publish_from_catalog(callback_query: types.CallbackQuery):
-    movie_id = int(callback_query.data.split(':')[-1])
-    movie_info = await get_movie_by_tmdb_id(movie_id)
-    if not movie_info:
-        await bot.answer_callback_query(callback_query.id, "Error: película no encontrada en la base de datos.", show_alert=True)
-        return
-    tmdb_data = await get_movie_details(movie_id)
-    if not tmdb_data:
-        await bot.answer_callback_query(callback_query.id, "No se pudo obtener la información de la película. No se puede publicar.", show_alert=True)
-        return
-    await delete_old_post(movie_id)
-    text, poster_url, post_keyboard = create_movie_message(tmdb_data, movie_info.get("link"))
-    success, _ = await send_movie_post(TELEGRAM_MAIN_CHANNEL_ID, tmdb_data, movie_info.get("link"), post_keyboard)
-    if success:
-        await bot.answer_callback_query(callback_query.id, "✅ Película publicada con éxito.", show_alert=True)
-    else:
-        await bot.answer_callback_query(callback_query.id, "Ocurrió un error al publicar la película.", show_alert=True)
-        
-# --- FIN DEL NUEVO FLUJO DE CATÁLOGO ---
-
-
-# --- Opciones de auto-publicación actualizadas ---
-@dp.message(F.text == "⚙️ Configuración auto-publicación")
-async def auto_post_config(message: types.Message, state: FSMContext):
-    await state.clear()
-    if str(message.from_user.id) != ADMIN_ID:
-        await message.reply("No tienes permiso para esta acción.")
-        return
-    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-        [types.InlineKeyboardButton(text="8 películas al día (Cada 3 hrs)", callback_data="set_auto_8")],
-        [types.InlineKeyboardButton(text="12 películas al día (Cada 2 hrs)", callback_data="set_auto_12")],
-        [types.InlineKeyboardButton(text="16 películas al día", callback_data="set_auto_16")],
-        [types.InlineKeyboardButton(text="24 películas al día (Cada 1 hr)", callback_data="set_auto_24")]
-    ])
-    await message.reply("Elige cuántas películas quieres que se publiquen automáticamente cada día:", reply_markup=keyboard)
-
-@dp.callback_query(F.data.startswith("set_auto_"))
-async def set_auto_post_count(callback_query: types.CallbackQuery):
-    global AUTO_POST_COUNT
-    AUTO_POST_COUNT = int(callback_query.data.split("_")[2])
-    await bot.answer_callback_query(callback_query.id, f"Publicación automática configurada para {AUTO_POST_COUNT} películas al día.")
-    await bot.edit_message_text(
-        chat_id=callback_query.message.chat.id,
-        message_id=callback_query.message.message_id,
-        text=f"✅ Publicación automática configurada para {AUTO_POST_COUNT} películas al día."
-    )
-
-# --- (ESTA ES LA FUNCIÓN MODIFICADA) ---
-@dp.message(F.text == "📰 Configurar noticias")
-async def news_post_config(message: types.Message, state: FSMContext):
-    if str(message.from_user.id) != ADMIN_ID:
-        await message.reply("No tienes permiso para esta acción.")
-        return
-    await state.clear()
-    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-        [types.InlineKeyboardButton(text="3 noticias/memes al día (Cada 8 hrs)", callback_data="set_news_3")],
-        [types.InlineKeyboardButton(text="4 noticias/memes al día (Cada 6 hrs)", callback_data="set_news_4")],
-        [types.InlineKeyboardButton(text="6 noticias/memes al día (Cada 4 hrs)", callback_data="set_news_6")]
-    ])
-    await message.reply("Elige cuántas noticias y memes quieres que se publiquen automáticamente cada día:", reply_markup=keyboard)
-
-@dp.callback_query(F.data.startswith("set_news_"))
-async def set_news_post_count(callback_query: types.CallbackQuery):
-    global NEWS_POST_COUNT
-    NEWS_POST_COUNT = int(callback_query.data.split("_")[2])
-    await bot.answer_callback_query(callback_query.id, f"Publicación de noticias y memes configurada para {NEWS_POST_COUNT} al día.")
-    await bot.edit_message_text(
-        chat_id=callback_query.message.chat.id,
-        message_id=callback_query.message.message_id,
-        text=f"✅ Publicación de noticias y memes configurada para {NEWS_POST_COUNT} al día."
-    )
-
-
-@dp.message(F.text == "🎞️ Estrenos")
-async def show_estrenos_by_text(message: types.Message, state: FSMContext):
-    await state.clear()
-    await show_estrenos_page(message.chat.id, page=1, is_start_message=True)
-
-@dp.callback_query(F.data.startswith("estrenos_page:"))
-async def navigate_estrenos_page(callback_query: types.CallbackQuery):
-    page = int(callback_query.data.split(":")[-1])
-    await bot.answer_callback_query(callback_query.id)
-    await show_estrenos_page(callback_query.message.chat.id, page)
-
-async def show_estrenos_page(chat_id, page, is_start_message=False):
-    if is_start_message:
-        await bot.send_message(chat_id, "Buscando los últimos estrenos... 🎬")
-
-    upcoming_movies, total_pages = await get_upcoming_movies(page)
-    
-    if not upcoming_movies:
-        await bot.send_message(chat_id, "No se encontraron más estrenos recientes en este momento. Vuelve a intentarlo más tarde.")
-        return
-
-    for movie in upcoming_movies[:ESTRENOS_PER_PAGE]:
-        tmdb_id = movie.get("id")
-        tmdb_data = await get_movie_details(tmdb_id)
-        if not tmdb_data:
-            continue
-        
-        movie_in_db = await get_movie_by_tmdb_id(tmdb_id)
-        
-        if movie_in_db:
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="🎬 Ver ahora", url=movie_in_db.get("link"))],
-                [types.InlineKeyboardButton(text="📢 Publicar en el canal", callback_data=f"publish_now_manual:{tmdb_id}")]
-            ])
-        else:
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="🎬 Pedir esta película", callback_data=f"request_movie_by_id:{tmdb_id}")]
-            ])
-            
-        text, poster_url, _ = create_movie_message(tmdb_data)
-        
-        try:
-            if poster_url:
-                await bot.send_photo(chat_id, photo=poster_url, caption=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-            else:
-                await bot.send_message(chat_id, text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-        except Exception as e:
-            logging.error(f"Error al enviar estreno: {e}")
-    
-    if page < total_pages:
-        keyboard_next = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(text="Ver más estrenos ➡️", callback_data=f"estrenos_page:{page+1}")]
-        ])
-        await bot.send_message(chat_id, "Mira lo que sigue:", reply_markup=keyboard_next)
-
-@dp.message(F.text == "🔍 Buscar película")
-async def show_search_options_by_text(message: types.Message, state: FSMContext):
-    await state.clear()
-    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-        [types.InlineKeyboardButton(text="Por Género", callback_data="search_by_genre")],
-        [types.InlineKeyboardButton(text="Por Actor", callback_data="search_by_actor")],
-        [types.InlineKeyboardButton(text="Buscar Película", callback_data="search_by_name")],
-    ])
-    await message.reply(
-        "¿Cómo quieres buscar la película? 🔎",
-        reply_markup=keyboard
-    )
-    
-@dp.callback_query(F.data == "search_by_actor")
-async def search_by_actor_start(callback_query: types.CallbackQuery, state: FSMContext):
-    await bot.answer_callback_query(callback_query.id)
-    await state.clear()
-    await state.set_state(MovieRequestStates.waiting_for_actor_name)
-    await bot.send_message(callback_query.message.chat.id, "Por favor, escribe el nombre del actor. 🎭")
-
-@dp.message(MovieRequestStates.waiting_for_actor_name)
-async def search_by_actor_process(message: types.Message, state: FSMContext):
-    actor_name = message.text.strip()
-    await message.reply(f"Buscando películas de '{actor_name}'...")
-    movies, total_pages = await get_movies_by_actor(actor_name)
-    
-    if not movies:
-        await message.reply("No se encontraron películas para este actor. Intenta con un nombre diferente.")
-        await state.clear()
-        return
-
-    for movie in movies[:SEARCH_RESULTS_PER_PAGE]:
-        tmdb_id = movie.get("id")
-        tmdb_data = await get_movie_details(tmdb_id)
-        if not tmdb_data:
-            continue
-        
-        movie_in_db = await get_movie_by_tmdb_id(tmdb_id)
-        
-        if movie_in_db:
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="🎬 Ver ahora", url=movie_in_db.get("link"))]
-            ])
-        else:
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="🎬 Pedir esta película", callback_data=f"request_movie_by_id:{tmdb_id}")]
-            ])
-            
-        text, poster_url, _ = create_movie_message(tmdb_data)
-        
-        try:
-            if poster_url:
-                await bot.send_photo(chat_id=message.chat.id, photo=poster_url, caption=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-            else:
-                await bot.send_message(chat_id=message.chat.id, text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-        except Exception as e:
-            logging.error(f"Error al enviar la publicación de actor: {e}")
-    
-    await state.clear()
-
-
-@dp.callback_query(F.data == "search_by_name")
-async def search_by_name_start(callback_query: types.CallbackQuery, state: FSMContext):
-    await bot.answer_callback_query(callback_query.id)
-    await state.clear()
-    await state.set_state(MovieRequestStates.waiting_for_search_query)
-    await bot.send_message(callback_query.message.chat.id, "Por favor, escribe el nombre de la película. 🎬")
-
-@dp.message(MovieRequestStates.waiting_for_search_query)
-async def search_by_name_process(message: types.Message, state: FSMContext):
-    query = message.text.strip()
-    await message.reply(f"Buscando '{query}'...")
-    results, total_pages = await get_movie_results_by_title(query)
-    
-    if not results:
-        await message.reply("No se encontraron películas con ese nombre. Intenta con otro.")
-        await state.clear()
-        return
-        
-    for movie in results[:SEARCH_RESULTS_PER_PAGE]:
-        tmdb_id = movie.get("id")
-        tmdb_data = await get_movie_details(tmdb_id)
-        if not tmdb_data:
-            continue
-        
-        movie_in_db = await get_movie_by_tmdb_id(tmdb_id)
-        
-        if movie_in_db:
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="🎬 Ver ahora", url=movie_in_db.get("link"))],
-                [types.InlineKeyboardButton(text="📢 Publicar en el canal", callback_data=f"publish_now_manual:{tmdb_id}")]
-            ])
-        else:
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="🎬 Pedir esta película", callback_data=f"request_movie_by_id:{tmdb_id}")]
-            ])
-            
-        text, poster_url, _ = create_movie_message(tmdb_data)
-        
-        try:
-            if poster_url:
-                await bot.send_photo(chat_id=message.chat.id, photo=poster_url, caption=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-            else:
-                await bot.send_message(chat_id=message.chat.id, text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-        except Exception as e:
-            logging.error(f"Error al enviar la publicación de búsqueda: {e}")
-            
-    await state.clear()
-
-
-@dp.message(F.text == "✨ Recomiéndame")
-async def show_recomendar_by_text(message: types.Message, state: FSMContext):
-    await state.clear()
-    await show_recomendar_page(message.chat.id, page=1, is_start_message=True)
-
-@dp.callback_query(F.data.startswith("recomendar_page:"))
-async def navigate_recomendar_page(callback_query: types.CallbackQuery):
-    page = int(callback_query.data.split(":")[-1])
-    await bot.answer_callback_query(callback_query.id)
-    await show_recomendar_page(callback_query.message.chat.id, page)
-
-async def show_recomendar_page(chat_id, page, is_start_message=False):
-    if is_start_message:
-        await bot.send_message(chat_id, "Obteniendo recomendaciones... ✨")
-
-    popular_movies, total_pages = await get_popular_movies(page)
-    
-    if not popular_movies:
-        await bot.send_message(chat_id, "No se pudieron obtener más recomendaciones en este momento. Vuelve a intentarlo más tarde.")
-        return
-
-    for movie in popular_movies[:RECOMENDACIONES_PER_PAGE]:
-        tmdb_id = movie.get("id")
-        tmdb_data = await get_movie_details(tmdb_id)
-        if not tmdb_data:
-            continue
-
-        movie_in_db = await get_movie_by_tmdb_id(tmdb_id)
-
-        if movie_in_db:
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="🎬 Ver ahora", url=movie_in_db.get("link"))],
-                [types.InlineKeyboardButton(text="📢 Publicar en el canal", callback_data=f"publish_now_manual:{tmdb_id}")]
-            ])
-        else:
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="🎬 Pedir esta película", callback_data=f"request_movie_by_id:{tmdb_id}")]
-            ])
-            
-        text, poster_url, _ = create_movie_message(tmdb_data)
-        
-        try:
-            if poster_url:
-                await bot.send_photo(chat_id, photo=poster_url, caption=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-            else:
-                await bot.send_message(chat_id, text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-        except Exception as e:
-            logging.error(f"Error al enviar recomendación: {e}")
-    
-    if page < total_pages:
-        keyboard_next = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(text="Ver más recomendaciones ➡️", callback_data=f"recomendar_page:{page+1}")]
-        ])
-        await bot.send_message(chat_id, "Mira lo que sigue:", reply_markup=keyboard_next)
-
-@dp.message(F.text == "📰 Noticias")
-async def send_latest_news_handler(message: types.Message, state: FSMContext):
-    await state.clear()
-    await message.reply("Buscando las últimas noticias de cine...")
-    articles = await get_latest_news()
-    if not articles:
-        await message.reply("Lo siento, no se encontraron noticias de cine en este momento.")
-        return
-
-    for article in articles[:3]:
-        title = article.get("title", "Sin título")
-        description = article.get("description", "Sin descripción")
-        url = article.get("url", "#")
-        image_url = article.get("urlToImage", None)
-
-        news_text = (
-            f"<b>{html.quote(title)}</b>\n\n"
-            f"<i>{html.quote(description)}</i>\n\n"
-            f"<a href='{html.quote(url)}'>Leer más</a>"
-        )
-        try:
-            if image_url:
-                await bot.send_photo(
-                    chat_id=message.chat.id,
-                    photo=image_url,
-                    caption=news_text,
-                    parse_mode=ParseMode.HTML
-                )
-            else:
-                await bot.send_message(
-                    chat_id=message.chat.id,
-                    text=news_text,
-                    parse_mode=ParseMode.HTML,
-                    disable_web_page_preview=True
-                )
-        except Exception as e:
-            logging.error(f"Error al enviar la noticia: {e}")
-            await bot.send_message(
-                chat_id=message.chat.id,
-                text=news_text,
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=True
-            )
-
-@dp.callback_query(F.data == "search_by_genre")
-async def search_by_genre_callback(callback_query: types.CallbackQuery, state: FSMContext):
-    await bot.answer_callback_query(callback_query.id)
-    await state.clear()
-    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-        [types.InlineKeyboardButton(text=genre, callback_data=f"genre:{id}") for genre, id in list(GENRES.items())[i:i+3]] for i in range(0, len(GENRES), 3)
-    ] + [[types.InlineKeyboardButton(text="⬅️ Regresar", callback_data="back_to_search_menu")]])
-    await bot.send_message(callback_query.message.chat.id, "Elige un género:", reply_markup=keyboard)
-
-@dp.callback_query(F.data == "back_to_search_menu")
-async def back_to_search_menu(callback_query: types.CallbackQuery, state: FSMContext):
-    await bot.answer_callback_query(callback_query.id)
-    await state.clear()
-    await show_search_options_by_text(callback_query.message)
-
-
-@dp.callback_query(F.data.startswith("genre:"))
-async def show_movies_by_genre(callback_query: types.CallbackQuery, page=1):
-    await bot.answer_callback_query(callback_query.id)
-    genre_id_str = callback_query.data.split(':')[1]
-    genre_id = int(genre_id_str)
-    
-    movies, total_pages = await get_movies_by_genre(genre_id, page=page)
-
-    if not movies:
-        await bot.send_message(callback_query.message.chat.id, "No se encontraron más películas para este género.")
-        return
-
-    await bot.send_message(callback_query.message.chat.id, f"**Aquí tienes algunas películas de {next((k for k, v in GENRES.items() if v == genre_id), 'este género')}:**", parse_mode=ParseMode.MARKDOWN)
-
-    for movie in movies[:5]:
-        tmdb_id = movie.get("id")
-        tmdb_data = await get_movie_details(tmdb_id)
-        if not tmdb_data:
-            continue
-        
-        movie_in_db = await get_movie_by_tmdb_id(tmdb_id)
-        
-        if movie_in_db:
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="🎬 Ver ahora", url=movie_in_db.get("link"))],
-                [types.InlineKeyboardButton(text="📢 Publicar en el canal", callback_data=f"publish_now_manual:{tmdb_id}")]
-            ])
-        else:
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="🎬 Pedir esta película", callback_data=f"request_movie_by_id:{tmdb_id}")]
-            ])
-
-        text, poster_url, _ = create_movie_message(tmdb_data)
-        
-        try:
-            if poster_url:
-                await bot.send_photo(chat_id=callback_query.message.chat.id, photo=poster_url, caption=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-            else:
-                await bot.send_message(chat_id=callback_query.message.chat.id, text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
-        except Exception as e:
-            logging.error(f"Error al enviar la publicación en el catálogo: {e}")
-
-    keyboard_buttons = []
-    if page > 1:
-        keyboard_buttons.append(types.InlineKeyboardButton(text="⬅️ Anterior", callback_data=f"genre_page:{genre_id}:{page-1}"))
-    if page + 1 < total_pages:
-        keyboard_buttons.append(types.InlineKeyboardButton(text="Siguiente ➡️", callback_data=f"genre_page:{genre_id}:{page+1}"))
-    
-    keyboard_buttons.append(types.InlineKeyboardButton(text="⬅️ Regresar", callback_data="back_to_search_menu"))
-
-    keyboard_pag = types.InlineKeyboardMarkup(inline_keyboard=[keyboard_buttons])
-    await bot.send_message(callback_query.message.chat.id, "Navega en los resultados:", reply_markup=keyboard_pag)
-
-@dp.callback_query(F.data.startswith("genre_page:"))
-async def navigate_genre_page(callback_query: types.CallbackQuery):
-    parts = callback_query.data.split(':')
-    genre_id = int(parts[1])
-    page = int(parts[2])
-    try:
-        await bot.delete_message(chat_id=callback_query.message.chat.id, message_id=callback_query.message.message_id)
-    except Exception as e:
-        logging.error(f"Error al borrar mensaje de catálogo: {e}")
-    await show_movies_by_genre(callback_query, page=page)
-
-
-@dp.message(F.text == "📌 Pedir película")
-async def start_request_flow(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
-    today = datetime.date.today().isoformat()
-    if user_id not in user_daily_requests or user_daily_requests[user_id]["date"] != today:
-        user_daily_requests[user_id] = {"count": 0, "date": today}
-    
-    if user_daily_requests[user_id]["count"] >= USER_REQUEST_LIMIT:
-        await message.reply("🚫 Has alcanzado el límite de solicitudes diarias. Inténtalo de nuevo mañana.")
-        await state.clear()
-        return
-        
-    await state.set_state(MovieRequestStates.waiting_for_movie_name_to_request)
-    await message.reply(
-        "Por favor, escribe el nombre de la película que te gustaría solicitar. Buscaremos las mejores opciones para ti."
-    )
-
-@dp.callback_query(F.data == "request_movie_from_main_menu")
-async def start_request_flow_callback(callback_query: types.CallbackQuery, state: FSMContext):
-    await bot.answer_callback_query(callback_query.id)
-    await state.clear()
-    await state.set_state(MovieRequestStates.waiting_for_movie_name_to_request)
-    await bot.send_message(
-        callback_query.message.chat.id,
-        "Por favor, escribe el nombre de la película que te gustaría solicitar. Buscaremos las mejores opciones para ti."
-    )
-    try:
-        await bot.delete_message(chat_id=callback_query.message.chat.id, message_id=callback_query.message.message_id)
-    except Exception as e:
-        logging.warning(f"No se pudo borrar el mensaje original al solicitar otra película: {e}")
-
-
-@dp.message(MovieRequestStates.waiting_for_movie_name_to_request)
-async def process_movie_name_for_request(message: types.Message, state: FSMContext):
-    user_id = message.from_user.id
-    movie_title = message.text.strip()
-    await message.reply(f"Buscando **{movie_title}** en la base de datos... 🔍")
-    
-    tmdb_results, _ = await get_movie_results_by_title(movie_title, page=1)
-    
-    if not tmdb_results:
-        await message.reply(
-            f"Lo siento, no se encontraron resultados para **{movie_title}**. Intenta con un nombre diferente o más preciso."
-        )
-        return
-        
-    await message.reply("Hemos encontrado algunas opciones. ¿Cuál de estas es la que buscas?")
-    
-    for movie in tmdb_results[:SEARCH_RESULTS_PER_PAGE]:
-        tmdb_id = movie.get("id")
-        tmdb_data = await get_movie_details(tmdb_id)
-        if not tmdb_data:
-            continue
-            
-        text, poster_url, _ = create_movie_message(tmdb_data)
-        
-        movie_in_db = await get_movie_by_tmdb_id(tmdb_id)
-        
-        today = datetime.date.today().isoformat()
-        if tmdb_id not in daily_requests:
-            daily_requests[tmdb_id] = {"count": 0, "date": today}
-        if daily_requests[tmdb_id]["date"] != today:
-            daily_requests[tmdb_id]["count"] = 0
-            daily_requests[tmdb_id]["date"] = today
-        
-        if movie_in_db and daily_requests[tmdb_id]["count"] >= REQUEST_LIMIT:
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="🎬 Ver ahora", url=movie_in_db.get("link"))]
-            ])
-            text += "\n\n🚫 Esta película ha superado el límite de solicitudes diarias. Haz clic en 'Ver ahora' para acceder al enlace."
-        else:
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="✅ Solicitar esta", callback_data=f"request_movie:{tmdb_id}:{message.from_user.id}")]
-            ])
-
-        try:
-            if poster_url:
-                await bot.send_photo(
-                    chat_id=message.chat.id,
-                    photo=poster_url,
-                    caption=text,
-                    reply_markup=keyboard,
-                    parse_mode=ParseMode.HTML
-                )
-            else:
-                await bot.send_message(
-                    chat_id=message.chat.id,
-                    text=text,
-                    reply_markup=keyboard,
-                    parse_mode=ParseMode.HTML
-                )
-        except Exception as e:
-            logging.error(f"Error al enviar la opción de película para solicitud: {e}")
-
-    await state.clear()
-    
-@dp.callback_query(F.data.startswith("request_movie_by_id:"))
-async def handle_movie_request_by_id(callback_query: types.CallbackQuery):
-    await bot.answer_callback_query(callback_query.id)
-    
-    tmdb_id = int(callback_query.data.split(':')[1])
-    requester_id = callback_query.from_user.id
-    
-    tmdb_data = await get_movie_details(tmdb_id)
-    if not tmdb_data:
-        await bot.send_message(callback_query.message.chat.id, "No se pudo obtener la información de la película. Por favor, inténtalo de nuevo.")
-        return
-
-    movie_in_db = await get_movie_by_tmdb_id(tmdb_id)
-    
-    today = datetime.date.today().isoformat()
-    if tmdb_id not in daily_requests:
-        daily_requests[tmdb_id] = {"count": 0, "date": today}
-    if daily_requests[tmdb_id]["date"] != today:
-        daily_requests[tmdb_id]["count"] = 0
-        daily_requests[tmdb_id]["date"] = today
-        
-    if movie_in_db and daily_requests[tmdb_id]["count"] >= REQUEST_LIMIT:
-        await bot.send_message(callback_query.message.chat.id, f"🚫 Esta película ha superado el límite de solicitudes diarias. Aquí tienes el enlace para verla:")
-        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(text="🎬 Ver ahora", url=movie_in_db.get("link"))]
-        ])
-        await bot.send_message(callback_query.message.chat.id, f"**{movie_in_db.get('title')}**", reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
-    
-    elif movie_in_db:
-        await bot.send_message(callback_query.message.chat.id, f"La película **{movie_in_db.get('title')}** ya existe en el catálogo. Publicándola en el canal...")
-        daily_requests[tmdb_id]["count"] += 1
-        
-        await delete_old_post(tmdb_id)
-        
-        text, poster_url, post_keyboard = create_movie_message(tmdb_data, movie_in_db.get("link"))
-        success, message_id = await send_movie_post(TELEGRAM_MAIN_CHANNEL_ID, tmdb_data, movie_in_db.get("link"), post_keyboard)
-        
-        if success:
-            notification_message = (
-                f"Tu película fue publicada en el canal principal. Haz clic aquí para verla"
-            )
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="📢 Ver en el canal", url=f"https://t.me/{MAIN_CHANNEL_USERNAME}/{message_id}")]
-            ])
-            await bot.send_message(callback_query.from_user.id, notification_message, reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
-    
-    else:
-        poster_url = get_movie_poster_url(tmdb_data.get("poster_path"))
-        caption_text = (
-            f"✨ **Nueva solicitud de película**\n\n"
-            f"El usuario **{callback_query.from_user.full_name}** (@{callback_query.from_user.username})\n"
-            f"ha solicitado: **{tmdb_data.get('title')}**\n"
-            f"ID de la película: `{tmdb_id}`\n\n"
-        )
-        
-        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(text="📌 Publicar ahora esta película", callback_data=f"publish_now_from_trakt:{tmdb_id}:{requester_id}")]
-        ])
-        
-        if poster_url:
-            await bot.send_photo(
-                ADMIN_ID,
-                photo=poster_url,
-                caption=caption_text,
-                parse_mode=ParseMode.HTML,
-                reply_markup=keyboard
-            )
-        else:
-            await bot.send_message(
-                ADMIN_ID,
-                text=caption_text,
-                parse_mode=ParseMode.HTML,
-                reply_markup=keyboard
-            )
-            
-        await bot.send_message(callback_query.message.chat.id, f"✅ Tu solicitud para **{tmdb_data.get('title')}** ha sido enviada al administrador. ¡Te avisaremos cuando esté lista!")
-
-
-@dp.callback_query(F.data.startswith("request_movie:"))
-async def handle_movie_request_callback(callback_query: types.CallbackQuery):
-    await bot.answer_callback_query(callback_query.id)
-    
-    parts = callback_query.data.split(':')
-    tmdb_id = int(parts[1])
-    requester_id = int(parts[2])
-    
-    tmdb_data = await get_movie_details(tmdb_id)
-    if not tmdb_data:
-        await bot.send_message(callback_query.message.chat.id, "No se pudo obtener la información de la película. Por favor, inténtalo de nuevo.")
-        return
-
-    movie_in_db = await get_movie_by_tmdb_id(tmdb_id)
-    
-    today = datetime.date.today().isoformat()
-    if tmdb_id not in daily_requests:
-        daily_requests[tmdb_id] = {"count": 0, "date": today}
-    if daily_requests[tmdb_id]["date"] != today:
-        daily_requests[tmdb_id]["count"] = 0
-        daily_requests[tmdb_id]["date"] = today
-        
-    if movie_in_db and daily_requests[tmdb_id]["count"] >= REQUEST_LIMIT:
-        await bot.send_message(callback_query.message.chat.id, f"🚫 Esta película ha superado el límite de solicitudes diarias. Aquí tienes el enlace para verla:")
-        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(text="🎬 Ver ahora", url=movie_in_db.get("link"))]
-        ])
-        await bot.send_message(callback_query.message.chat.id, f"**{movie_in_db.get('title')}**", reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
-    
-    elif movie_in_db:
-        await bot.send_message(callback_query.message.chat.id, f"La película **{movie_in_db.get('title')}** ya existe en el catálogo. Publicándola en el canal...")
-        daily_requests[tmdb_id]["count"] += 1
-        
-        await delete_old_post(tmdb_id)
-        
-        text, poster_url, post_keyboard = create_movie_message(tmdb_data, movie_in_db.get("link"))
-        success, message_id = await send_movie_post(TELEGRAM_MAIN_CHANNEL_ID, tmdb_data, movie_in_db.get("link"), post_keyboard)
-        
-        if success:
-            notification_message = (
-                f"Tu película fue publicada en el canal principal. Haz clic aquí para verla"
-            )
-            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                [types.InlineKeyboardButton(text="📢 Ver en el canal", url=f"https://t.me/{MAIN_CHANNEL_USERNAME}/{message_id}")]
-            ])
-            await bot.send_message(callback_query.from_user.id, notification_message, reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
-    
-    else:
-        poster_url = get_movie_poster_url(tmdb_data.get("poster_path"))
-        caption_text = (
-            f"✨ **Nueva solicitud de película**\n\n"
-            f"El usuario **{callback_query.from_user.full_name}** (@{callback_query.from_user.username})\n"
-            f"ha solicitado: **{tmdb_data.get('title')}**\n"
-            f"ID de la película: `{tmdb_id}`\n\n"
-        )
-        
-        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(text="📌 Publicar ahora esta película", callback_data=f"publish_now_from_trakt:{tmdb_id}:{requester_id}")]
-        ])
-        
-        if poster_url:
-            await bot.send_photo(
-                ADMIN_ID,
-                photo=poster_url,
-                caption=caption_text,
-                parse_mode=ParseMode.HTML,
-                reply_markup=keyboard
-            )
-        else:
-            await bot.send_message(
-                ADMIN_ID,
-                text=caption_text,
-                parse_mode=ParseMode.HTML,
-                reply_markup=keyboard
-            )
-            
-        await bot.send_message(callback_query.message.chat.id, f"✅ Tu solicitud para **{tmdb_data.get('title')}** ha sido enviada al administrador. ¡Te avisaremos cuando esté lista!")
-
-
-@dp.callback_query(F.data.startswith("publish_now_from_trakt:"))
-async def publish_now_from_trakt_callback(callback_query: types.CallbackQuery, state: FSMContext):
-    if str(callback_query.from_user.id) != ADMIN_ID:
-        await bot.answer_callback_query(callback_query.id, "No tienes permiso para esta acción.")
-        return
-    await bot.answer_callback_query(callback_query.id, "Preparando para agregar la película...", show_alert=True)
-    parts = callback_query.data.split(':')
-    tmdb_id = int(parts[1])
-    requester_id = int(parts[2])
-    tmdb_data = await get_movie_details(tmdb_id)
-    if not tmdb_data:
-        await bot.send_message(callback_query.message.chat.id, "No se pudo obtener la información completa de la película desde TMDB. Por favor, reinicie el proceso manualmente.")
-        return
-    await state.update_data(
-        tmdb_id=tmdb_id,
-        movie_title=tmdb_data.get("title"),
-        original_request_id=callback_query.message.message_id,
-        requester_id=requester_id
-    )
-    poster_url = get_movie_poster_url(tmdb_data.get("poster_path"))
-    caption = f"Por favor, ahora envía el enlace de la película '{tmdb_data.get('title')}' para publicarla."
-    
-    if poster_url:
-        await bot.send_photo(
-            chat_id=ADMIN_ID,
-            photo=poster_url,
-            caption=caption,
-        )
-    else:
-        await bot.send_message(
-            chat_id=ADMIN_ID,
-            text=caption,
-        )
-
-    await state.set_state(MovieUploadStates.waiting_for_requested_movie_link)
-
-@dp.message(MovieUploadStates.waiting_for_requested_movie_link)
-async def process_requested_movie_link(message: types.Message, state: FSMContext):
-    if str(message.from_user.id) != ADMIN_ID:
-        await message.reply("No tienes permiso para usar esta función.")
-        await state.clear()
-        return
-    movie_link = message.text.strip()
-    user_data = await state.get_data()
-    tmdb_id = user_data.get("tmdb_id")
-    movie_title = user_data.get("movie_title")
-    original_request_id = user_data.get("original_request_id")
-    requester_id = user_data.get('requester_id')
-    if not tmdb_id or not movie_title:
-        await message.reply("Ocurrió un error. Por favor, reenvía el enlace. Si el problema persiste, inicia el proceso de nuevo.")
-        return
-    tmdb_data = await get_movie_details(tmdb_id)
-    if not tmdb_data:
-        await message.reply("No se pudo obtener la información de la película desde TMDB. Reenvía el enlace o cancela el proceso.")
-        return
-    main_title = tmdb_data.get("title")
-    names = [main_title]
-    if tmdb_data.get("original_title") and tmdb_data.get("original_title") != main_title:
-        names.append(tmdb_data.get("original_title"))
-    
-    new_movie = {
-        "title": main_title,
-        "names": ", ".join(names),
-        "id": tmdb_id,
-        "link": movie_link,
-        "last_message_id": None,
-        "last_message_id_public": None,
-        "last_posted_at": None,
-        "added_at": datetime.datetime.now().isoformat()
-    }
-    await save_movie_to_db(new_movie)
-    await delete_old_post(tmdb_id)
-    text, poster_url, post_keyboard = create_movie_message(tmdb_data, movie_link)
-    success, message_id = await send_movie_post(TELEGRAM_MAIN_CHANNEL_ID, tmdb_data, movie_link, post_keyboard, user_id_to_notify=requester_id)
-    
-    await state.clear()
-    
-    if success:
-        await message.reply("✅ Película agregada a la base de datos y publicada con éxito.")
-        # La notificación al usuario ya se maneja dentro de send_movie_post
-    else:
-        await message.reply("✅ Película agregada a la base de datos, pero ocurrió un error al publicarla en el canal.")
-    
-    if original_request_id:
-        try:
-            await bot.delete_message(chat_id=message.chat.id, message_id=original_request_id)
-        except Exception as e:
-            logging.error(f"No se pudo eliminar el mensaje original de la solicitud: {e}")
-
-@dp.callback_query(F.data.startswith("publish_now_manual:"))
-async def publish_now_manual(callback_query: types.CallbackQuery):
-    await bot.answer_callback_query(callback_query.id)
-    tmdb_id = int(callback_query.data.split(':')[1])
-    movie_info = await get_movie_by_tmdb_id(tmdb_id)
-    if not movie_info:
-        await bot.send_message(callback_query.message.chat.id, "Error: película no encontrada en la base de datos.")
-        return
-    
-    tmdb_data = await get_movie_details(tmdb_id)
-    if not tmdb_data:
-        await bot.send_message(callback_query.message.chat.id, "Error al obtener la información de la película. No se puede publicar.")
-        return
-    
-    await delete_old_post(tmdb_id)
-    text, poster_url, post_keyboard = create_movie_message(tmdb_data, movie_info.get("link"))
-    success, message_id = await send_movie_post(TELEGRAM_MAIN_CHANNEL_ID, tmdb_data, movie_info.get("link"), post_keyboard)
-    
-    if success:
-        notification_message = "✅ Tu película fue publicada en el canal principal. Haz clic aquí para verla."
-        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-            [types.InlineKeyboardButton(text="📢 Ver en el canal", url=f"https://t.me/{MAIN_CHANNEL_USERNAME}/{message_id}")]
-        ])
-        await bot.send_message(callback_query.from_user.id, notification_message, reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
-    else:
-        await bot.send_message(callback_query.message.chat.id, "Ocurrió un error al publicar la película.")
-
-
-@dp.callback_query(F.data.startswith("schedule_movie_"))
-async def schedule_callback(callback_query: types.CallbackQuery, state: FSMContext):
-    movie_id = int(callback_query.data.split("_")[2])
-    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-        [types.InlineKeyboardButton(text="En 30 minutos", callback_data=f"schedule_30m_{movie_id}")],
-        [types.InlineKeyboardButton(text="En 1 hora", callback_data=f"schedule_1h_{movie_id}")]
-    ])
-    await bot.answer_callback_query(callback_query.id)
-    await bot.send_message(
-        chat_id=callback_query.message.chat.id,
-        text="Elige cuándo quieres programar la publicación:",
-        reply_markup=keyboard
-    )
-    await bot.delete_message(chat_id=callback_query.message.chat.id, message_id=callback_query.message.message_id)
-
-@dp.callback_query(F.data.startswith("schedule_30m_") | F.data.startswith("schedule_1h_"))
-async def final_schedule_callback(callback_query: types.CallbackQuery, state: FSMContext):
-    parts = callback_query.data.split("_")
-    delay_type = parts[1]
-    movie_id = int(parts[2])
-    delay_minutes = 0
-    if delay_type == "30m":
-        delay_minutes = 30
-    elif delay_type == "1h":
-        delay_minutes = 60
-    movie_info = await get_movie_by_tmdb_id(movie_id)
-    if not movie_info:
-        await bot.answer_callback_query(callback_query.id, "Error: película no encontrada en la base de datos.", show_alert=True)
-        return
-    await scheduled_posts.put((movie_info, delay_minutes))
-    await bot.answer_callback_query(callback_query.id, f"✅ Publicación programada para dentro de {delay_minutes} minutos.", show_alert=True)
-    await bot.edit_message_text(
-        chat_id=callback_query.message.chat.id,
-        message_id=callback_query.message.message_id,
-        text=f"✅ Película programada para publicación."
-    )
-
-
-# --- Tarea de auto-publicación (configurable + re-publicación) ---
-async def auto_post_scheduler():
-    while True:
-        try:
-            # 1. Vuelve a usar la variable global que configuras con los botones
-            total_posts_per_day = AUTO_POST_COUNT 
-            
-            if total_posts_per_day <= 0:
-                logging.warning("AUTO_POST_COUNT es 0 o menos, el auto-posting está desactivado. Revisando en 1 hora.")
-                await asyncio.sleep(3600)
-                continue
-
-            # 2. Calcula el intervalo basado en tu configuración
-            interval_seconds = (24 * 60 * 60) / total_posts_per_day
-            logging.info(f"Auto-post: {total_posts_per_day} películas/día. Próxima publicación en {interval_seconds/3600:.2f} horas.")
-
-            # 3. Lógica para seleccionar película (prioriza nuevas, luego re-publica)
-            unposted_movies = [
-                v for v in await get_all_movies() 
-                if str(v.get("last_message_id")) == 'None' or v.get("last_message_id") == ''
-            ]
-            
-            movie_info = None
-            if unposted_movies:
-                # Si hay películas "vírgenes", elige una al azar
-                movie_info = random.choice(unposted_movies)
-                logging.info(f"Auto-publicación: Seleccionando película NUEVA: {movie_info.get('title')}")
-            else:
-                # Si NO hay películas vírgenes, usa el catálogo COMPLETO
-                all_movies = await get_all_movies()
-                if all_movies:
-                    movie_info = random.choice(all_movies)
-                    logging.info(f"Auto-publicación: RE-PUBLICANDO película existente: {movie_info.get('title')}")
-                else:
-                    logging.warning("Auto-publicación: No hay películas en la base de datos para publicar.")
-            
-            # 4. Lógica de publicación (si se encontró una película)
-            if movie_info:
-                movie_id = movie_info.get("id")
-                tmdb_data = await get_movie_details(movie_id)
-                
-                if tmdb_data:
-                    # 5. Borra el post anterior (si existe) ANTES de publicar el nuevo
-                    await delete_old_post(movie_id)
-
-                    # Crear el teclado para el post
-                    post_keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
-                        [types.InlineKeyboardButton(text="🎬 Ver ahora", url=movie_info.get("link"))],
-                        [types.InlineKeyboardButton(text="✨ Pedir otra película", url="https://t.me/sdmin_dy_bot?start=request")]
-                    ])
-                    
-                    # Enviar el post (la función send_movie_post ya actualiza el last_message_id y last_posted_at)
-                    success, _ = await send_movie_post(
-                        TELEGRAM_MAIN_CHANNEL_ID, 
-                        tmdb_data, 
-                        movie_info.get("link"), 
-                        post_keyboard
-                    )
-                    
-                    if success:
-                        logging.info(f"Publicación automática de '{tmdb_data.get('title')}' enviada con éxito.")
-                    else:
-                        logging.error("Error al enviar la publicación automática.")
-                else:
-                    logging.error(f"Error: No se pudo obtener TMDB data para {movie_id} en auto-publicación.")
-            
-            # 6. Espera el intervalo calculado
-            await asyncio.sleep(interval_seconds)
-
-        except Exception as e:
-            logging.error(f"Error grave en el programador de publicaciones automáticas: {e}")
-            await asyncio.sleep(60) # Espera 60 segundos si ocurre un error grave
-
-async def check_scheduled_posts():
-    while True:
-        try:
-            while not scheduled_posts.empty():
-                movie_info, delay = scheduled_posts.get_nowait()
-                logging.info(f"Programando publicación para '{movie_info.get('names', '').split(',')[0]}' en {delay} minutos.")
-                async def publish_later(movie_info, delay):
-                    await asyncio.sleep(delay * 60)
-                    try:
-                        tmdb_data = await get_movie_details(movie_info.get("id"))
-                        if tmdb_data:
-                            await delete_old_post(movie_info.get("id"))
-                            text, poster_url, post_keyboard = create_movie_message(tmdb_data, movie_info.get("link"))
-                            success, _ = await send_movie_post(TELEGRAM_MAIN_CHANNEL_ID, tmdb_data, movie_info.get("link"), post_keyboard)
-                            if success:
-                                logging.info(f"Publicación programada de '{tmdb_data.get('title')}' enviada con éxito.")
-                            else:
-                                logging.error("Error al enviar la publicación programada.")
-                    except Exception as e:
-                        logging.error(f"Error en la tarea de publicación programada: {e}")
-                asyncio.create_task(publish_later(movie_info, delay))
-            await asyncio.sleep(60)
-        except Exception as e:
-            logging.error(f"Error en la tarea de revisión de publicaciones programadas: {e}")
-            await asyncio.sleep(60)
-
-# --- TAREA: Limpieza automática de películas antiguas (después de 2 días) ---
-async def movie_cleanup_scheduler():
-    DELETE_AFTER_DAYS = 2
-    CHECK_INTERVAL_HOURS = 6 # Revisará cada 6 horas
-    collection = get_mongo_db_collection()
-    
-    if collection is None:
-        logging.error("Limpieza de películas: No se pudo conectar a la DB. La tarea no se iniciará.")
-        return
-
-    while True:
-        try:
-            logging.info(f"Ejecutando tarea de limpieza. Borrando películas con más de {DELETE_AFTER_DAYS} días.")
-            all_movies = await get_all_movies()
-            now = datetime.datetime.now(datetime.timezone.utc)
-            
-            movies_to_reset = []
-
-            for movie in all_movies:
-                posted_at_str = movie.get("last_posted_at")
-                
-                # Si tiene un ID de mensaje pero no un timestamp, es de una versión antigua del bot.
-                # Lo marcaremos para borrado si tiene ID de mensaje.
-                if not posted_at_str and movie.get("last_message_id"):
-                    logging.warning(f"Película '{movie.get('title')}' tiene post antiguo sin timestamp. Marcando para borrado.")
-                    movies_to_reset.append(movie)
-                    continue
-
-                if not posted_at_str:
-                    continue # Nunca ha sido posteada, ignorar
-
-                try:
-                    # Convertir a datetime con timezone-aware (ISO format guarda info de timezone)
-                    posted_at_dt = datetime.datetime.fromisoformat(posted_at_str)
-                    
-                    # Asegurarse que ambos son aware o naive. ISO 8601 de python es "aware".
-                    # Si 'now' no lo es, ajústalo. (Asegurémonos que 'now' sea aware)
-                    if posted_at_dt.tzinfo is None:
-                       posted_at_dt = posted_at_dt.replace(tzinfo=datetime.timezone.utc)
-                    
-                    time_diff = now - posted_at_dt
-                    
-                    if time_diff.days >= DELETE_AFTER_DAYS:
-                        logging.info(f"Película '{movie.get('title')}' tiene {time_diff.days} días. Eliminando post...")
-                        movies_to_reset.append(movie)
-
-                except Exception as e:
-                    logging.error(f"Error procesando fecha de película {movie.get('id')} para limpieza: {e}")
-            
-            # Procesar todos los borrados
-            for movie in movies_to_reset:
-                movie_id = movie.get("id")
-                
-                # 1. Borrar los posts de los canales
-                await delete_old_post(movie_id) 
-                
-                # 2. Resetear los campos en la DB para que pueda ser re-publicada
-                await collection.update_one(
-                    {"id": movie_id},
-                    {"$set": {
-                        "last_message_id": None,
-                        "last_message_id_public": None,
-                        "last_posted_at": None
-                    }}
-                )
-                logging.info(f"Post de '{movie.get('title')}' eliminado y DB reseteada para futura re-publicación.")
-            
-            logging.info(f"Limpieza de películas completada. {len(movies_to_reset)} posts eliminados. Durmiendo por {CHECK_INTERVAL_HOURS} horas.")
-            await asyncio.sleep(CHECK_INTERVAL_HOURS * 3600)
-        
-        except Exception as e:
-            logging.error(f"Error grave en movie_cleanup_scheduler: {e}")
-            await asyncio.sleep(3600) # Esperar 1 hora si hay un error grave
-
-# --- TAREA de contenido (con auto-eliminación de 5 horas) ---
-async def channel_content_scheduler():
-    global NEWS_POST_COUNT
-    DELETE_NEWS_AFTER_HOURS = 5
-    
-    async def delete_message_later(chat_id, message_id, delay_seconds):
-        """Tarea anidada para borrar un mensaje después de un tiempo"""
-        await asyncio.sleep(delay_seconds)
-        try:
-            await bot.delete_message(chat_id=chat_id, message_id=message_id)
-            logging.info(f"Contenido (noticia/meme) {message_id} eliminado de {chat_id} tras {DELETE_NEWS_AFTER_HOURS} horas.")
-        except Exception as e:
-            logging.warning(f"No se pudo eliminar el mensaje {message_id} de {chat_id}: {e}")
-
-    while True:
-        try:
-            # Calcula los intervalos de publicación de noticias/memes en base al NEWS_POST_COUNT
-            interval_seconds = (24 * 3600) / NEWS_POST_COUNT if NEWS_POST_COUNT > 0 else 4 * 3600
-            
-            content_type = random.choice(["meme", "news"])
-            message_to_delete = None # Para guardar el mensaje que se publicará
-            
-            if content_type == "meme":
-                meme_url, meme_caption = await get_random_meme()
-                if meme_url:
-                    try:
-                        message_to_delete = await bot.send_photo(TELEGRAM_PUBLIC_CHANNEL_ID, photo=meme_url, caption=meme_caption)
-                        logging.info("Meme publicado con éxito en el canal público.")
-                    except Exception as e:
-                        logging.error(f"Error al publicar un meme en el canal público: {e}")
-                else:
-                    logging.warning("No se encontraron memes. Intentando publicar una noticia en su lugar.")
-                    content_type = "news" # Forzar que sea noticia si el meme falla
-
-            if content_type == "news":
-                articles = await get_latest_news()
-                if articles:
-                    article = random.choice(articles)
-                    text = (
-                        f"<b>{html.quote(article.get('title', 'Sin título'))}</b>\n\n"
-                        f"<i>{html.quote(article.get('description', 'Sinopsis no disponible'))}</i>\n\n"
-                        f"<a href='{html.quote(article.get('url'))}'>Leer más</a>"
-                    )
-                    poster_url = article.get("urlToImage")
-                    try:
-                        if poster_url:
-                            message_to_delete = await bot.send_photo(TELEGRAM_PUBLIC_CHANNEL_ID, photo=poster_url, caption=text, parse_mode=ParseMode.HTML)
-                        else:
-                            message_to_delete = await bot.send_message(TELEGRAM_PUBLIC_CHANNEL_ID, text, parse_mode=ParseMode.HTML)
-                        logging.info("Noticia de cine publicada con éxito en el canal público.")
-                    except Exception as e:
-                        logging.error(f"Error al publicar una noticia en el canal público: {e}")
-                else:
-                    logging.warning("No se encontraron noticias para publicar.")
-
-            # Si se publicó un meme o noticia, programar su borrado
-            if message_to_delete:
-                asyncio.create_task(delete_message_later(
-                    chat_id=TELEGRAM_PUBLIC_CHANNEL_ID,
-                    message_id=message_to_delete.message_id,
-                    delay_seconds=DELETE_NEWS_AFTER_HOURS * 3600
-                ))
-
-            await asyncio.sleep(interval_seconds)
-        except Exception as e:
-            logging.error(f"Error en el programador de contenido del canal: {e}")
-            await asyncio.sleep(60)
-
-# WEBHOOK SETUP
-async def handle_home(request):
-    return web.Response(text="Tu bot está activo y funcionando. ¡El webhook está configurado!")
-
-async def on_startup(app):
-    # Usar variable de entorno si está configurada, sino, asumir el entorno local/dev
-    RENDER_EXTERNAL_URL = os.environ.get('RENDER_EXTERNAL_URL') 
-    if RENDER_EXTERNAL_URL:
-        WEBHOOK_URL = RENDER_EXTERNAL_URL + '/webhook'
-        await bot.set_webhook(WEBHOOK_URL)
-        logging.info(f"Webhook establecido con éxito: {WEBHOOK_URL}")
-    else:
-        logging.warning("RENDER_EXTERNAL_URL no está configurada. El bot podría estar corriendo en modo polling o debe configurarse manualmente.")
-
-async def handle_telegram_webhook(request):
-    try:
-        data = await request.json()
-        update = Update.model_validate(data)
-        await dp.feed_update(bot, update)
-    except Exception as e:
-        logging.error(f"Error al procesar el webhook de Telegram: {e}")
-    finally:
-        return web.Response(text="OK")
-
-async def start_webhook_server():
-    app = web.Application()
-    app.router.add_post('/webhook', handle_telegram_webhook)
-    app.router.add_get('/', handle_home)
-    app.on_startup.append(on_startup)
-    
-    # Obtener puerto de las variables de entorno, por defecto 8080.
-    port = int(os.environ.get('PORT', 8080))
-    
-    runner = web.AppRunner(app)
-    await runner.setup()
-    site = web.TCPSite(runner, '0.0.0.0', port)
-    await site.start()
-
-# --- Añadir la nueva tarea de limpieza al main ---
-async def main():
-    
-    # Iniciar las tareas en segundo plano
-    auto_post_task = asyncio.create_task(auto_post_scheduler())
-    scheduled_posts_task = asyncio.create_task(check_scheduled_posts())
-    channel_content_task = asyncio.create_task(channel_content_scheduler())
-    movie_cleanup_task = asyncio.create_task(movie_cleanup_scheduler()) # <-- NUEVA TAREA
-    
-    webhook_task = asyncio.create_task(start_webhook_server())
-
-    try:
-        await asyncio.gather(
-            auto_post_task, 
-            scheduled_posts_task, 
-            channel_content_task, 
-            movie_cleanup_task, # <-- NUEVA TAREA
-            webhook_task
-        )
-    except asyncio.CancelledError:
-        logging.info("Las tareas automáticas han sido canceladas.")
-    except Exception as e:
-        logging.error(f"Error general en la ejecución del bot: {e}")
-        
-if __name__ == "__main__":
-    asyncio.run(main())
+import time
+IMPORT_STARTED_AT = time.perf_counter()
+
+import asyncio
+import contextlib
+import contextvars
+import cProfile
+import functools
+import io
+import json
+import pstats
+import logging
+import re
+import os
+import random
+import heapq
+import socket
+import uuid
+import hashlib
+import secrets
+import bisect
+import tempfile
+import unicodedata
+import gzip
+import shutil
+import signal
+import sys
+import threading
+from collections import Counter, deque, namedtuple, OrderedDict
+import datetime
+from zoneinfo import ZoneInfo
+from urllib.parse import urlsplit
+import aiohttp
+import motor.motor_asyncio
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo import monitoring
+from aiogram import Bot, Dispatcher, types, F, html
+from aiogram.enums import ParseMode
+from aiogram.filters import Command, CommandObject, Filter
+from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError, TelegramRetryAfter
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiohttp import web
+from aiogram.types import Update, InputMediaPhoto
+
+# --- VARIABLES DE ENTORNO ---
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+TMDB_API_KEY = os.getenv("TMDB_API_KEY")
+TRAKT_CLIENT_ID = os.getenv("TRAKT_CLIENT_ID")
+TRAKT_CLIENT_SECRET = os.getenv("TRAKT_CLIENT_SECRET")
+ADMIN_ID = os.getenv("ADMIN_ID")
+DATABASE_URL = os.getenv("DATABASE_URL")
+NEWS_API_KEY = os.getenv("NEWS_API_KEY")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")  # Servidor Bot API alternativo (local o de pruebas)
+# ----------------------------------------
+
+# Canal ID
+TELEGRAM_MAIN_CHANNEL_ID = -1002240787394
+TELEGRAM_PUBLIC_CHANNEL_ID = -1001945286271
+
+BASE_TMDB_URL = os.getenv("TMDB_BASE_URL", "https://api.themoviedb.org/3")
+POSTER_BASE_URL = "https://image.tmdb.org/t/p/w500"
+TRAKT_BASE_URL = os.getenv("TRAKT_BASE_URL", "https://api.trakt.tv")
+WELCOME_IMAGE_URL = "https://i.imgur.com/DJSUzQh.jpeg"
+
+# Pausa entre el post del canal principal y su reenvío al canal público
+PUBLIC_FORWARD_DELAY_SECONDS = float(os.getenv("PUBLIC_FORWARD_DELAY_SECONDS", "5"))
+
+# Enlace de invitación del canal principal
+MAIN_CHANNEL_INVITE_LINK = "https://t.me/click_para_ver"
+MAIN_CHANNEL_USERNAME = "click_para_ver"
+
+# Storage for recent posts
+recent_posts = deque(maxlen=20)
+user_requests = {}
+admin_data = {}
+user_message_ids = {}
+ongoing_tasks = {}
+REQUEST_LIMIT = 3
+USER_REQUEST_LIMIT = 5
+
+# Backend de contadores diarios: "memory" (una sola instancia) o "mongo" (varias réplicas)
+COUNTER_BACKEND = os.getenv("COUNTER_BACKEND", "mongo" if DATABASE_URL else "memory")
+COUNTER_CACHE_TTL = float(os.getenv("COUNTER_CACHE_TTL", "5"))
+COUNTER_FLUSH_INTERVAL = float(os.getenv("COUNTER_FLUSH_INTERVAL", "2"))
+
+# Almacenamiento de estados FSM: "memory" o "mongo" (compartido entre instancias)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "mongo" if DATABASE_URL else "memory")
+FSM_STATE_TTL_HOURS = float(os.getenv("FSM_STATE_TTL_HOURS", "24"))
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "1"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "1000"))
+
+# Modo multiproceso: con WEB_WORKERS > 1, `python bot.py` arranca un supervisor que lanza
+# WEB_WORKERS procesos con el mismo puerto (SO_REUSEPORT); cada uno recibe su WORKER_INDEX
+WEB_WORKERS = int(os.getenv("WEB_WORKERS", "1"))
+IS_WORKER_PROCESS = "WORKER_INDEX" in os.environ
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+WORKER_RESTART_DELAY_SECONDS = float(os.getenv("WORKER_RESTART_DELAY_SECONDS", "2"))
+WORKER_START_TIMEOUT_SECONDS = float(os.getenv("WORKER_START_TIMEOUT_SECONDS", "60"))
+WORKER_SHUTDOWN_TIMEOUT_SECONDS = float(os.getenv("WORKER_SHUTDOWN_TIMEOUT_SECONDS", "30"))
+
+# Elección de líder para las tareas programadas (una sola instancia ejecuta cada una)
+INSTANCE_ID = os.getenv("INSTANCE_ID") or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+if IS_WORKER_PROCESS:
+    INSTANCE_ID += f"/w{WORKER_INDEX}"
+LEASE_TTL_SECONDS = float(os.getenv("LEASE_TTL_SECONDS", "30"))
+
+# Publicaciones programadas: zona horaria para las horas absolutas y resincronización con la DB
+BOT_TIMEZONE = ZoneInfo(os.getenv("BOT_TIMEZONE", "UTC"))
+SCHEDULE_RECONCILE_SECONDS = float(os.getenv("SCHEDULE_RECONCILE_SECONDS", "300"))
+# Una publicación reclamada por una instancia que se cae vuelve a estar libre pasado este tiempo
+SCHEDULE_CLAIM_TTL_SECONDS = float(os.getenv("SCHEDULE_CLAIM_TTL_SECONDS", "600"))
+SCHEDULE_RETRY_SECONDS = float(os.getenv("SCHEDULE_RETRY_SECONDS", "300"))
+SCHEDULE_MAX_ATTEMPTS = int(os.getenv("SCHEDULE_MAX_ATTEMPTS", "3"))
+SCHEDULE_DELAY_OPTIONS = {"30m": 30, "1h": 60, "3h": 180}
+
+# Borrado diferido de noticias y memes
+EXPIRY_SWEEP_SECONDS = float(os.getenv("EXPIRY_SWEEP_SECONDS", "60"))
+EXPIRY_BATCH_SIZE = int(os.getenv("EXPIRY_BATCH_SIZE", "50"))
+EXPIRY_MAX_ATTEMPTS = 5
+# Espera base entre reintentos de un borrado fallido (se dobla en cada intento)
+EXPIRY_RETRY_BASE_SECONDS = float(os.getenv("EXPIRY_RETRY_BASE_SECONDS", "60"))
+
+# Reserva de memes precargados y huellas de contenido ya publicado
+REDDIT_MEMES_URL = os.getenv("REDDIT_MEMES_URL", "https://www.reddit.com/r/memesenespanol/.json?limit=50")
+MEME_POOL_TARGET = int(os.getenv("MEME_POOL_TARGET", "20"))
+MEME_POOL_LOW_WATERMARK = int(os.getenv("MEME_POOL_LOW_WATERMARK", "5"))
+MEME_REFILL_WAIT_SECONDS = float(os.getenv("MEME_REFILL_WAIT_SECONDS", "10"))
+MEME_MAX_IMAGE_BYTES = 10 * 1024 * 1024
+# La huella de un meme es el hash de sus primeros bytes (y del tamaño): no hace falta bajar la imagen entera
+MEME_HASH_PREFIX_BYTES = 64 * 1024
+POSTED_CONTENT_RETENTION_DAYS = int(os.getenv("POSTED_CONTENT_RETENTION_DAYS", "30"))
+
+# Reserva de noticias de NewsAPI
+NEWS_API_URL = os.getenv("NEWS_API_URL", "https://newsapi.org/v2/everything")
+NEWS_POOL_SIZE = int(os.getenv("NEWS_POOL_SIZE", "20"))
+NEWS_REFRESH_MINUTES = float(os.getenv("NEWS_REFRESH_MINUTES", "60"))
+
+# Registro de solicitudes en JSONL (se consulta con request_log_tool.py)
+REQUEST_LOG_PATH = os.getenv("REQUEST_LOG_PATH", "request_logs/requests.jsonl")
+REQUEST_LOG_FLUSH_SECONDS = float(os.getenv("REQUEST_LOG_FLUSH_SECONDS", "2"))
+REQUEST_LOG_FLUSH_EVENTS = int(os.getenv("REQUEST_LOG_FLUSH_EVENTS", "200"))
+REQUEST_LOG_MAX_BYTES = int(os.getenv("REQUEST_LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+REQUEST_LOG_KEEP_FILES = int(os.getenv("REQUEST_LOG_KEEP_FILES", "20"))
+
+# Solicitudes pendientes: una tarjeta por película para el admin y aviso a todos los solicitantes
+PENDING_CARD_DEBOUNCE_SECONDS = float(os.getenv("PENDING_CARD_DEBOUNCE_SECONDS", "5"))
+PENDING_REQUEST_TTL_DAYS = float(os.getenv("PENDING_REQUEST_TTL_DAYS", "60"))  # Sin solicitudes nuevas, se olvidan
+# Una tarjeta que lleva más de esto "enviándose" se da por perdida (p. ej. el proceso se cayó) y se reintenta
+PENDING_CARD_CLAIM_SECONDS = float(os.getenv("PENDING_CARD_CLAIM_SECONDS", "120"))
+NOTIFY_RATE_PER_SECOND = float(os.getenv("NOTIFY_RATE_PER_SECOND", "20"))
+
+# Búsqueda inline (@bot título) servida desde un índice del catálogo en memoria
+INLINE_RESULTS_PER_PAGE = int(os.getenv("INLINE_RESULTS_PER_PAGE", "20"))
+INLINE_CACHE_SECONDS = int(os.getenv("INLINE_CACHE_SECONDS", "300"))
+CATALOG_INDEX_REFRESH_MINUTES = float(os.getenv("CATALOG_INDEX_REFRESH_MINUTES", "15"))
+# Coincidencias del catálogo (tolerantes a erratas) que se muestran antes de consultar TMDB
+CATALOG_MATCHES_PER_SEARCH = int(os.getenv("CATALOG_MATCHES_PER_SEARCH", "3"))
+
+# Importación masiva del catálogo (movies.json)
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "500"))
+IMPORT_TMDB_CONCURRENCY = int(os.getenv("IMPORT_TMDB_CONCURRENCY", "8"))
+IMPORT_PROGRESS_SECONDS = float(os.getenv("IMPORT_PROGRESS_SECONDS", "3"))
+
+# Instantánea de metadatos de TMDB guardada en cada película del catálogo
+METADATA_MAX_AGE_HOURS = float(os.getenv("METADATA_MAX_AGE_HOURS", "168"))
+METADATA_BACKFILL_BATCH_SIZE = int(os.getenv("METADATA_BACKFILL_BATCH_SIZE", "200"))
+METADATA_BACKFILL_CONCURRENCY = int(os.getenv("METADATA_BACKFILL_CONCURRENCY", "4"))
+METADATA_BACKFILL_INTERVAL_MINUTES = float(os.getenv("METADATA_BACKFILL_INTERVAL_MINUTES", "60"))
+# Refresco incremental con el feed /movie/changes de TMDB (admite como mucho 14 días por consulta)
+METADATA_CHANGES_INTERVAL_HOURS = float(os.getenv("METADATA_CHANGES_INTERVAL_HOURS", "6"))
+METADATA_CHANGES_CONCURRENCY = int(os.getenv("METADATA_CHANGES_CONCURRENCY", "4"))
+TMDB_CHANGES_MAX_DAYS = 14
+
+# Comprobación periódica de los enlaces de descarga del catálogo (HEAD y, si no vale, GET)
+LINK_CHECK_INTERVAL_HOURS = float(os.getenv("LINK_CHECK_INTERVAL_HOURS", "24"))
+LINK_CHECK_BATCH_SIZE = int(os.getenv("LINK_CHECK_BATCH_SIZE", "200"))
+LINK_CHECK_CONCURRENCY = int(os.getenv("LINK_CHECK_CONCURRENCY", "16"))
+LINK_CHECK_PER_HOST = int(os.getenv("LINK_CHECK_PER_HOST", "2"))
+LINK_CHECK_TIMEOUT_SECONDS = float(os.getenv("LINK_CHECK_TIMEOUT_SECONDS", "15"))
+LINK_CHECK_MAX_ERRORS = int(os.getenv("LINK_CHECK_MAX_ERRORS", "3"))  # Fallos seguidos (timeouts, 5xx) para darlo por muerto
+# Redirecciones a una página de error (p. ej. /sharing/error de terabox) cuentan como enlace muerto
+LINK_DEAD_URL_MARKERS = tuple(marker for marker in os.getenv("LINK_DEAD_URL_MARKERS", "/error").split(",") if marker)
+LINK_DEAD_STATUSES = {404, 410}
+LINK_CHECK_USER_AGENT = "Mozilla/5.0 (compatible; CatalogLinkChecker/1.0)"
+
+# Filtro de spam: patrones en la colección spam_blocklist, recargados sin reiniciar
+SPAM_DEFAULT_PATTERNS = ("ordershunter.ru",)
+SPAM_BLOCKLIST_REFRESH_MINUTES = float(os.getenv("SPAM_BLOCKLIST_REFRESH_MINUTES", "5"))
+
+# Callback data compacto: versión + código de ruta + campos en base 36, como mucho 64 bytes
+CALLBACK_DATA_VERSION = "1"
+CALLBACK_DATA_MAX_BYTES = 64
+# Listas de resultados que se paginan desde un botón (el botón solo lleva un token)
+RESULT_SET_CACHE_SIZE = int(os.getenv("RESULT_SET_CACHE_SIZE", "1000"))
+RESULT_SET_TTL_SECONDS = int(os.getenv("RESULT_SET_TTL_SECONDS", str(24 * 3600)))
+
+# Limitador por usuario (token bucket): THROTTLE_RATE fichas por segundo hasta THROTTLE_BURST
+THROTTLE_RATE = float(os.getenv("THROTTLE_RATE", "1"))  # 0 = desactivado
+THROTTLE_BURST = float(os.getenv("THROTTLE_BURST", "12"))
+THROTTLE_CHEAP_COST = float(os.getenv("THROTTLE_CHEAP_COST", "1"))
+THROTTLE_EXPENSIVE_COST = float(os.getenv("THROTTLE_EXPENSIVE_COST", "4"))
+THROTTLE_SWEEP_SECONDS = 60
+
+# Captions y teclados de película ya renderizados (LRU por tmdb_id, variante y enlace)
+RENDER_CACHE_SIZE = int(os.getenv("RENDER_CACHE_SIZE", "2000"))
+
+# Servicio externo al que pertenece cada host[:puerto] (etiqueta de las métricas)
+EXTERNAL_SERVICE_HOSTS = {
+    urlsplit(BASE_TMDB_URL).netloc: "tmdb",
+    urlsplit(TRAKT_BASE_URL).netloc: "trakt",
+    urlsplit(NEWS_API_URL).netloc: "newsapi",
+    urlsplit(REDDIT_MEMES_URL).netloc: "reddit",
+    "i.redd.it": "reddit",
+}
+
+# Géneros de TMDB
+GENRES = {
+    "Acción": 28, "Aventura": 12, "Animación": 16, "Comedia": 35, "Crimen": 80,
+    "Documental": 99, "Drama": 18, "Familia": 10751, "Fantasía": 14, "Historia": 36,
+    "Terror": 27, "Música": 10402, "Misterio": 9648, "Romance": 10749, "Ciencia ficción": 878,
+    "Película de TV": 10770, "Suspense": 53, "Guerra": 10752, "Western": 37
+}
+
+# Logging configuration
+logging.basicConfig(level=logging.INFO)
+
+# --- Métricas (formato de texto de Prometheus) ---
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+METRICS_TOKEN = os.getenv("METRICS_TOKEN")
+SLOW_UPDATE_THRESHOLD = float(os.getenv("SLOW_UPDATE_THRESHOLD", "1.0"))
+PROFILE_SAMPLE_EVERY = int(os.getenv("PROFILE_SAMPLE_EVERY", "0"))  # 0 = cProfile desactivado
+# Si se define, cada update del webhook se guarda anonimizado en este JSONL (ver benchmarks/load_webhook.py)
+UPDATE_RECORD_PATH = os.getenv("UPDATE_RECORD_PATH")
+UPDATE_RECORD_SALT = os.getenv("UPDATE_RECORD_SALT", "")
+metrics_registry = []
+
+def format_metric_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+class CounterValue:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+class GaugeValue(CounterValue):
+    __slots__ = ()
+
+    def set(self, value):
+        self.value = value
+
+class HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        # Solo incrementa contadores ya reservados: no crea objetos por observación
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class Metric:
+    """Métrica con etiquetas. Los hijos se crean una vez por combinación y se reutilizan."""
+
+    def __init__(self, kind, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, lock=None):
+        self.kind = kind
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # Solo para métricas que se actualizan desde otros hilos; quien escribe debe tomar el mismo lock
+        self.lock = lock
+        self._children = {}
+        metrics_registry.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if self.kind == "histogram":
+                child = HistogramValue(self.buckets)
+            elif self.kind == "gauge":
+                child = GaugeValue()
+            else:
+                child = CounterValue()
+            self._children[values] = child
+        return child
+
+    def render(self):
+        with self.lock or contextlib.nullcontext():
+            return self._render()
+
+    def _render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            labels = format_metric_labels(self.labelnames, values)
+            if self.kind != "histogram":
+                lines.append(f"{self.name}{labels} {child.value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+                cumulative += count
+                bucket_labels = format_metric_labels(self.labelnames + ("le",), values + ("+Inf" if bound == float("inf") else bound,))
+                lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+UPDATES_TOTAL = Metric("counter", "bot_updates_total", "Updates de Telegram recibidos.", ("type",))
+UPDATE_DURATION = Metric("histogram", "bot_update_duration_seconds", "Tiempo total de procesamiento de un update.")
+HANDLER_DURATION = Metric("histogram", "bot_handler_duration_seconds", "Duración de cada handler.", ("handler",))
+HANDLER_ERRORS = Metric("counter", "bot_handler_errors_total", "Excepciones no controladas por handler.", ("handler",))
+EXTERNAL_DURATION = Metric("histogram", "bot_external_request_duration_seconds", "Latencia de APIs externas.", ("service",))
+EXTERNAL_ERRORS = Metric("counter", "bot_external_request_errors_total", "Errores de APIs externas (excepciones o HTTP >= 400).", ("service",))
+# El CommandListener de pymongo se ejecuta en los hilos del driver, no en el event loop
+MONGO_METRICS_LOCK = threading.Lock()
+MONGO_DURATION = Metric("histogram", "bot_mongo_command_duration_seconds", "Latencia de comandos de MongoDB.", ("command",), lock=MONGO_METRICS_LOCK)
+MONGO_ERRORS = Metric("counter", "bot_mongo_command_errors_total", "Comandos de MongoDB fallidos.", ("command",), lock=MONGO_METRICS_LOCK)
+TELEGRAM_DURATION = Metric("histogram", "bot_telegram_request_duration_seconds", "Latencia de llamadas a la Bot API.", ("method",))
+TELEGRAM_ERRORS = Metric("counter", "bot_telegram_request_errors_total", "Llamadas a la Bot API fallidas.", ("method",))
+TELEGRAM_RETRY_AFTER = Metric("counter", "bot_telegram_retry_after_total", "Respuestas RetryAfter (flood control) de la Bot API.", ("method",))
+SCHEDULER_LAG = Metric("gauge", "bot_scheduler_lag_seconds", "Retraso de la última ejecución respecto a la hora prevista.", ("scheduler",))
+STATE_SIZE = Metric("gauge", "bot_state_size", "Tamaño de las estructuras en memoria.", ("name",))
+THROTTLED_UPDATES = Metric("counter", "bot_throttled_updates_total", "Updates descartados por el limitador por usuario.", ("reason",))
+SPAM_HITS = Metric("counter", "bot_spam_hits_total", "Mensajes borrados por el filtro de spam, por patrón.", ("pattern",))
+LINK_CHECKS = Metric("counter", "bot_link_checks_total", "Comprobaciones de enlaces del catálogo, por resultado.", ("status",))
+RENDER_CACHE_REQUESTS = Metric("counter", "bot_render_cache_requests_total", "Consultas a la caché de captions y teclados.", ("kind", "result"))
+
+# Tamaños de estado que se leen en el momento del scrape
+state_size_probes = {}
+
+def render_metrics():
+    for name, probe in state_size_probes.items():
+        try:
+            STATE_SIZE.labels(name).set(probe())
+        except Exception:
+            pass
+    lines = []
+    for metric in metrics_registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# --- Perfil por update: tiempo atribuido a TMDB, MongoDB, Telegram y esperas ---
+current_update_profile = contextvars.ContextVar("current_update_profile", default=None)
+
+class UpdateProfile:
+    __slots__ = ("phases", "calls", "active", "handler")
+
+    def __init__(self):
+        self.phases = {}
+        self.calls = {}
+        self.active = set()
+        self.handler = None
+
+    def add(self, phase, elapsed):
+        self.phases[phase] = self.phases.get(phase, 0.0) + elapsed
+        self.calls[phase] = self.calls.get(phase, 0) + 1
+
+def record_phase(phase, elapsed):
+    profile = current_update_profile.get()
+    if profile is not None:
+        profile.add(phase, elapsed)
+
+def profiled(phase):
+    """Atribuye la duración de la corrutina decorada a `phase` en el update en curso."""
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            profile = current_update_profile.get()
+            if profile is None or phase in profile.active:
+                # Fuera de un update, o anidada en otra llamada de la misma fase: no se cuenta dos veces
+                return await function(*args, **kwargs)
+            profile.active.add(phase)
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                profile.active.discard(phase)
+                profile.add(phase, time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+async def profiled_sleep(seconds):
+    started = time.perf_counter()
+    await asyncio.sleep(seconds)
+    record_phase("sleep", time.perf_counter() - started)
+
+def log_slow_update(update, event_type, profile, elapsed):
+    attributed = sum(profile.phases.values())
+    logging.warning(json.dumps({
+        "event": "slow_update",
+        "update_id": update.update_id,
+        "type": event_type,
+        "handler": profile.handler,
+        "total_ms": round(elapsed * 1000, 1),
+        "phases_ms": {phase: round(value * 1000, 1) for phase, value in profile.phases.items()},
+        "unattributed_ms": round(max(elapsed - attributed, 0) * 1000, 1),
+        "calls": profile.calls,
+        "external_calls": sum(profile.calls.values()),
+    }, ensure_ascii=False))
+
+def log_update_profile(profiler, update, event_type):
+    output = io.StringIO()
+    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(20)
+    logging.info(f"Perfil cProfile del update {update.update_id} ({event_type}):\n{output.getvalue()}")
+
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    """
+    Mide cada update de principio a fin, reparte el tiempo por fases y registra un desglose
+    cuando supera SLOW_UPDATE_THRESHOLD. Con PROFILE_SAMPLE_EVERY = N > 0, uno de cada N
+    updates se ejecuta bajo cProfile (el perfil incluye lo que otras tareas hagan a la vez).
+    """
+
+    def __init__(self):
+        self._seen = 0
+        self._profiling = False
+
+    async def __call__(self, handler, event, data):
+        try:
+            event_type = event.event_type
+        except Exception:
+            event_type = "unknown"
+        UPDATES_TOTAL.labels(event_type).inc()
+
+        self._seen += 1
+        profiler = None
+        if PROFILE_SAMPLE_EVERY > 0 and self._seen % PROFILE_SAMPLE_EVERY == 0 and not self._profiling:
+            self._profiling = True
+            profiler = cProfile.Profile()
+            profiler.enable()
+
+        profile = UpdateProfile()
+        token = current_update_profile.set(profile)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - started
+            current_update_profile.reset(token)
+            UPDATE_DURATION.labels().observe(elapsed)
+            if profiler is not None:
+                profiler.disable()
+                self._profiling = False
+                log_update_profile(profiler, event, event_type)
+            if elapsed >= SLOW_UPDATE_THRESHOLD:
+                log_slow_update(event, event_type, profile, elapsed)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    def __init__(self):
+        self._children = {}  # callback -> (histograma, errores)
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        callback = handler_object.callback if handler_object is not None else None
+        children = self._children.get(callback)
+        if children is None:
+            name = getattr(callback, "__name__", "unknown")
+            children = self._children[callback] = (HANDLER_DURATION.labels(name), HANDLER_ERRORS.labels(name), name)
+        profile = current_update_profile.get()
+        if profile is not None:
+            profile.handler = children[2]
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            children[1].inc()
+            raise
+        finally:
+            children[0].observe(time.perf_counter() - started)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    def __init__(self):
+        self._children = {}  # clase del método -> (histograma, errores, retry_after)
+
+    async def __call__(self, make_request, bot, method):
+        method_type = type(method)
+        children = self._children.get(method_type)
+        if children is None:
+            name = getattr(method, "__api_method__", method_type.__name__)
+            children = self._children[method_type] = (
+                TELEGRAM_DURATION.labels(name), TELEGRAM_ERRORS.labels(name), TELEGRAM_RETRY_AFTER.labels(name)
+            )
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except TelegramRetryAfter:
+            children[2].inc()
+            children[1].inc()
+            raise
+        except Exception:
+            children[1].inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            children[0].observe(elapsed)
+            record_phase("telegram", elapsed)
+
+
+class MongoMetricsListener(monitoring.CommandListener):
+    """Lo llaman los hilos del driver: todo acceso a las métricas va bajo MONGO_METRICS_LOCK."""
+
+    def __init__(self):
+        self._children = {}
+
+    def _children_for(self, command_name):
+        # Llamar con MONGO_METRICS_LOCK tomado
+        children = self._children.get(command_name)
+        if children is None:
+            children = self._children[command_name] = (MONGO_DURATION.labels(command_name), MONGO_ERRORS.labels(command_name))
+        return children
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        with MONGO_METRICS_LOCK:
+            self._children_for(event.command_name)[0].observe(event.duration_micros / 1_000_000)
+
+    def failed(self, event):
+        with MONGO_METRICS_LOCK:
+            children = self._children_for(event.command_name)
+            children[0].observe(event.duration_micros / 1_000_000)
+            children[1].inc()
+
+mongo_metrics_listener = MongoMetricsListener()
+
+
+def external_service_for_host(host):
+    return EXTERNAL_SERVICE_HOSTS.get(host, "other")
+
+async def on_external_request_start(session, context, params):
+    context.started = time.perf_counter()
+
+async def on_external_request_end(session, context, params):
+    service = external_service_for_host(params.url.raw_authority)
+    elapsed = time.perf_counter() - context.started
+    EXTERNAL_DURATION.labels(service).observe(elapsed)
+    record_phase(service, elapsed)
+    if params.response.status >= 400:
+        EXTERNAL_ERRORS.labels(service).inc()
+
+async def on_external_request_exception(session, context, params):
+    service = external_service_for_host(params.url.raw_authority)
+    elapsed = time.perf_counter() - context.started
+    EXTERNAL_DURATION.labels(service).observe(elapsed)
+    record_phase(service, elapsed)
+    EXTERNAL_ERRORS.labels(service).inc()
+
+def create_external_trace_config():
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_external_request_start)
+    trace_config.on_request_end.append(on_external_request_end)
+    trace_config.on_request_exception.append(on_external_request_exception)
+    return trace_config
+
+
+# --- Almacenamiento FSM en MongoDB ---
+class MongoFSMStorage(BaseStorage):
+    """
+    Guarda el estado y los datos FSM de cada chat en MongoDB para que los flujos de varios
+    pasos sobrevivan a reinicios y funcionen aunque el siguiente mensaje llegue a otra instancia.
+
+    Los documentos caducan por TTL (FSM_STATE_TTL_HOURS) si el flujo se abandona. Las lecturas
+    repetidas dentro de un mismo update se sirven de una pequeña caché LRU local (FSM_CACHE_TTL).
+    """
+
+    def __init__(self, collection_name="fsm_states"):
+        self._collection_name = collection_name
+        self._key_builder = DefaultKeyBuilder(with_destiny=True)
+        self._cache = OrderedDict()  # id -> (estado, datos, instante de lectura)
+        self._indexes_ready = False
+
+    async def _get_collection(self):
+        collection = get_mongo_db_collection(self._collection_name)
+        if collection is None:
+            raise RuntimeError("No hay conexión a MongoDB para el almacenamiento FSM.")
+        if not self._indexes_ready:
+            await collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexes_ready = True
+        return collection
+
+    def _remember(self, document_id, state, data):
+        self._cache[document_id] = (state, data, time.monotonic())
+        self._cache.move_to_end(document_id)
+        while len(self._cache) > FSM_CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    @profiled("mongo")
+    async def _load(self, document_id):
+        entry = self._cache.get(document_id)
+        if entry is not None and time.monotonic() - entry[2] <= FSM_CACHE_TTL:
+            self._cache.move_to_end(document_id)
+            return entry[0], entry[1]
+
+        collection = await self._get_collection()
+        document = await collection.find_one({"_id": document_id}, {"state": 1, "data": 1})
+        state = document.get("state") if document else None
+        data = (document.get("data") or {}) if document else {}
+        self._remember(document_id, state, data)
+        return state, data
+
+    def _expires_at(self):
+        return datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=FSM_STATE_TTL_HOURS)
+
+    @profiled("mongo")
+    async def set_state(self, key, state=None):
+        document_id = self._key_builder.build(key)
+        state = state.state if isinstance(state, State) else state
+        collection = await self._get_collection()
+        if state is None:
+            await collection.update_one({"_id": document_id}, {"$unset": {"state": 1}})
+        else:
+            await collection.update_one(
+                {"_id": document_id},
+                {"$set": {"state": str(state), "expires_at": self._expires_at()}},
+                upsert=True
+            )
+        cached = self._cache.get(document_id)
+        self._remember(document_id, state, cached[1] if cached is not None else {})
+
+    async def get_state(self, key):
+        state, _ = await self._load(self._key_builder.build(key))
+        return state
+
+    @profiled("mongo")
+    async def set_data(self, key, data):
+        document_id = self._key_builder.build(key)
+        data = dict(data)
+        collection = await self._get_collection()
+        if not data:
+            await collection.update_one({"_id": document_id}, {"$unset": {"data": 1}})
+        else:
+            await collection.update_one(
+                {"_id": document_id},
+                {"$set": {"data": data, "expires_at": self._expires_at()}},
+                upsert=True
+            )
+        cached = self._cache.get(document_id)
+        self._remember(document_id, cached[0] if cached is not None else await self.get_state(key), data)
+
+    async def get_data(self, key):
+        _, data = await self._load(self._key_builder.build(key))
+        return dict(data)
+
+    async def close(self):
+        self._cache.clear()
+
+
+# --- Filtro de spam (Aho-Corasick sobre la lista de spam_blocklist) ---
+
+class AhoCorasick:
+    """Autómata de Aho-Corasick: encuentra todos los patrones en una sola pasada por el texto."""
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [()]
+        for pattern in patterns:
+            node = 0
+            for char in pattern:
+                child = self._goto[node].get(char)
+                if child is None:
+                    child = self._goto[node][char] = len(self._goto)
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append(())
+                node = child
+            self._output[node] += (pattern,)
+        # Enlaces de fallo por niveles: el sufijo más largo que también es prefijo de algún patrón
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                self._output[child] += self._output[self._fail[child]]
+
+    def find(self, text):
+        goto, fail, output = self._goto, self._fail, self._output
+        found = {}
+        node = 0
+        for char in text:
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for pattern in output[node]:
+                found[pattern] = None
+        return list(found)
+
+def normalize_spam_pattern(pattern):
+    return (pattern or "").strip().casefold()
+
+class SpamFilter:
+    """
+    Patrones activos de la colección spam_blocklist compilados en un autómata. Se recarga cada
+    SPAM_BLOCKLIST_REFRESH_MINUTES (y al momento en la instancia que atiende /spam_add o
+    /spam_remove). Los aciertos se cuentan por patrón en memoria y se suman a la colección
+    en cada recarga. Los patrones borrados quedan inactivos para que la semilla no vuelva.
+    """
+
+    def __init__(self, patterns=SPAM_DEFAULT_PATTERNS):
+        self._pending_hits = Counter()
+        self.set_patterns(patterns)
+
+    def __len__(self):
+        return len(self.patterns)
+
+    def set_patterns(self, patterns):
+        self.patterns = {normalize_spam_pattern(pattern) for pattern in patterns} - {""}
+        self._automaton = AhoCorasick(sorted(self.patterns))
+
+    def match(self, text):
+        return self._automaton.find(text.casefold()) if text else []
+
+    def record_hits(self, patterns):
+        for pattern in patterns:
+            SPAM_HITS.labels(pattern).inc()
+            self._pending_hits[pattern] += 1
+
+    async def reload(self):
+        collection = get_mongo_db_collection("spam_blocklist")
+        if collection is None:
+            return
+        if await collection.count_documents({}) == 0:
+            now = datetime.datetime.now(datetime.timezone.utc)
+            for pattern in SPAM_DEFAULT_PATTERNS:
+                await collection.update_one(
+                    {"_id": pattern},
+                    {"$setOnInsert": {"active": True, "hits": 0, "added_at": now}},
+                    upsert=True
+                )
+        documents = await collection.find({"active": {"$ne": False}}, {"_id": 1}).to_list(None)
+        self.set_patterns(document["_id"] for document in documents)
+
+    async def flush_hits(self):
+        collection = get_mongo_db_collection("spam_blocklist")
+        if collection is None or not self._pending_hits:
+            return
+        pending, self._pending_hits = self._pending_hits, Counter()
+        now = datetime.datetime.now(datetime.timezone.utc)
+        patterns = list(pending)
+        try:
+            await collection.bulk_write(
+                [UpdateOne({"_id": pattern}, {"$inc": {"hits": pending[pattern]}, "$set": {"last_hit_at": now}}) for pattern in patterns],
+                ordered=True
+            )
+        except Exception as e:
+            # Lote ordenado: lo anterior al primer error ya está escrito; el resto vuelve al contador
+            unwritten = patterns
+            if isinstance(e, BulkWriteError) and e.details.get("writeErrors"):
+                unwritten = patterns[e.details["writeErrors"][0]["index"]:]
+            self._pending_hits.update({pattern: pending[pattern] for pattern in unwritten})
+            logging.error(f"Error al guardar los aciertos de la lista de spam ({len(unwritten)} patrones se reintentarán): {e}")
+
+    async def add(self, pattern):
+        collection = get_mongo_db_collection("spam_blocklist")
+        if collection is not None:
+            await collection.update_one(
+                {"_id": pattern},
+                {"$set": {"active": True}, "$setOnInsert": {"hits": 0, "added_at": datetime.datetime.now(datetime.timezone.utc)}},
+                upsert=True
+            )
+        self.set_patterns(self.patterns | {pattern})
+
+    async def remove(self, pattern):
+        collection = get_mongo_db_collection("spam_blocklist")
+        if collection is not None:
+            await collection.update_one({"_id": pattern}, {"$set": {"active": False}})
+        self.set_patterns(self.patterns - {pattern})
+
+    async def stats(self):
+        collection = get_mongo_db_collection("spam_blocklist")
+        if collection is None:
+            return [(pattern, self._pending_hits[pattern]) for pattern in sorted(self.patterns)]
+        documents = await collection.find({"active": {"$ne": False}}).to_list(None)
+        return sorted(((document["_id"], document.get("hits", 0) + self._pending_hits[document["_id"]]) for document in documents), key=lambda item: -item[1])
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(SPAM_BLOCKLIST_REFRESH_MINUTES * 60)
+            try:
+                await self.flush_hits()
+                await self.reload()
+            except Exception as e:
+                logging.error(f"Error al recargar la lista de spam: {e}")
+
+spam_filter = SpamFilter()
+
+def message_scan_text(message):
+    """Texto, caption y URLs ocultas en entidades (text_link) de un mensaje, en un solo texto."""
+    parts = [message.text, message.caption]
+    for entity in (message.entities or []) + (message.caption_entities or []):
+        if entity.url:
+            parts.append(entity.url)
+    return "\n".join(part for part in parts if part)
+
+class SpamFilterMiddleware(BaseMiddleware):
+    """Borra los mensajes que contienen algún patrón de spam antes de que lleguen a los handlers."""
+
+    async def __call__(self, handler, event, data):
+        if event.from_user is not None and str(event.from_user.id) != ADMIN_ID:
+            matches = spam_filter.match(message_scan_text(event))
+            if matches:
+                spam_filter.record_hits(matches)
+                try:
+                    await event.delete()
+                except Exception as e:
+                    logging.error(f"No se pudo eliminar el mensaje de spam: {e}")
+                return None
+        return await handler(event, data)
+
+
+# --- Callback data compacto y versionado, con tabla de rutas ---
+
+def to_base36(number):
+    if number < 0:
+        return "-" + to_base36(-number)
+    digits = ""
+    while True:
+        number, remainder = divmod(number, 36)
+        digits = "0123456789abcdefghijklmnopqrstuvwxyz"[remainder] + digits
+        if not number:
+            return digits
+
+CALLBACK_TOKEN_RE = re.compile(r"[0-9A-Za-z_-]+")
+
+class CallbackRouteSpec:
+    """
+    Una ruta de callback: nombre, código de dos caracteres y campos tipados (int o str).
+    pack() genera "<versión><código>.<campo>..." con los enteros en base 36; los campos
+    finales a None se omiten y al desempaquetar vuelven como None.
+    """
+
+    def __init__(self, name, code, fields):
+        self.name = name
+        self.code = code
+        self.fields = fields
+        self.args_type = namedtuple(f"{name}_args", [field for field, _ in fields], defaults=[None] * len(fields))
+
+    def pack(self, *values):
+        if len(values) > len(self.fields):
+            raise ValueError(f"Demasiados valores para la ruta de callback '{self.name}'.")
+        values = list(values)
+        while values and values[-1] is None:
+            values.pop()
+        parts = [CALLBACK_DATA_VERSION + self.code]
+        for (field, kind), value in zip(self.fields, values):
+            if kind is int:
+                parts.append(to_base36(int(value)))
+            elif CALLBACK_TOKEN_RE.fullmatch(str(value)):
+                parts.append(str(value))
+            else:
+                raise ValueError(f"Valor no válido para '{self.name}.{field}': {value!r}")
+        data = ".".join(parts)
+        if len(data.encode()) > CALLBACK_DATA_MAX_BYTES:
+            raise ValueError(f"Callback data de '{self.name}' supera {CALLBACK_DATA_MAX_BYTES} bytes: {data}")
+        return data
+
+    def unpack(self, raw_values, base=36):
+        values = []
+        for (_, kind), raw in zip(self.fields, raw_values):
+            values.append(int(raw, base) if kind is int else raw)
+        return self.args_type(*values)
+
+CALLBACK_ROUTES = {}  # código -> ruta
+CALLBACK_ROUTES_BY_NAME = {}
+
+def register_callback_route(name, code, *fields):
+    if len(code) != 2 or code in CALLBACK_ROUTES or name in CALLBACK_ROUTES_BY_NAME:
+        raise ValueError(f"Ruta de callback duplicada o con código no válido: {name} ({code})")
+    route = CALLBACK_ROUTES[code] = CALLBACK_ROUTES_BY_NAME[name] = CallbackRouteSpec(name, code, fields)
+    return route
+
+def callback_data(name, *values):
+    return CALLBACK_ROUTES_BY_NAME[name].pack(*values)
+
+for _name, _code, *_fields in (
+    ("movie_exists_dummy", "ex"),
+    ("admin_add_movie", "aa", ("tmdb_id", int)),
+    ("publish_now_admin", "pa", ("tmdb_id", int)),
+    ("add_another_movie", "am"),
+    ("admin_search_catalog", "sc"),
+    ("admin_view_all_catalog", "vc"),
+    ("catalog_page", "cp", ("page", int)),
+    ("edit_movie", "em", ("tmdb_id", int)),
+    ("delete_movie", "dm", ("tmdb_id", int)),
+    ("publish_from_catalog", "pc", ("tmdb_id", int)),
+    ("set_auto", "sa", ("count", int)),
+    ("set_news", "sn", ("count", int)),
+    ("estrenos_page", "ep", ("page", int)),
+    ("search_by_actor", "ba"),
+    ("search_by_name", "bn"),
+    ("search_more", "bs", ("token", str), ("offset", int)),
+    ("recomendar_page", "rp", ("page", int)),
+    ("search_by_genre", "bg"),
+    ("back_to_search_menu", "bm"),
+    ("genre", "ge", ("genre_id", int)),
+    ("genre_page", "gp", ("genre_id", int), ("page", int)),
+    ("request_movie_from_main_menu", "rm"),
+    ("request_movie_by_id", "ri", ("tmdb_id", int)),
+    ("request_movie", "rq", ("tmdb_id", int), ("user_id", int)),
+    # requester_id solo llega en tarjetas antiguas: publish_now_from_trakt:<tmdb_id>:<user_id>
+    ("publish_now_from_trakt", "pt", ("tmdb_id", int), ("requester_id", int)),
+    ("publish_now_manual", "pn", ("tmdb_id", int)),
+    ("schedule_movie", "sm", ("tmdb_id", int)),
+    ("schedule_delay", "sd", ("delay", str), ("tmdb_id", int)),
+    ("schedule_custom", "su", ("tmdb_id", int)),
+):
+    register_callback_route(_name, _code, *_fields)
+
+# Formato anterior ("publish_now_admin:123", "schedule_30m_123"...) de los botones que siguen
+# en chats y tarjetas antiguas: prefijo -> (ruta, valores fijos que preceden a los del texto)
+LEGACY_CALLBACK_CONSTANTS = {
+    name: name for name in (
+        "movie_exists_dummy", "add_another_movie", "admin_search_catalog", "admin_view_all_catalog",
+        "search_by_actor", "search_by_name", "search_by_genre", "back_to_search_menu", "request_movie_from_main_menu",
+    )
+}
+LEGACY_CALLBACK_COLON_PREFIXES = {
+    name: (name, ()) for name in (
+        "admin_add_movie", "publish_now_admin", "catalog_page", "edit_movie", "delete_movie", "publish_from_catalog",
+        "estrenos_page", "recomendar_page", "genre", "genre_page", "request_movie_by_id", "request_movie",
+        "publish_now_from_trakt", "publish_now_manual",
+    )
+}
+LEGACY_CALLBACK_UNDERSCORE_PREFIXES = {
+    "set_auto": ("set_auto", ()),
+    "set_news": ("set_news", ()),
+    "schedule_movie": ("schedule_movie", ()),
+    "schedule_custom": ("schedule_custom", ()),
+    **{f"schedule_{delay}": ("schedule_delay", (delay,)) for delay in SCHEDULE_DELAY_OPTIONS},
+}
+
+def decode_callback_data(data):
+    """(ruta, argumentos) de un callback data nuevo o antiguo, o (None, None) si no se reconoce."""
+    if not data:
+        return None, None
+    try:
+        if data[0] == CALLBACK_DATA_VERSION:
+            route = CALLBACK_ROUTES.get(data[1:3])
+            if route is None:
+                return None, None
+            return route, route.unpack(data[4:].split(".") if len(data) > 3 else ())
+        if data in LEGACY_CALLBACK_CONSTANTS:
+            route = CALLBACK_ROUTES_BY_NAME[LEGACY_CALLBACK_CONSTANTS[data]]
+            return route, route.args_type()
+        prefix, separator, rest = data.partition(":")
+        legacy = LEGACY_CALLBACK_COLON_PREFIXES.get(prefix) if separator else None
+        if legacy is None:
+            prefix, separator, rest = data.rpartition("_")
+            legacy = LEGACY_CALLBACK_UNDERSCORE_PREFIXES.get(prefix)
+        if legacy is None:
+            return None, None
+        route_name, fixed_values = legacy
+        route = CALLBACK_ROUTES_BY_NAME[route_name]
+        return route, route.unpack((*fixed_values, *rest.split(":")), base=10)
+    except ValueError:
+        logging.warning(f"Callback data no válido: {data!r}")
+        return None, None
+
+class CallbackDataMiddleware(BaseMiddleware):
+    """Decodifica el callback data una sola vez por update: deja la ruta y sus argumentos en `data`."""
+
+    async def __call__(self, handler, event, data):
+        data["callback_route"], data["callback_args"] = decode_callback_data(event.data)
+        return await handler(event, data)
+
+class CallbackRoute(Filter):
+    """Filtro de handler por nombre de ruta: compara con la ruta ya decodificada por el middleware."""
+
+    def __init__(self, name):
+        self.route = CALLBACK_ROUTES_BY_NAME[name]
+
+    async def __call__(self, callback_query: types.CallbackQuery, callback_route=None):
+        return callback_route is self.route
+
+class ResultSetStore:
+    """
+    Listas de IDs (p. ej. los resultados de una búsqueda) guardadas tras un token corto, para
+    que un botón "Ver más" pueda paginarlas sin volver a buscar. LRU en memoria y copia en la
+    colección result_sets (índice TTL) para que el botón funcione en cualquier instancia.
+    """
+
+    def __init__(self, max_entries=RESULT_SET_CACHE_SIZE, ttl_seconds=RESULT_SET_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # token -> (caduca en, ids)
+        self._indexes_ready = False
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def _get_collection(self):
+        collection = get_mongo_db_collection("result_sets")
+        if collection is not None and not self._indexes_ready:
+            await collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexes_ready = True
+        return collection
+
+    @profiled("mongo")
+    async def put(self, ids):
+        token = secrets.token_urlsafe(6)
+        self._entries[token] = (time.monotonic() + self.ttl_seconds, list(ids))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        try:
+            collection = await self._get_collection()
+            if collection is not None:
+                expires_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=self.ttl_seconds)
+                await collection.insert_one({"_id": token, "ids": list(ids), "expires_at": expires_at})
+        except Exception as e:
+            logging.error(f"Error al guardar la lista de resultados {token}: {e}")
+        return token
+
+    @profiled("mongo")
+    async def get(self, token):
+        entry = self._entries.get(token)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(token)
+                return entry[1]
+            del self._entries[token]
+        try:
+            collection = await self._get_collection()
+            if collection is None:
+                return None
+            document = await collection.find_one({"_id": token, "expires_at": {"$gt": datetime.datetime.now(datetime.timezone.utc)}})
+        except Exception as e:
+            logging.error(f"Error al leer la lista de resultados {token}: {e}")
+            return None
+        return document.get("ids") if document else None
+
+result_sets = ResultSetStore()
+
+
+# --- Limitador por usuario (token bucket) ---
+
+# Acciones que disparan varias llamadas a TMDB y varios envíos: cuestan THROTTLE_EXPENSIVE_COST
+THROTTLE_EXPENSIVE_CALLBACKS = {
+    "estrenos_page", "recomendar_page", "genre", "genre_page", "search_more", "request_movie_by_id", "request_movie",
+}
+THROTTLE_EXPENSIVE_TEXTS = {"🎞️ Estrenos", "✨ Recomiéndame", "📰 Noticias"}
+THROTTLE_EXPENSIVE_STATES = {
+    "MovieRequestStates:waiting_for_search_query",
+    "MovieRequestStates:waiting_for_actor_name",
+    "MovieRequestStates:waiting_for_movie_name_to_request",
+}
+
+class TokenBucketLimiter:
+    """
+    Un token bucket por clave: (fichas, última actualización, ya avisado) en una tupla.
+    Un bucket que ha tenido tiempo de llenarse equivale a uno nuevo, así que sweep() lo borra:
+    solo se guardan los usuarios activos en los últimos burst / rate segundos.
+    """
+
+    def __init__(self, rate=THROTTLE_RATE, burst=THROTTLE_BURST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._last_sweep = time.monotonic()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def _tokens(self, key, now):
+        tokens, updated_at, warned = self._buckets.get(key, (self.burst, now, False))
+        return min(self.burst, tokens + (now - updated_at) * self.rate), warned
+
+    def take(self, key, cost, now=None):
+        """True si había fichas suficientes y se han consumido; False si hay que descartar la acción."""
+        now = time.monotonic() if now is None else now
+        if now - self._last_sweep >= THROTTLE_SWEEP_SECONDS:
+            self.sweep(now)
+        tokens, _ = self._tokens(key, now)
+        if tokens < cost:
+            return False
+        self._buckets[key] = (tokens - cost, now, False)
+        return True
+
+    def should_warn(self, key, now=None):
+        """True solo la primera vez que se descarta una acción desde la última aceptada."""
+        now = time.monotonic() if now is None else now
+        tokens, warned = self._tokens(key, now)
+        self._buckets[key] = (tokens, now, True)
+        return not warned
+
+    def sweep(self, now=None):
+        now = time.monotonic() if now is None else now
+        self._last_sweep = now
+        full = [key for key, (tokens, updated_at, _) in self._buckets.items() if tokens + (now - updated_at) * self.rate >= self.burst]
+        for key in full:
+            del self._buckets[key]
+
+class ThrottleMiddleware(BaseMiddleware):
+    """
+    Limita por usuario los mensajes y callbacks (el administrador queda exento). Un toque repetido
+    mientras el anterior sigue en curso se descarta sin gastar fichas; si no quedan fichas, el
+    callback se responde con "Espera un momento" y el mensaje se ignora (avisando una sola vez).
+    """
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self._in_flight = set()
+
+    def _cost(self, event, data):
+        if isinstance(event, types.CallbackQuery):
+            route = data.get("callback_route")
+            expensive = route is not None and route.name in THROTTLE_EXPENSIVE_CALLBACKS
+        else:
+            expensive = event.text in THROTTLE_EXPENSIVE_TEXTS or data.get("raw_state") in THROTTLE_EXPENSIVE_STATES
+        return THROTTLE_EXPENSIVE_COST if expensive else THROTTLE_CHEAP_COST
+
+    async def _reject(self, event, reason):
+        THROTTLED_UPDATES.labels(reason).inc()
+        try:
+            if isinstance(event, types.CallbackQuery):
+                await event.answer("⏳ Espera un momento")
+            elif reason == "rate" and self.limiter.should_warn(event.from_user.id):
+                await event.answer("⏳ Espera un momento antes de volver a intentarlo.")
+        except Exception as e:
+            logging.error(f"Error al avisar del límite de peticiones: {e}")
+
+    async def __call__(self, handler, event, data):
+        user = event.from_user
+        if THROTTLE_RATE <= 0 or user is None or str(user.id) == ADMIN_ID:
+            return await handler(event, data)
+        # Solo se agrupan toques con el mismo texto o callback; fotos y álbumes pasan siempre
+        payload = event.data if isinstance(event, types.CallbackQuery) else event.text
+        key = (user.id, payload) if payload is not None else None
+        if key is not None and key in self._in_flight:
+            await self._reject(event, "duplicate")
+            return None
+        if not self.limiter.take(user.id, self._cost(event, data)):
+            await self._reject(event, "rate")
+            return None
+        if key is None:
+            return await handler(event, data)
+        self._in_flight.add(key)
+        try:
+            return await handler(event, data)
+        finally:
+            self._in_flight.discard(key)
+
+user_limiter = TokenBucketLimiter()
+
+
+def create_fsm_storage():
+    if FSM_STORAGE == "mongo":
+        return MongoFSMStorage()
+    return MemoryStorage()
+
+# Bot, dispatcher, and database initialization
+bot = Bot(
+    token=TELEGRAM_BOT_TOKEN,
+    session=AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None,
+    default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+)
+dp = Dispatcher(storage=create_fsm_storage())
+bot.session.middleware(TelegramMetricsMiddleware())
+dp.update.outer_middleware(UpdateTimingMiddleware())
+dp.message.outer_middleware(SpamFilterMiddleware())
+dp.edited_message.outer_middleware(SpamFilterMiddleware())
+dp.callback_query.outer_middleware(CallbackDataMiddleware())
+dp.message.outer_middleware(ThrottleMiddleware(user_limiter))
+dp.callback_query.outer_middleware(ThrottleMiddleware(user_limiter))
+dp.message.middleware(HandlerMetricsMiddleware())
+dp.callback_query.middleware(HandlerMetricsMiddleware())
+
+AUTO_POST_COUNT = 8 # Valor por defecto
+NEWS_POST_COUNT = 4 # Variable para controlar la cantidad de noticias por día
+
+MOVIES_PER_PAGE = 5
+SEARCH_RESULTS_PER_PAGE = 5
+RECOMENDACIONES_PER_PAGE = 5
+ESTRENOS_PER_PAGE = 5
+
+# New states for the state machine
+class MovieUploadStates(StatesGroup):
+    waiting_for_movie_info = State()
+    waiting_for_requested_movie_link = State()
+    waiting_for_admin_movie_name = State()
+    waiting_for_admin_movie_link = State()
+
+class MovieRequestStates(StatesGroup):
+    waiting_for_movie_name = State()
+    waiting_for_actor_name = State()
+    waiting_for_confirmation = State()
+    waiting_for_search_query = State()
+    waiting_for_movie_name_to_request = State()
+
+class AdminStates(StatesGroup):
+    waiting_for_auto_post_count = State()
+    waiting_for_manual_movie_info = State()
+    waiting_for_edit_movie_info = State()
+    waiting_for_catalog_search_query = State()
+    waiting_for_news_post_count = State() # NUEVO ESTADO PARA NOTICIAS
+    waiting_for_schedule_time = State()
+
+
+class SupportStates(StatesGroup):
+    waiting_for_support_message = State()
+
+# --- Funciones de Base de Datos (Motor - Asíncrono) ---
+
+mongo_client = None
+
+def get_mongo_database():
+    global mongo_client
+    try:
+        if mongo_client is None:
+            connection_string = os.getenv("DATABASE_URL")
+            if not connection_string:
+                logging.error("DATABASE_URL no está configurada. No se puede conectar a la base de datos.")
+                return None
+            # Un único cliente por proceso: reutiliza el pool de conexiones en vez de abrir uno por consulta
+            mongo_client = motor.motor_asyncio.AsyncIOMotorClient(connection_string, event_listeners=[mongo_metrics_listener])
+        return mongo_client["movies_database"]
+    except Exception as e:
+        logging.error(f"Error al conectar con MongoDB: {e}")
+        return None
+
+def get_mongo_db_collection(collection_name="movies_collection"):
+    db = get_mongo_database()
+    if db is None:
+        return None
+    return db[collection_name]
+
+@profiled("mongo")
+async def save_movie_to_db(movie_data):
+    collection = get_mongo_db_collection()
+    if collection is None:
+        return
+
+    try:
+        movie_id = movie_data.get("id")
+        
+        update = {"$set": movie_data}
+        if movie_data.get("link"):
+            # Un enlace nuevo o repuesto se vuelve a comprobar en la siguiente pasada
+            update["$unset"] = {field: "" for field in LINK_CHECK_FIELDS}
+        await collection.update_one(
+            {"id": movie_id},
+            update,
+            upsert=True
+        )
+        invalidate_rendered_movie(movie_id)
+        catalog_index.upsert(movie_data)
+        logging.info(f"Película '{movie_data.get('title')}' guardada/actualizada en MongoDB.")
+    except Exception as e:
+        logging.error(f"Error al guardar la película en MongoDB: {e}")
+
+@profiled("mongo")
+async def get_movie_by_tmdb_id(tmdb_id):
+    collection = get_mongo_db_collection()
+    if collection is None:
+        return None
+
+    try:
+        movie_document = await collection.find_one({"id": tmdb_id})
+        return movie_document
+    except Exception as e:
+        logging.error(f"Error al obtener la película de MongoDB: {e}")
+        return None
+
+@profiled("mongo")
+async def find_movie_in_db_by_name(title_to_find):
+    collection = get_mongo_db_collection()
+    if collection is None:
+        return None
+
+    try:
+        movie_document = await collection.find_one({
+            "$or": [
+                {"title": {"$regex": title_to_find, "$options": "i"}},
+                {"names": {"$regex": title_to_find, "$options": "i"}}
+            ]
+        })
+        return movie_document
+    except Exception as e:
+        logging.error(f"Error al buscar película por nombre en MongoDB: {e}")
+        return None
+
+@profiled("mongo")
+async def get_all_movies():
+    collection = get_mongo_db_collection()
+    if collection is None:
+        return []
+    
+    try:
+        movies_list = await collection.find({}).sort("added_at", -1).to_list(None)
+        return movies_list
+    except Exception as e:
+        logging.error(f"Error al obtener todas las películas de MongoDB: {e}")
+        return []
+
+@profiled("mongo")
+async def delete_movie_from_db(movie_id):
+    collection = get_mongo_db_collection()
+    if collection is None:
+        return
+
+    try:
+        await collection.delete_one({"id": movie_id})
+        invalidate_rendered_movie(movie_id)
+        catalog_index.remove(movie_id)
+        logging.info(f"Película con ID {movie_id} eliminada de MongoDB.")
+    except Exception as e:
+        logging.error(f"Error al eliminar la película de MongoDB: {e}")
+
+
+# --- Índice del catálogo en memoria (búsqueda inline por prefijo y tolerante a erratas) ---
+
+NON_ALNUM_RE = re.compile(r"[\W_]+")
+
+def fold_text(text):
+    """Minúsculas sin acentos y solo letras/números separados por un espacio: "¡Érase una vez!" -> "erase una vez"."""
+    text = text or ""
+    if not text.isascii():
+        text = "".join(c for c in unicodedata.normalize("NFKD", text) if not unicodedata.combining(c))
+    return " ".join(NON_ALNUM_RE.sub(" ", text.casefold()).split())
+
+def text_trigrams(folded):
+    """Trigramas de un texto ya normalizado, con un espacio de relleno en cada extremo."""
+    padded = f" {folded} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def bounded_edit_distance(a, b, limit):
+    """
+    Distancia de Levenshtein entre a y b, o limit + 1 en cuanto se sabe que la supera.
+    Solo calcula la banda de la matriz a menos de `limit` de la diagonal.
+    """
+    over = limit + 1
+    if abs(len(a) - len(b)) > limit:
+        return over
+    if a == b:
+        return 0
+    previous = [j if j <= limit else over for j in range(len(b) + 1)]
+    for i, char_a in enumerate(a, 1):
+        current = [over] * (len(b) + 1)
+        if i <= limit:
+            current[0] = i
+        row_min = current[0]
+        for j in range(max(1, i - limit), min(len(b), i + limit) + 1):
+            cost = previous[j - 1] + (char_a != b[j - 1])
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost
+            if cost < row_min:
+                row_min = cost
+        if row_min > limit:
+            return over
+        previous = current
+    return min(previous[-1], over)
+
+class CatalogIndex:
+    """
+    Copia en memoria de los campos del catálogo necesarios para buscar (id, título, nombres,
+    enlace y póster), con una lista ordenada de claves para buscar por prefijo con bisect.
+    Cada nombre aporta una clave por palabra ("el padrino" -> "el padrino", "padrino"), así
+    "padr" encuentra la película. Para las búsquedas con erratas ("el padrinno") guarda además
+    un índice invertido de trigramas de los nombres normalizados: los trigramas compartidos
+    eligen unos pocos candidatos y la distancia de edición decide cuáles coinciden.
+    Se recarga entera al arrancar y cada CATALOG_INDEX_REFRESH_MINUTES, y se actualiza al
+    guardar o borrar películas.
+    """
+
+    FIELDS = ("id", "title", "names", "link", "poster_path", "original_title", "added_at")
+
+    def __init__(self):
+        self.movies = {}
+        self._keys = []  # (clave, rango, tmdb_id); rango 0 = empieza el nombre, 1 = empieza una palabra
+        self._keys_by_id = {}
+        self._trigrams = {}  # trigrama -> IDs con algún nombre que lo contiene
+        self._folded_by_id = {}  # tmdb_id -> nombres normalizados
+        self._recent = None  # se ordena al pedirlo: guardar una película no reordena todo el catálogo
+        self.loaded_at = None
+
+    def __len__(self):
+        return len(self.movies)
+
+    @staticmethod
+    def movie_names(movie):
+        names = movie.get("names") or []
+        if isinstance(names, str):
+            names = names.split(", ")
+        return [name for name in [movie.get("title"), movie.get("original_title"), *names] if name]
+
+    def folded_names(self, movie):
+        return tuple(dict.fromkeys(filter(None, map(fold_text, self.movie_names(movie)))))
+
+    @staticmethod
+    def _movie_keys(tmdb_id, folded_names):
+        keys = set()
+        for name in folded_names:
+            words = name.split()
+            for position in range(len(words)):
+                keys.add((" ".join(words[position:]), 0 if position == 0 else 1, tmdb_id))
+        return keys
+
+    @staticmethod
+    def _add_trigrams(tmdb_id, folded_names, trigrams):
+        for trigram in set().union(*map(text_trigrams, folded_names)):
+            trigrams.setdefault(trigram, set()).add(tmdb_id)
+
+    def _refresh_recent(self):
+        self._recent = None
+
+    def recent(self, limit):
+        if self._recent is None:
+            self._recent = sorted(self.movies, key=lambda tmdb_id: str(self.movies[tmdb_id].get("added_at") or ""), reverse=True)
+        return self._recent[:limit]
+
+    async def reload(self):
+        collection = get_mongo_db_collection()
+        if collection is None:
+            return
+        projection = {field: 1 for field in self.FIELDS}
+        movies, keys, keys_by_id, trigrams, folded_by_id = {}, [], {}, {}, {}
+        async for document in collection.find({}, projection):
+            if document.get("id") is None:
+                continue
+            movie = {field: document.get(field) for field in self.FIELDS}
+            movies[movie["id"]] = movie
+            folded_names = folded_by_id[movie["id"]] = self.folded_names(movie)
+            movie_keys = self._movie_keys(movie["id"], folded_names)
+            keys_by_id[movie["id"]] = movie_keys
+            keys.extend(movie_keys)
+            self._add_trigrams(movie["id"], folded_names, trigrams)
+        keys.sort()
+        self.movies, self._keys, self._keys_by_id = movies, keys, keys_by_id
+        self._trigrams, self._folded_by_id = trigrams, folded_by_id
+        self._refresh_recent()
+        self.loaded_at = time.monotonic()
+        logging.info(f"Índice del catálogo cargado: {len(movies)} películas, {len(keys)} claves, {len(trigrams)} trigramas.")
+
+    def _merge(self, movie_data):
+        tmdb_id = movie_data["id"]
+        movie = dict(self.movies.get(tmdb_id) or {field: None for field in self.FIELDS})
+        movie.update({field: movie_data[field] for field in self.FIELDS if movie_data.get(field) is not None})
+        self.movies[tmdb_id] = movie
+        return movie
+
+    def upsert(self, movie_data):
+        """Mezcla los campos conocidos de un documento guardado (puede venir incompleto)."""
+        if movie_data.get("id") is None:
+            return
+        movie = self._merge(movie_data)
+        self._drop_keys(movie["id"])
+        folded_names = self._folded_by_id[movie["id"]] = self.folded_names(movie)
+        movie_keys = self._movie_keys(movie["id"], folded_names)
+        self._keys_by_id[movie["id"]] = movie_keys
+        for key in movie_keys:
+            bisect.insort(self._keys, key)
+        self._add_trigrams(movie["id"], folded_names, self._trigrams)
+        self._refresh_recent()
+
+    def upsert_many(self, movies_data):
+        """Como upsert() para muchas películas a la vez: reordena las claves una sola vez."""
+        for movie_data in movies_data:
+            if movie_data.get("id") is None:
+                continue
+            movie = self._merge(movie_data)
+            self._drop_trigrams(movie["id"])
+            folded_names = self._folded_by_id[movie["id"]] = self.folded_names(movie)
+            self._keys_by_id[movie["id"]] = self._movie_keys(movie["id"], folded_names)
+            self._add_trigrams(movie["id"], folded_names, self._trigrams)
+        self._keys = sorted(key for movie_keys in self._keys_by_id.values() for key in movie_keys)
+        self._refresh_recent()
+
+    def _drop_keys(self, tmdb_id):
+        for key in self._keys_by_id.pop(tmdb_id, ()):
+            position = bisect.bisect_left(self._keys, key)
+            if position < len(self._keys) and self._keys[position] == key:
+                self._keys.pop(position)
+        self._drop_trigrams(tmdb_id)
+
+    def _drop_trigrams(self, tmdb_id):
+        for trigram in set().union(*map(text_trigrams, self._folded_by_id.pop(tmdb_id, ()))):
+            postings = self._trigrams.get(trigram)
+            if postings is not None:
+                postings.discard(tmdb_id)
+                if not postings:
+                    del self._trigrams[trigram]
+
+    def remove(self, tmdb_id):
+        self._drop_keys(tmdb_id)
+        if self.movies.pop(tmdb_id, None) is not None:
+            self._refresh_recent()
+
+    def search_prefix(self, query, limit=1000):
+        """IDs cuyo nombre (o alguna palabra de él) empieza por `query`; primero los de nombre completo."""
+        folded = fold_text(query)
+        if not folded:
+            return self.recent(limit)
+        best = {}
+        position = bisect.bisect_left(self._keys, (folded,))
+        while position < len(self._keys) and len(best) < limit:
+            key, rank, tmdb_id = self._keys[position]
+            if not key.startswith(folded):
+                break
+            if rank < best.get(tmdb_id, 2):
+                best[tmdb_id] = rank
+            position += 1
+        return sorted(best, key=lambda tmdb_id: (best[tmdb_id], (self.movies[tmdb_id].get("title") or "").casefold()))
+
+    @staticmethod
+    def _name_distance(folded_query, folded_name, limit):
+        """Distancia al nombre completo o a cualquier tramo de palabras seguidas de igual longitud que la consulta."""
+        best = bounded_edit_distance(folded_query, folded_name, limit)
+        query_words = folded_query.count(" ") + 1
+        words = folded_name.split()
+        for position in range(len(words) - query_words + 1 if len(words) > query_words else 0):
+            if best == 0:
+                break
+            window = " ".join(words[position:position + query_words])
+            best = min(best, bounded_edit_distance(folded_query, window, min(limit, best - 1)))
+        return best
+
+    def search_fuzzy(self, query, limit=3, max_candidates=50):
+        """
+        IDs cuyo nombre (completo o un tramo de palabras) está a pocas ediciones de `query`:
+        una errata cada cuatro letras, tres como mucho. Ordenados por distancia y después
+        por trigramas en común.
+        """
+        folded = fold_text(query)
+        if len(folded) < 3:
+            return []
+        max_distance = min(3, max(1, len(folded) // 4))
+        postings = sorted((self._trigrams.get(trigram, ()) for trigram in text_trigrams(folded)), key=len)
+        # Cada edición estropea como mucho tres trigramas, así que un nombre que coincida comparte
+        # al menos uno de los 3 * max_distance + 1 más raros: los muy comunes (" el", "la ") no
+        # hace falta recorrerlos para encontrar candidatos
+        shared = Counter()
+        for posting in postings[:3 * max_distance + 1]:
+            shared.update(posting)
+        matches = []
+        for tmdb_id, count in shared.most_common(max_candidates):
+            # Con `limit` resultados ya encontrados solo interesa lo que los mejore
+            bound = max_distance if len(matches) < limit else min(max_distance, matches[limit - 1][0] - 1)
+            if bound < 0:
+                break
+            distance = min(self._name_distance(folded, name, bound) for name in self._folded_by_id[tmdb_id])
+            if distance <= bound:
+                matches.append((distance, -count, tmdb_id))
+                matches.sort()
+        return [tmdb_id for _, _, tmdb_id in matches[:limit]]
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(CATALOG_INDEX_REFRESH_MINUTES * 60)
+            try:
+                await self.reload()
+            except Exception as e:
+                logging.error(f"Error al recargar el índice del catálogo: {e}")
+
+catalog_index = CatalogIndex()
+
+
+# --- Contadores diarios de solicitudes (REQUEST_LIMIT / USER_REQUEST_LIMIT) ---
+
+def counter_day():
+    return datetime.date.today().isoformat()
+
+class MemoryCounterBackend:
+    """Contadores por día en memoria. Solo válido con una única instancia del bot."""
+
+    def __init__(self):
+        self._counts = {}
+
+    async def get(self, scope, key):
+        entry = self._counts.get((scope, key))
+        if entry is None or entry[0] != counter_day():
+            return 0
+        return entry[1]
+
+    async def incr(self, scope, key, amount=1):
+        day = counter_day()
+        entry = self._counts.get((scope, key))
+        count = (entry[1] if entry is not None and entry[0] == day else 0) + amount
+        self._counts[(scope, key)] = (day, count)
+        return count
+
+    async def flush(self):
+        # Descarta los contadores de días anteriores
+        day = counter_day()
+        for counter_key in [k for k, (d, _) in self._counts.items() if d != day]:
+            del self._counts[counter_key]
+
+
+class MongoCounterBackend:
+    """
+    Contadores por día en MongoDB, compartidos entre réplicas.
+
+    Cada contador es un documento `{_id: "scope:key:día", count, expires_at}` que se
+    incrementa con `$inc` atómico; el índice TTL sobre `expires_at` borra los días viejos.
+    Las lecturas se sirven de una caché local (COUNTER_CACHE_TTL) y los incrementos se
+    acumulan localmente y se escriben en lote cada COUNTER_FLUSH_INTERVAL segundos.
+    """
+
+    def __init__(self, collection_name="daily_counters"):
+        self._collection_name = collection_name
+        self._cache = {}  # bucket -> (valor remoto, instante de lectura)
+        self._pending = {}  # bucket -> incremento aún no escrito
+        self._indexes_ready = False
+
+    def _bucket(self, scope, key):
+        return f"{scope}:{key}:{counter_day()}"
+
+    async def _get_collection(self):
+        collection = get_mongo_db_collection(self._collection_name)
+        if collection is not None and not self._indexes_ready:
+            await collection.create_index("expires_at", expireAfterSeconds=0)
+            self._indexes_ready = True
+        return collection
+
+    @profiled("mongo")
+    async def _fetch(self, bucket):
+        try:
+            collection = await self._get_collection()
+            if collection is None:
+                return None
+            document = await collection.find_one({"_id": bucket}, {"count": 1})
+            return document.get("count", 0) if document else 0
+        except Exception as e:
+            logging.error(f"Error al leer el contador {bucket} de MongoDB: {e}")
+            return None
+
+    async def get(self, scope, key):
+        bucket = self._bucket(scope, key)
+        now = time.monotonic()
+        cached = self._cache.get(bucket)
+        if cached is None or now - cached[1] > COUNTER_CACHE_TTL:
+            remote = await self._fetch(bucket)
+            if remote is None:
+                remote = cached[0] if cached is not None else 0
+            cached = (remote, now)
+            self._cache[bucket] = cached
+        return cached[0] + self._pending.get(bucket, 0)
+
+    async def incr(self, scope, key, amount=1):
+        bucket = self._bucket(scope, key)
+        self._pending[bucket] = self._pending.get(bucket, 0) + amount
+        return await self.get(scope, key)
+
+    async def flush(self):
+        today_suffix = f":{counter_day()}"
+        for bucket in [b for b in self._cache if not b.endswith(today_suffix)]:
+            del self._cache[bucket]
+
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+
+        # Se aplica el incremento a la caché antes de escribir para no contar de menos mientras tanto
+        for bucket, delta in pending.items():
+            remote, fetched_at = self._cache.get(bucket, (0, 0.0))
+            self._cache[bucket] = (remote + delta, fetched_at)
+
+        expires_at = datetime.datetime.combine(
+            datetime.date.today() + datetime.timedelta(days=2), datetime.time.min
+        )
+        operations = [
+            UpdateOne(
+                {"_id": bucket},
+                {"$inc": {"count": delta}, "$setOnInsert": {"expires_at": expires_at}},
+                upsert=True
+            )
+            for bucket, delta in pending.items()
+        ]
+        try:
+            collection = await self._get_collection()
+            if collection is None:
+                raise RuntimeError("sin conexión a la base de datos")
+            await collection.bulk_write(operations, ordered=False)
+        except Exception as e:
+            logging.error(f"Error al escribir {len(operations)} contadores en MongoDB, se reintentará: {e}")
+            for bucket, delta in pending.items():
+                remote, fetched_at = self._cache.get(bucket, (delta, 0.0))
+                self._cache[bucket] = (remote - delta, fetched_at)
+                self._pending[bucket] = self._pending.get(bucket, 0) + delta
+
+
+def create_counter_backend():
+    if COUNTER_BACKEND == "mongo":
+        return MongoCounterBackend()
+    return MemoryCounterBackend()
+
+request_counters = create_counter_backend()
+
+async def counter_flush_scheduler():
+    while True:
+        await asyncio.sleep(COUNTER_FLUSH_INTERVAL)
+        try:
+            await request_counters.flush()
+        except Exception as e:
+            logging.error(f"Error al sincronizar los contadores de solicitudes: {e}")
+
+
+# --- Registro de solicitudes (JSONL append-only con buffer, fsync por lotes y rotación) ---
+
+class RequestLog:
+    """
+    Los handlers añaden eventos a un buffer en memoria sin bloquear; `run()` los vuelca cada
+    REQUEST_LOG_FLUSH_SECONDS (o antes si se acumulan REQUEST_LOG_FLUSH_EVENTS) en un hilo, con
+    un único write + fsync por lote. Al pasar de REQUEST_LOG_MAX_BYTES el fichero se rota a
+    <nombre>-<fecha>.jsonl.gz y se conservan los REQUEST_LOG_KEEP_FILES más recientes.
+    """
+
+    def __init__(self, path, max_bytes, keep_files):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.keep_files = keep_files
+        self._buffer = []
+        self._file = None
+        self._flush_lock = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def log(self, event, **fields):
+        self.append({"ts": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="milliseconds"), "event": event, **fields})
+
+    def append(self, record):
+        """Añade un registro ya formado al buffer; se escribe tal cual como una línea JSON."""
+        if not self.path:
+            return
+        self._buffer.append(record)
+        if len(self._buffer) >= REQUEST_LOG_FLUSH_EVENTS:
+            self._wakeup.set()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._buffer:
+                return
+            events, self._buffer = self._buffer, []
+            data = "".join(json.dumps(e, ensure_ascii=False, default=str) + "\n" for e in events).encode("utf-8")
+            try:
+                await asyncio.to_thread(self._write, data)
+            except Exception as e:
+                logging.error(f"Error al escribir el registro de solicitudes ({len(events)} eventos perdidos): {e}")
+
+    def _write(self, data):
+        # Se ejecuta fuera del event loop
+        if self._file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._file = open(self.path, "ab")
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        if self._file.tell() >= self.max_bytes:
+            self._rotate()
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        base, extension = os.path.splitext(self.path)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+        rotated = f"{base}-{stamp}{extension}"
+        os.replace(self.path, rotated)
+        with open(rotated, "rb") as source, gzip.open(rotated + ".gz", "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.remove(rotated)
+        logging.info(f"Registro de solicitudes rotado a {rotated}.gz")
+
+        directory = os.path.dirname(self.path) or "."
+        prefix = os.path.basename(base) + "-"
+        archives = sorted(name for name in os.listdir(directory) if name.startswith(prefix) and name.endswith(extension + ".gz"))
+        for name in archives[:max(len(archives) - self.keep_files, 0)]:
+            os.remove(os.path.join(directory, name))
+
+    async def run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=REQUEST_LOG_FLUSH_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def close(self):
+        await self.flush()
+        if self._file is not None:
+            await asyncio.to_thread(self._file.close)
+            self._file = None
+
+def worker_log_path(path):
+    """Con varios workers, cada uno escribe y rota su propio fichero: requests-w<índice>.jsonl."""
+    if not path or not IS_WORKER_PROCESS:
+        return path
+    base, extension = os.path.splitext(path)
+    return f"{base}-w{WORKER_INDEX}{extension}"
+
+request_log = RequestLog(worker_log_path(REQUEST_LOG_PATH), REQUEST_LOG_MAX_BYTES, REQUEST_LOG_KEEP_FILES)
+
+
+# --- Sesión HTTP compartida ---
+shared_http_session = None
+
+def get_http_session():
+    # Una sola sesión por proceso reutiliza conexiones keep-alive y resoluciones DNS
+    global shared_http_session
+    if shared_http_session is None or shared_http_session.closed:
+        shared_http_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=30),
+            trace_configs=[create_external_trace_config()]
+        )
+    return shared_http_session
+
+@contextlib.asynccontextmanager
+async def http_session():
+    yield get_http_session()
+
+
+# --- Funciones de TMDB y Trakt (aiohttp - Asíncrono) ---
+
+async def get_movie_results_by_title(title, page=1):
+    url = f"{BASE_TMDB_URL}/search/movie"
+    params = {"api_key": TMDB_API_KEY, "query": title, "language": "es-ES", "page": page}
+    try:
+        async with http_session() as session:
+            async with session.get(url, params=params) as response:
+                response.raise_for_status()
+                data = await response.json()
+                return data.get("results", []), data.get("total_pages", 1)
+    except aiohttp.ClientError as e:
+        logging.error(f"Error al buscar película en TMDB por título: {e}")
+        return [], 1
+
+async def get_movie_details(movie_id):
+    url = f"{BASE_TMDB_URL}/movie/{movie_id}"
+    params = {"api_key": TMDB_API_KEY, "language": "es-ES"}
+    try:
+        async with http_session() as session:
+            async with session.get(url, params=params) as response:
+                response.raise_for_status()
+                return await response.json()
+    except aiohttp.ClientError as e:
+        logging.error(f"Error al conectar con la API de TMDB: {e}")
+        return None
+
+async def get_tmdb_movie_changes(start_date, end_date, page=1):
+    """Una página del feed de cambios de TMDB. Devuelve (IDs, total de páginas), o (None, 0) si falla."""
+    url = f"{BASE_TMDB_URL}/movie/changes"
+    params = {"api_key": TMDB_API_KEY, "start_date": start_date.isoformat(), "end_date": end_date.isoformat(), "page": page}
+    try:
+        async with http_session() as session:
+            async with session.get(url, params=params) as response:
+                response.raise_for_status()
+                data = await response.json()
+                return [item["id"] for item in data.get("results", []) if item.get("id") is not None], data.get("total_pages", 1)
+    except aiohttp.ClientError as e:
+        logging.error(f"Error al obtener el feed de cambios de TMDB: {e}")
+        return None, 0
+
+async def get_popular_movies(page=1):
+    url = f"{BASE_TMDB_URL}/movie/popular"
+    params = {"api_key": TMDB_API_KEY, "language": "es-ES", "page": page}
+    try:
+        async with http_session() as session:
+            async with session.get(url, params=params) as response:
+                response.raise_for_status()
+                data = await response.json()
+                return data.get("results", []), data.get("total_pages", 1)
+    except aiohttp.ClientError as e:
+        logging.error(f"Error al obtener películas populares de TMDB: {e}")
+        return [], 1
+
+async def get_movies_by_genre(genre_id, page=1):
+    url = f"{BASE_TMDB_URL}/discover/movie"
+    params = {"api_key": TMDB_API_KEY, "language": "es-ES", "with_genres": genre_id, "sort_by": "popularity.desc", "page": page}
+    try:
+        async with http_session() as session:
+            async with session.get(url, params=params) as response:
+                response.raise_for_status()
+                data = await response.json()
+                return data.get("results", []), data.get("total_pages", 1)
+    except aiohttp.ClientError as e:
+        logging.error(f"Error al buscar películas por género: {e}")
+        return [], 1
+
+async def get_upcoming_movies(page=1):
+    url = f"{BASE_TMDB_URL}/discover/movie"
+    current_year = datetime.datetime.now().year
+    params = {
+        "api_key": TMDB_API_KEY,
+        "language": "es-ES",
+        "sort_by": "popularity.desc",
+        "primary_release_date.gte": f"{current_year}-01-01",
+        "vote_count.gte": 50,
+        "page": page,
+    }
+    try:
+        async with http_session() as session:
+            async with session.get(url, params=params) as response:
+                response.raise_for_status()
+                data = await response.json()
+                return data.get("results", []), data.get("total_pages", 1)
+    except aiohttp.ClientError as e:
+        logging.error(f"Error al obtener próximos estrenos de TMDB: {e}")
+        return [], 1
+
+async def get_movies_by_actor(actor_name):
+    url = f"{BASE_TMDB_URL}/search/person"
+    params = {"api_key": TMDB_API_KEY, "query": actor_name, "language": "es-ES"}
+    try:
+        async with http_session() as session:
+            async with session.get(url, params=params) as response:
+                response.raise_for_status()
+                actor = (await response.json()).get("results")[0] if (await response.json()).get("results") else None
+                if not actor:
+                    return [], 1
+                
+                person_id = actor.get("id")
+                url = f"{BASE_TMDB_URL}/person/{person_id}/movie_credits"
+                params = {"api_key": TMDB_API_KEY, "language": "es-ES"}
+                async with session.get(url, params=params) as response:
+                    response.raise_for_status()
+                    movies = sorted((await response.json()).get("cast", []), key=lambda x: x.get("popularity", 0), reverse=True)
+                    total_pages = (len(movies) + SEARCH_RESULTS_PER_PAGE - 1) // SEARCH_RESULTS_PER_PAGE
+                    return movies, total_pages
+    except aiohttp.ClientError as e:
+        logging.error(f"Error al buscar películas por actor: {e}")
+        return [], 1
+
+async def trakt_api_search_movie(title):
+    headers = {
+        "Content-Type": "application/json",
+        "trakt-api-version": "2",
+        "trakt-api-key": TRAKT_CLIENT_ID
+    }
+    url = f"{TRAKT_BASE_URL}/search/movie"
+    params = {"query": title}
+    try:
+        async with http_session() as session:
+            async with session.get(url, headers=headers, params=params) as response:
+                response.raise_for_status()
+                results = await response.json()
+                if results:
+                    for result in results:
+                        tmdb_id = result.get("movie", {}).get("ids", {}).get("tmdb")
+                        if tmdb_id:
+                            return tmdb_id
+                return None
+    except aiohttp.ClientError as e:
+        logging.error(f"Error al buscar película en Trakt.tv: {e}")
+        return None
+
+# --- NUEVAS FUNCIONES PARA NOTICIAS Y MEMES ---
+async def get_latest_news(page_size=5):
+    params = {
+        "q": "cine",
+        "sortBy": "publishedAt",
+        "language": "es",
+        "apiKey": NEWS_API_KEY,
+        "pageSize": page_size,
+    }
+    try:
+        async with http_session() as session:
+            async with session.get(NEWS_API_URL, params=params) as response:
+                response.raise_for_status()
+                data = await response.json()
+                return data.get("articles", [])
+    except aiohttp.ClientError as e:
+        logging.error(f"Error al obtener noticias de NewsAPI: {e}")
+        return []
+
+async def fetch_reddit_image_posts():
+    headers = {"User-Agent": "MyBot/0.1"}
+    try:
+        async with http_session() as session:
+            async with session.get(REDDIT_MEMES_URL, headers=headers) as response:
+                response.raise_for_status()
+                data = await response.json()
+                posts = data['data']['children']
+                return [
+                    (p['data']['url_overridden_by_dest'], p['data']['title'])
+                    for p in posts
+                    if p['data'].get('url_overridden_by_dest') and p['data']['url_overridden_by_dest'].endswith(('.jpg', '.png'))
+                ]
+    except aiohttp.ClientError as e:
+        logging.error(f"Error al hacer scraping de memes: {e}")
+    except KeyError:
+        logging.error("Error al procesar la respuesta de Reddit.")
+    return []
+
+async def get_random_meme():
+    """(url, título, huella del contenido). Tras publicarlo hay que llamar a meme_pool.mark_posted."""
+    meme = await meme_pool.next()
+    if meme:
+        return meme
+    return None, "¡Aquí tienes un meme divertido!", None
+
+
+# --- Contenido ya publicado y reserva de memes ---
+class PostedContentSet:
+    """Huellas (URL, hash de contenido) de lo ya publicado, persistidas en `posted_content` con TTL."""
+
+    _indexes_ready = False
+
+    def __init__(self, kind):
+        self._kind = kind
+        self._fingerprints = set()
+        self._loaded = False
+
+    def __contains__(self, fingerprint):
+        return fingerprint in self._fingerprints
+
+    def __len__(self):
+        return len(self._fingerprints)
+
+    async def _get_collection(self):
+        collection = get_mongo_db_collection("posted_content")
+        if collection is not None and not PostedContentSet._indexes_ready:
+            await collection.create_index("expires_at", expireAfterSeconds=0)
+            PostedContentSet._indexes_ready = True
+        return collection
+
+    async def load(self):
+        if self._loaded:
+            return
+        collection = await self._get_collection()
+        if collection is not None:
+            prefix = f"{self._kind}:"
+            async for document in collection.find({"kind": self._kind}, {"_id": 1}):
+                self._fingerprints.add(document["_id"][len(prefix):])
+        self._loaded = True
+
+    async def add(self, *fingerprints):
+        fingerprints = [f for f in fingerprints if f]
+        self._fingerprints.update(fingerprints)
+        collection = await self._get_collection()
+        if collection is None or not fingerprints:
+            return
+        now = datetime.datetime.now(datetime.timezone.utc)
+        expires_at = now + datetime.timedelta(days=POSTED_CONTENT_RETENTION_DAYS)
+        try:
+            await collection.bulk_write([
+                UpdateOne(
+                    {"_id": f"{self._kind}:{fingerprint}"},
+                    {"$set": {"kind": self._kind, "posted_at": now, "expires_at": expires_at}},
+                    upsert=True
+                )
+                for fingerprint in fingerprints
+            ], ordered=False)
+        except Exception as e:
+            logging.error(f"Error al guardar las huellas de contenido publicado ({self._kind}): {e}")
+
+
+class MemePool:
+    """
+    Memes listos para publicar. Se rellena en segundo plano cuando baja de
+    MEME_POOL_LOW_WATERMARK y descarta los memes cuya URL o cuyo contenido ya se publicó.
+    """
+
+    def __init__(self):
+        self._memes = deque()  # (url, título, hash del contenido)
+        self._queued = set()
+        self._posted = PostedContentSet("meme")
+        self._refill_task = None
+
+    def __len__(self):
+        return len(self._memes)
+
+    def ensure_refill(self):
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.create_task(self._refill())
+        return self._refill_task
+
+    async def _content_hash(self, session, semaphore, url):
+        async with semaphore:
+            try:
+                async with session.get(url, headers={"User-Agent": "MyBot/0.1"}) as response:
+                    response.raise_for_status()
+                    if response.content_length and response.content_length > MEME_MAX_IMAGE_BYTES:
+                        logging.warning(f"Meme descartado por tamaño ({response.content_length} bytes): {url}")
+                        return None
+                    prefix = b""
+                    while len(prefix) < MEME_HASH_PREFIX_BYTES:
+                        chunk = await response.content.read(MEME_HASH_PREFIX_BYTES - len(prefix))
+                        if not chunk:
+                            break
+                        prefix += chunk
+                    # Al salir sin leer el resto, aiohttp cierra la conexión en vez de descargarlo
+                    return hashlib.sha1(prefix + str(response.content_length).encode()).hexdigest()
+            except Exception as e:
+                logging.warning(f"No se pudo descargar el meme {url}: {e}")
+                return None
+
+    async def _refill(self):
+        try:
+            await self._posted.load()
+            candidates = [
+                (url, caption) for url, caption in await fetch_reddit_image_posts()
+                if url not in self._posted and url not in self._queued
+            ]
+            random.shuffle(candidates)
+            candidates = candidates[:max(MEME_POOL_TARGET - len(self._memes), 0)]
+            if not candidates:
+                return
+
+            semaphore = asyncio.Semaphore(4)
+            async with http_session() as session:
+                digests = await asyncio.gather(*(self._content_hash(session, semaphore, url) for url, _ in candidates))
+
+            added = 0
+            for (url, caption), digest in zip(candidates, digests):
+                if digest is None or digest in self._posted or digest in self._queued:
+                    continue
+                self._memes.append((url, caption, digest))
+                self._queued.update((url, digest))
+                added += 1
+            logging.info(f"Reserva de memes rellenada con {added} memes nuevos ({len(self._memes)} disponibles).")
+        except Exception as e:
+            logging.error(f"Error al rellenar la reserva de memes: {e}")
+
+    async def next(self):
+        if len(self._memes) <= MEME_POOL_LOW_WATERMARK:
+            refill_task = self.ensure_refill()
+            if not self._memes:
+                # Solo se espera cuando no queda nada, y con límite para no bloquear el ciclo
+                try:
+                    await asyncio.wait_for(asyncio.shield(refill_task), MEME_REFILL_WAIT_SECONDS)
+                except Exception:
+                    pass
+        if not self._memes:
+            return None
+        url, caption, digest = self._memes.popleft()
+        self._queued.difference_update((url, digest))
+        return url, caption, digest
+
+    async def mark_posted(self, url, digest):
+        """Llamar solo cuando el meme ya está en el canal; si el envío falla puede volver a la reserva."""
+        await self._posted.add(url, digest)
+
+meme_pool = MemePool()
+
+
+async def check_image_url(session, url):
+    """Comprueba que la URL responde con una imagen, para no fallar luego en send_photo."""
+    timeout = aiohttp.ClientTimeout(total=10)
+    try:
+        async with session.head(url, allow_redirects=True, timeout=timeout) as response:
+            if response.status < 400:
+                return response.headers.get("Content-Type", "").startswith("image/")
+            if response.status not in (403, 405):
+                return False
+        # Algunos servidores no aceptan HEAD: se pide solo el primer byte
+        async with session.get(url, headers={"Range": "bytes=0-0"}, timeout=timeout) as response:
+            return response.status < 400 and response.headers.get("Content-Type", "").startswith("image/")
+    except Exception:
+        return False
+
+
+class NewsPool:
+    """
+    Artículos de cine en memoria. Se refrescan bajo demanda cuando tienen más de NEWS_REFRESH_MINUTES
+    (sin bucle periódico: NewsAPI tiene cuota y con varios workers se consultaría una vez por proceso).
+    Las imágenes se validan al refrescar y las URL ya publicadas en el canal se guardan en `posted_content`.
+    """
+
+    def __init__(self):
+        self._articles = []
+        self._image_checks = {}
+        self._posted = PostedContentSet("news")
+        self._refreshed_at = None
+        self._refresh_task = None
+
+    def __len__(self):
+        return len(self._articles)
+
+    def _is_stale(self):
+        return self._refreshed_at is None or time.monotonic() - self._refreshed_at >= NEWS_REFRESH_MINUTES * 60
+
+    def ensure_refresh(self):
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.refresh())
+        return self._refresh_task
+
+    async def refresh(self):
+        try:
+            articles = await get_latest_news(NEWS_POOL_SIZE)
+            if not articles:
+                return
+
+            unique_articles = []
+            seen_urls = set()
+            for article in articles:
+                url = article.get("url")
+                if not url or url in seen_urls:
+                    continue
+                seen_urls.add(url)
+                unique_articles.append(dict(article))
+
+            image_urls = {a.get("urlToImage") for a in unique_articles if a.get("urlToImage")}
+            pending = [url for url in image_urls if url not in self._image_checks]
+            if pending:
+                semaphore = asyncio.Semaphore(5)
+                async def check(session, url):
+                    async with semaphore:
+                        return await check_image_url(session, url)
+                async with http_session() as session:
+                    results = await asyncio.gather(*(check(session, url) for url in pending))
+                self._image_checks.update(zip(pending, results))
+            self._image_checks = {url: ok for url, ok in self._image_checks.items() if url in image_urls}
+
+            for article in unique_articles:
+                article["image_ok"] = self._image_checks.get(article.get("urlToImage"), False)
+            self._articles = unique_articles
+            self._refreshed_at = time.monotonic()
+            logging.info(f"Reserva de noticias actualizada: {len(unique_articles)} artículos.")
+        except Exception as e:
+            logging.error(f"Error al actualizar la reserva de noticias: {e}")
+
+    async def _wait_if_empty(self):
+        if self._is_stale():
+            refresh_task = self.ensure_refresh()
+            if not self._articles:
+                try:
+                    await asyncio.wait_for(asyncio.shield(refresh_task), 15)
+                except Exception:
+                    pass
+
+    async def latest(self, count):
+        await self._wait_if_empty()
+        return self._articles[:count]
+
+    async def next_unposted(self):
+        """Devuelve el artículo más reciente que aún no se publicó en el canal (sin marcarlo)."""
+        await self._posted.load()
+        await self._wait_if_empty()
+        for article in self._articles:
+            if article["url"] not in self._posted:
+                return article
+        return None
+
+    async def mark_posted(self, url):
+        """Llamar solo cuando el artículo ya está en el canal."""
+        await self._posted.add(url)
+
+news_pool = NewsPool()
+
+
+def get_movie_poster_url(poster_path):
+    if poster_path:
+        return f"{POSTER_BASE_URL}{poster_path}"
+    return None
+
+def render_movie_message(movie_data, movie_link=None, from_channel=False):
+    title = movie_data.get("title", "Título no disponible")
+    overview = movie_data.get("overview", "Sinopsis no disponible")
+    release_date = movie_data.get("release_date", "Fecha no disponible")
+    vote_average = movie_data.get("vote_average", 0)
+    poster_path = movie_data.get("poster_path")
+
+    if not overview.strip():
+        overview = "Sinopsis no disponible."
+    
+    if len(overview) > 250:
+        overview = overview[:250] + "..."
+
+    text = (
+        f"<b>🎬 {title}</b>\n\n"
+        f"<i>Sinopsis:</i> {overview}\n\n"
+        f"📅 <b>Fecha de estreno:</b> {release_date}\n"
+        f"⭐ <b>Puntuación:</b> {vote_average:.1f}/10"
+    )
+
+    if from_channel:
+        post_keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text="🎬 Ver ahora", url=movie_link)],
+            [types.InlineKeyboardButton(text="✨ Pedir otra película", url="https://t.me/sdmin_dy_bot?start=request")]
+        ])
+    elif movie_link:
+        post_keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text="🎬 Ver ahora", url=movie_link)],
+            [types.InlineKeyboardButton(text="📽️ Pedir otra película", url="https://t.me/sdmin_dy_bot?start=request")]
+        ])
+    else:
+        post_keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text="🎬 ¿Quieres pedir una película? Pídela aquí 👇", url="https://t.me/sdmin_dy_bot?start=request")]
+        ])
+
+    poster_url = f"{POSTER_BASE_URL}{poster_path}" if poster_path and not poster_path.startswith("http") else poster_path
+
+    return text, poster_url, post_keyboard
+
+# Campos de TMDB de los que depende el caption: si cambian, la entrada cacheada deja de valer
+RENDERED_MOVIE_FIELDS = ("title", "overview", "release_date", "vote_average", "poster_path")
+
+class RenderedMovieCache:
+    """
+    LRU de captions y teclados ya construidos, con clave (tmdb_id, variante, enlace).
+    Cada entrada guarda la firma de los datos con que se renderizó; si TMDB devuelve otros datos
+    se vuelve a renderizar. `invalidate(tmdb_id)` descarta todas las variantes de una película.
+    Los teclados se comparten entre llamadas: no deben modificarse después de obtenerlos.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._keys_by_movie = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, kind, key, signature, render):
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == signature:
+            self._entries.move_to_end(key)
+            RENDER_CACHE_REQUESTS.labels(kind, "hit").inc()
+            return entry[1]
+
+        RENDER_CACHE_REQUESTS.labels(kind, "miss").inc()
+        value = render()
+        if self.max_size <= 0:
+            return value
+        self._entries[key] = (signature, value)
+        self._entries.move_to_end(key)
+        self._keys_by_movie.setdefault(key[0], set()).add(key)
+        while len(self._entries) > self.max_size:
+            old_key, _ = self._entries.popitem(last=False)
+            self._forget_key(old_key)
+        return value
+
+    def _forget_key(self, key):
+        keys = self._keys_by_movie.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_movie[key[0]]
+
+    def invalidate(self, tmdb_id):
+        for key in self._keys_by_movie.pop(tmdb_id, ()):
+            self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._keys_by_movie.clear()
+
+rendered_movies = RenderedMovieCache(RENDER_CACHE_SIZE)
+
+def invalidate_rendered_movie(tmdb_id):
+    """Llamar cuando cambian el enlace o los datos guardados de una película."""
+    rendered_movies.invalidate(tmdb_id)
+
+def create_movie_message(movie_data, movie_link=None, from_channel=False):
+    tmdb_id = movie_data.get("id")
+    if tmdb_id is None:
+        return render_movie_message(movie_data, movie_link, from_channel)
+    variant = "channel" if from_channel else ("link" if movie_link else "plain")
+    signature = tuple(movie_data.get(field) for field in RENDERED_MOVIE_FIELDS)
+    return rendered_movies.get(
+        "caption",
+        (tmdb_id, variant, movie_link),
+        signature,
+        lambda: render_movie_message(movie_data, movie_link, from_channel)
+    )
+
+# Teclados de las tarjetas de película que se repiten en búsquedas, estrenos, géneros y catálogo
+MOVIE_CARD_KEYBOARDS = {
+    # Película en el catálogo: verla o republicarla
+    "watch_publish": lambda tmdb_id, link: [
+        [types.InlineKeyboardButton(text="🎬 Ver ahora", url=link)],
+        [types.InlineKeyboardButton(text="📢 Publicar en el canal", callback_data=callback_data("publish_now_manual", tmdb_id))]
+    ],
+    "watch": lambda tmdb_id, link: [
+        [types.InlineKeyboardButton(text="🎬 Ver ahora", url=link)]
+    ],
+    # Película fuera del catálogo: pedirla
+    "request": lambda tmdb_id, link: [
+        [types.InlineKeyboardButton(text="🎬 Pedir esta película", callback_data=callback_data("request_movie_by_id", tmdb_id))]
+    ],
+    # Flujo de administración
+    "admin_exists": lambda tmdb_id, link: [
+        [types.InlineKeyboardButton(text="✅ Película ya en el catálogo", callback_data=callback_data("movie_exists_dummy"))],
+        [types.InlineKeyboardButton(text="📌 Publicar ahora", callback_data=callback_data("publish_now_admin", tmdb_id))]
+    ],
+    "admin_add": lambda tmdb_id, link: [
+        [types.InlineKeyboardButton(text="Agregar esta película", callback_data=callback_data("admin_add_movie", tmdb_id))]
+    ],
+    "admin_catalog": lambda tmdb_id, link: [
+        [types.InlineKeyboardButton(text="📌 Publicar en el canal", callback_data=callback_data("publish_now_admin", tmdb_id))],
+        [types.InlineKeyboardButton(text="✏️ Editar película", callback_data=callback_data("edit_movie", tmdb_id)),
+        types.InlineKeyboardButton(text="🗑️ Eliminar película", callback_data=callback_data("delete_movie", tmdb_id))]
+    ],
+}
+
+def movie_card_keyboard(variant, tmdb_id, link=None):
+    return rendered_movies.get(
+        "keyboard",
+        (tmdb_id, f"card:{variant}", link),
+        None,
+        lambda: types.InlineKeyboardMarkup(inline_keyboard=MOVIE_CARD_KEYBOARDS[variant](tmdb_id, link))
+    )
+
+# --- Instantánea de metadatos de TMDB en el catálogo ---
+
+# Campos de TMDB que se copian en el documento de la película para poder publicarla sin TMDB
+MOVIE_METADATA_FIELDS = ("title", "original_title", "overview", "release_date", "vote_average", "poster_path", "backdrop_path", "genres", "runtime")
+
+metadata_refresh_tasks = {}
+
+def movie_metadata_snapshot(tmdb_data):
+    snapshot = {field: tmdb_data[field] for field in MOVIE_METADATA_FIELDS if tmdb_data.get(field) is not None}
+    snapshot["metadata_fetched_at"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    return snapshot
+
+def movie_metadata_is_stale(movie_info):
+    try:
+        fetched_at = datetime.datetime.fromisoformat(movie_info["metadata_fetched_at"])
+    except (KeyError, TypeError, ValueError):
+        return True
+    if fetched_at.tzinfo is None:
+        fetched_at = fetched_at.replace(tzinfo=datetime.timezone.utc)
+    return datetime.datetime.now(datetime.timezone.utc) - fetched_at > datetime.timedelta(hours=METADATA_MAX_AGE_HOURS)
+
+@profiled("mongo")
+async def save_movie_metadata(tmdb_id, tmdb_data):
+    """Guarda la instantánea de TMDB en una película que ya está en el catálogo (no la crea)."""
+    collection = get_mongo_db_collection()
+    if collection is None:
+        return None
+
+    snapshot = movie_metadata_snapshot(tmdb_data)
+    try:
+        await collection.update_one({"id": tmdb_id}, {"$set": snapshot})
+        invalidate_rendered_movie(tmdb_id)
+        catalog_index.upsert({"id": tmdb_id, **snapshot})
+        return snapshot
+    except Exception as e:
+        logging.error(f"Error al guardar los metadatos de TMDB de la película {tmdb_id}: {e}")
+        return None
+
+async def refresh_movie_metadata(tmdb_id):
+    tmdb_data = await get_movie_details(tmdb_id)
+    if tmdb_data:
+        await save_movie_metadata(tmdb_id, tmdb_data)
+    return tmdb_data
+
+async def refresh_movie_metadata_in_background(tmdb_id):
+    # Nadie espera esta tarea: cualquier error (timeout, Mongo...) se registra aquí
+    try:
+        await refresh_movie_metadata(tmdb_id)
+    except Exception as e:
+        logging.error(f"Error al refrescar en segundo plano los metadatos de {tmdb_id}: {e}")
+
+def schedule_metadata_refresh(tmdb_id):
+    """Refresca en segundo plano una instantánea caducada; una sola tarea por película."""
+    if tmdb_id in metadata_refresh_tasks:
+        return
+    task = asyncio.create_task(refresh_movie_metadata_in_background(tmdb_id))
+    metadata_refresh_tasks[tmdb_id] = task
+    task.add_done_callback(lambda _: metadata_refresh_tasks.pop(tmdb_id, None))
+
+async def get_catalog_movie_metadata(movie_info):
+    """
+    Datos para renderizar una película del catálogo. Salen de la instantánea guardada en el
+    documento (si está caducada se refresca en segundo plano y se publica con la que hay);
+    solo las películas sin instantánea esperan a TMDB, y la guardan para la próxima vez.
+    """
+    tmdb_id = movie_info.get("id")
+    if movie_info.get("metadata_fetched_at") and movie_info.get("title"):
+        if movie_metadata_is_stale(movie_info):
+            schedule_metadata_refresh(tmdb_id)
+        movie_data = {field: movie_info[field] for field in MOVIE_METADATA_FIELDS if movie_info.get(field) is not None}
+        movie_data["id"] = tmdb_id
+        return movie_data
+    return await refresh_movie_metadata(tmdb_id)
+
+async def backfill_movie_metadata(collection, after_id, batch_size):
+    """
+    Completa con TMDB el siguiente lote (por ID ascendente, a partir de `after_id`) de películas
+    sin instantánea. Devuelve (último ID del lote o None si no quedan más, películas completadas).
+    Recorrer por ID evita que las que TMDB no devuelve bloqueen a las siguientes.
+    """
+    query = {"metadata_fetched_at": {"$exists": False}}
+    if after_id is not None:
+        query["id"] = {"$gt": after_id}
+    pending = await collection.find(query, {"id": 1}).sort("id", 1).to_list(batch_size)
+    tmdb_ids = [document["id"] for document in pending if document.get("id") is not None]
+    semaphore = asyncio.Semaphore(METADATA_BACKFILL_CONCURRENCY)
+
+    async def backfill(tmdb_id):
+        async with semaphore:
+            return await refresh_movie_metadata(tmdb_id) is not None
+
+    completed = sum(await asyncio.gather(*(backfill(tmdb_id) for tmdb_id in tmdb_ids)))
+    last_id = tmdb_ids[-1] if len(pending) >= batch_size and tmdb_ids else None
+    return last_id, completed
+
+async def metadata_backfill_scheduler():
+    collection = get_mongo_db_collection()
+    if collection is None:
+        logging.error("Metadatos del catálogo: No se pudo conectar a la DB. La tarea no se iniciará.")
+        return
+
+    after_id = None
+    while True:
+        try:
+            after_id, completed = await backfill_movie_metadata(collection, after_id, METADATA_BACKFILL_BATCH_SIZE)
+            if completed:
+                logging.info(f"Metadatos del catálogo: {completed} películas completadas con TMDB.")
+            # Los lotes siguen sin pausa hasta recorrer el catálogo; después se espera al siguiente intervalo
+            if after_id is None:
+                await asyncio.sleep(METADATA_BACKFILL_INTERVAL_MINUTES * 60)
+        except Exception as e:
+            logging.error(f"Error en metadata_backfill_scheduler: {e}")
+            await asyncio.sleep(300)
+
+# --- Refresco incremental de metadatos con el feed de cambios de TMDB ---
+
+@profiled("mongo")
+async def get_job_checkpoint(name):
+    collection = get_mongo_db_collection("job_checkpoints")
+    if collection is None:
+        return None
+
+    try:
+        document = await collection.find_one({"_id": name})
+        return document.get("checkpoint") if document else None
+    except Exception as e:
+        logging.error(f"Error al leer el checkpoint '{name}': {e}")
+        return None
+
+@profiled("mongo")
+async def set_job_checkpoint(name, checkpoint):
+    collection = get_mongo_db_collection("job_checkpoints")
+    if collection is None:
+        return
+
+    try:
+        await collection.update_one(
+            {"_id": name},
+            {"$set": {"checkpoint": checkpoint, "updated_at": datetime.datetime.now(datetime.timezone.utc)}},
+            upsert=True
+        )
+    except Exception as e:
+        logging.error(f"Error al guardar el checkpoint '{name}': {e}")
+
+async def fetch_tmdb_changed_ids(start_date, end_date):
+    """Todos los IDs del feed de cambios entre dos fechas, o None si falta alguna página."""
+    first_page, total_pages = await get_tmdb_movie_changes(start_date, end_date)
+    if first_page is None:
+        return None
+    semaphore = asyncio.Semaphore(METADATA_CHANGES_CONCURRENCY)
+
+    async def fetch_page(page):
+        async with semaphore:
+            tmdb_ids, _ = await get_tmdb_movie_changes(start_date, end_date, page)
+            return tmdb_ids
+
+    pages = await asyncio.gather(*(fetch_page(page) for page in range(2, total_pages + 1)))
+    if any(tmdb_ids is None for tmdb_ids in pages):
+        return None
+    return set(first_page).union(*pages)
+
+async def catalog_ids_among(tmdb_ids, collection):
+    """Los IDs que están en el catálogo: del índice en memoria si ya cargó, si no de MongoDB."""
+    if catalog_index.loaded_at is not None:
+        return {tmdb_id for tmdb_id in tmdb_ids if tmdb_id in catalog_index.movies}
+    tmdb_ids, found = list(tmdb_ids), set()
+    for start in range(0, len(tmdb_ids), 1000):
+        chunk = tmdb_ids[start:start + 1000]
+        async for document in collection.find({"id": {"$in": chunk}}, {"id": 1}):
+            found.add(document["id"])
+    return found
+
+async def sync_tmdb_movie_changes(collection):
+    """
+    Refresca la instantánea de las películas del catálogo que TMDB ha cambiado desde el último
+    checkpoint (colección job_checkpoints). Solo avanza el checkpoint de las ventanas leídas
+    enteras; las películas que no se pudieron refrescar se marcan como caducadas para que
+    la siguiente publicación las refresque. Devuelve cuántas se refrescaron.
+    """
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    checkpoint = await get_job_checkpoint("tmdb_movie_changes")
+    if checkpoint is None:
+        # Primera ejecución: lo anterior ya lo cubren la instantánea al guardar y el backfill
+        await set_job_checkpoint("tmdb_movie_changes", today.isoformat())
+        return 0
+
+    # Tras una parada larga no se recorren más de cuatro ventanas: lo más antiguo ya lo
+    # habrá marcado como caducado METADATA_MAX_AGE_HOURS
+    start_date = max(datetime.date.fromisoformat(checkpoint), today - datetime.timedelta(days=TMDB_CHANGES_MAX_DAYS * 4))
+    refreshed = 0
+    semaphore = asyncio.Semaphore(METADATA_CHANGES_CONCURRENCY)
+
+    async def refresh(tmdb_id):
+        async with semaphore:
+            return tmdb_id, await refresh_movie_metadata(tmdb_id) is not None
+
+    while True:
+        # El día del checkpoint se vuelve a leer: el feed va por fechas y ese día pudo seguir cambiando
+        end_date = min(start_date + datetime.timedelta(days=TMDB_CHANGES_MAX_DAYS - 1), today)
+        changed_ids = await fetch_tmdb_changed_ids(start_date, end_date)
+        if changed_ids is None:
+            logging.warning(f"Feed de cambios de TMDB incompleto para {start_date}..{end_date}; se reintentará.")
+            return refreshed
+        catalog_ids = await catalog_ids_among(changed_ids, collection)
+        results = await asyncio.gather(*(refresh(tmdb_id) for tmdb_id in catalog_ids))
+        failed = [tmdb_id for tmdb_id, ok in results if not ok]
+        if failed:
+            # Solo se marcan como caducadas las que ya tenían instantánea: las demás siguen pendientes del backfill
+            await collection.update_many(
+                {"id": {"$in": failed}, "metadata_fetched_at": {"$exists": True}},
+                {"$set": {"metadata_fetched_at": "1970-01-01T00:00:00+00:00"}}
+            )
+        refreshed += len(results) - len(failed)
+        logging.info(
+            f"Cambios de TMDB {start_date}..{end_date}: {len(changed_ids)} películas, "
+            f"{len(catalog_ids)} en el catálogo, {len(failed)} sin poder refrescar."
+        )
+        await set_job_checkpoint("tmdb_movie_changes", end_date.isoformat())
+        if end_date >= today:
+            return refreshed
+        start_date = end_date
+
+async def metadata_changes_scheduler():
+    collection = get_mongo_db_collection()
+    if collection is None:
+        logging.error("Cambios de TMDB: No se pudo conectar a la DB. La tarea no se iniciará.")
+        return
+
+    while True:
+        try:
+            refreshed = await sync_tmdb_movie_changes(collection)
+            logging.info(f"Cambios de TMDB: {refreshed} películas del catálogo refrescadas.")
+            await asyncio.sleep(METADATA_CHANGES_INTERVAL_HOURS * 3600)
+        except Exception as e:
+            logging.error(f"Error en metadata_changes_scheduler: {e}")
+            await asyncio.sleep(600)
+
+# --- Comprobación de los enlaces de descarga del catálogo ---
+
+# Resultado de la última comprobación guardado en cada película; se borra al cambiar el enlace
+LINK_CHECK_FIELDS = ("link_status", "link_http_status", "link_checked_at", "link_errors")
+
+def classify_link_response(status, final_url):
+    """"ok", "dead" (404/410 o redirección a una página de error) o "error" (fallo que puede ser pasajero)."""
+    if status in LINK_DEAD_STATUSES or any(marker in urlsplit(final_url).path for marker in LINK_DEAD_URL_MARKERS):
+        return "dead"
+    return "ok" if status < 400 else "error"
+
+class LinkChecker:
+    """
+    Comprueba enlaces con un límite global de peticiones simultáneas y otro por host, para no
+    saturar (ni provocar bloqueos de) los pocos hosts de descargas que usa el catálogo.
+    """
+
+    def __init__(self, concurrency=LINK_CHECK_CONCURRENCY, per_host=LINK_CHECK_PER_HOST):
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._per_host = per_host
+        self._host_semaphores = {}
+
+    def _host_semaphore(self, url):
+        host = urlsplit(url).netloc.lower()
+        semaphore = self._host_semaphores.get(host)
+        if semaphore is None:
+            semaphore = self._host_semaphores[host] = asyncio.Semaphore(self._per_host)
+        return semaphore
+
+    async def _request(self, session, method, url):
+        async with session.request(
+            method, url,
+            allow_redirects=True,
+            headers={"User-Agent": LINK_CHECK_USER_AGENT},
+            timeout=aiohttp.ClientTimeout(total=LINK_CHECK_TIMEOUT_SECONDS),
+        ) as response:
+            # Solo interesan el código y la URL final: el cuerpo no se descarga
+            return response.status, str(response.url)
+
+    async def check(self, url):
+        """(resultado, código HTTP o None) de un enlace: HEAD y, si el host no lo admite, GET."""
+        # Primero el hueco del host: así una cola en un host lento no ocupa plazas globales
+        async with self._host_semaphore(url), self._semaphore:
+            session = get_http_session()
+            try:
+                status, final_url = await self._request(session, "HEAD", url)
+            except Exception:
+                status, final_url = None, url
+            if status is None or (status >= 400 and status not in LINK_DEAD_STATUSES):
+                # Muchos hosts de descargas rechazan HEAD (403/405) o lo atienden mal: se repite con GET
+                try:
+                    status, final_url = await self._request(session, "GET", url)
+                except Exception as e:
+                    logging.debug(f"Enlace {url} inaccesible: {e}")
+                    return "error", None
+        return classify_link_response(status, final_url), status
+
+link_checker = LinkChecker()
+
+async def check_catalog_links(collection, batch_size, checker=link_checker):
+    """
+    Comprueba el siguiente lote de enlaces nunca comprobados o con la comprobación caducada y
+    guarda el resultado en cada película. Devuelve (enlaces comprobados, películas con enlace recién muerto).
+    """
+    cutoff = (datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=LINK_CHECK_INTERVAL_HOURS)).isoformat()
+    query = {
+        "link": {"$regex": "^https?://"},
+        "$or": [{"link_checked_at": {"$exists": False}}, {"link_checked_at": {"$lt": cutoff}}],
+    }
+    pending = await collection.find(query, {"id": 1, "title": 1, "link": 1, "link_status": 1, "link_errors": 1}).to_list(batch_size)
+    if not pending:
+        return 0, []
+
+    results = await asyncio.gather(*(checker.check(movie["link"]) for movie in pending))
+    checked_at = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    operations, newly_dead = [], []
+    for movie, (status, http_status) in zip(pending, results):
+        errors = (movie.get("link_errors") or 0) + 1 if status == "error" else 0
+        if errors >= LINK_CHECK_MAX_ERRORS:
+            status = "dead"
+        LINK_CHECKS.labels(status).inc()
+        if status == "dead" and movie.get("link_status") != "dead":
+            newly_dead.append(movie)
+        operations.append(UpdateOne({"_id": movie["_id"]}, {"$set": {
+            "link_status": status,
+            "link_http_status": http_status,
+            "link_checked_at": checked_at,
+            "link_errors": errors,
+        }}))
+    await collection.bulk_write(operations, ordered=False)
+    return len(pending), newly_dead
+
+async def notify_dead_links(movies):
+    lines = [f"• {html.quote(movie.get('title') or str(movie.get('id')))} — {html.quote(movie.get('link', ''))}" for movie in movies[:20]]
+    if len(movies) > 20:
+        lines.append(f"… y {len(movies) - 20} más (/dead_links)")
+    try:
+        await bot.send_message(ADMIN_ID, "🔗 <b>Enlaces caídos</b> (no se publicarán automáticamente):\n" + "\n".join(lines), parse_mode=ParseMode.HTML)
+    except Exception as e:
+        logging.error(f"Error al avisar de enlaces caídos: {e}")
+
+async def link_check_scheduler():
+    collection = get_mongo_db_collection()
+    if collection is None:
+        logging.error("Comprobación de enlaces: No se pudo conectar a la DB. La tarea no se iniciará.")
+        return
+
+    while True:
+        try:
+            checked, newly_dead = await check_catalog_links(collection, LINK_CHECK_BATCH_SIZE)
+            if checked:
+                logging.info(f"Comprobación de enlaces: {checked} enlaces comprobados, {len(newly_dead)} caídos.")
+            if newly_dead and ADMIN_ID:
+                await notify_dead_links(newly_dead)
+            # Los lotes siguen sin pausa hasta que no queda nada pendiente; después se revisa cada hora
+            if checked < LINK_CHECK_BATCH_SIZE:
+                await asyncio.sleep(3600)
+        except Exception as e:
+            logging.error(f"Error en link_check_scheduler: {e}")
+            await asyncio.sleep(300)
+
+# --- Functions for managing messages on the channel
+async def delete_old_post(movie_id_tmdb):
+    movie_data = await get_movie_by_tmdb_id(movie_id_tmdb)
+    if movie_data:
+        old_message_id_main = movie_data.get("last_message_id")
+        old_message_id_public = movie_data.get("last_message_id_public")
+        
+        # Eliminar del canal principal
+        if old_message_id_main is not None:
+            try:
+                await bot.delete_message(chat_id=TELEGRAM_MAIN_CHANNEL_ID, message_id=int(old_message_id_main))
+                logging.info(f"Mensaje {old_message_id_main} eliminado del canal principal.")
+            except Exception as e:
+                logging.error(f"Error al intentar borrar el mensaje {old_message_id_main} del canal principal: {e}")
+        
+        # Eliminar del canal público
+        if old_message_id_public is not None:
+            try:
+                await bot.delete_message(chat_id=TELEGRAM_PUBLIC_CHANNEL_ID, message_id=int(old_message_id_public))
+                logging.info(f"Mensaje {old_message_id_public} eliminado del canal público.")
+            except Exception as e:
+                logging.error(f"Error al intentar borrar el mensaje {old_message_id_public} del canal público: {e}")
+
+
+async def forward_post_to_public_channel(original_message: types.Message, movie_data):
+    if not TELEGRAM_PUBLIC_CHANNEL_ID:
+        logging.warning("TELEGRAM_PUBLIC_CHANNEL_ID no está configurado. No se puede reenviar el post.")
+        return
+
+    try:
+        # Enlace al post específico en el canal principal usando el nombre de usuario
+        post_link = f"https://t.me/{MAIN_CHANNEL_USERNAME}/{original_message.message_id}"
+        
+        # Obtener la sinopsis y acortarla
+        sinopsis = movie_data.get("overview", "Sinopsis no disponible.")
+        if len(sinopsis) > 250:
+            sinopsis = sinopsis[:250] + "..."
+            
+        caption_text = (
+            f"🎬 **¡Nueva película disponible!**\n\n"
+            f"🍿 **{movie_data.get('title')}**\n\n"
+            f"📝 {sinopsis}\n\n"
+            f"Presiona el botón 'Ver Película' para acceder al post original."
+        )
+
+        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text="🎬 Ver Película", url=post_link)],
+            [types.InlineKeyboardButton(text="➡️ Ir al Canal", url=MAIN_CHANNEL_INVITE_LINK)],
+            [types.InlineKeyboardButton(text="✨ Pedir una película", url="https://t.me/sdmin_dy_bot?start=request")]
+        ])
+
+        poster_url = get_movie_poster_url(movie_data.get("poster_path"))
+        
+        public_message = None
+        if poster_url:
+            public_message = await bot.send_photo(
+                chat_id=TELEGRAM_PUBLIC_CHANNEL_ID,
+                photo=poster_url,
+                caption=caption_text,
+                reply_markup=keyboard,
+                parse_mode=ParseMode.MARKDOWN
+            )
+        else:
+            public_message = await bot.send_message(
+                chat_id=TELEGRAM_PUBLIC_CHANNEL_ID,
+                text=caption_text,
+                reply_markup=keyboard,
+                parse_mode=ParseMode.MARKDOWN,
+                disable_web_page_preview=True
+            )
+            
+        logging.info(f"Enlace al post {original_message.message_id} reenviado al canal público.")
+        return public_message.message_id
+
+    except Exception as e:
+        logging.error(f"Error al reenviar el post al canal público: {e}")
+        return None
+
+async def send_movie_post(chat_id, movie_data, movie_link, post_keyboard, user_id_to_notify=None):
+    text, poster_url, _ = create_movie_message(movie_data, movie_link, from_channel=True)
+
+    try:
+        if poster_url and (poster_url.startswith('http://') or poster_url.startswith('https://')):
+            message = await bot.send_photo(
+                chat_id=chat_id,
+                photo=poster_url,
+                caption=text,
+                reply_markup=post_keyboard
+            )
+        else:
+            message = await bot.send_message(
+                chat_id=chat_id,
+                text=text,
+                reply_markup=post_keyboard
+            )
+
+        if chat_id == TELEGRAM_MAIN_CHANNEL_ID:
+            # --- MODIFICACIÓN 1: Añadir timestamp de publicación ---
+            movie_data["last_message_id"] = message.message_id
+            movie_data["last_posted_at"] = datetime.datetime.now().isoformat() # <-- NUEVA LÍNEA
+            
+            await profiled_sleep(PUBLIC_FORWARD_DELAY_SECONDS)
+            public_message_id = await forward_post_to_public_channel(message, movie_data)
+            
+            if public_message_id:
+                movie_data["last_message_id_public"] = public_message_id
+            
+            await save_movie_to_db(movie_data) # <-- Esto ahora guarda el timestamp
+
+        if user_id_to_notify:
+            notification_message = (
+                f"🎉 ¡Tu película solicitada, **{movie_data.get('title')}**, ya está disponible en el canal!\n\n"
+                f"Haz clic en el botón de abajo para verla."
+            )
+            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+                [types.InlineKeyboardButton(text="🎬 Ver ahora", url=f"https://t.me/{MAIN_CHANNEL_USERNAME}/{message.message_id}")],
+                [types.InlineKeyboardButton(text="➡️ Ir al Canal", url=MAIN_CHANNEL_INVITE_LINK)],
+                [types.InlineKeyboardButton(text="✨ Pedir otra película", url="https://t.me/sdmin_dy_bot?start=request")]
+            ])
+            await bot.send_message(user_id_to_notify, notification_message, reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
+
+        return True, message.message_id
+    except Exception as e:
+        logging.error(f"Error al enviar la publicación: {e}")
+        return False, None
+
+@dp.message(F.text == "🆘 Soporte")
+async def start_support_handler(message: types.Message, state: FSMContext):
+    await state.set_state(SupportStates.waiting_for_support_message)
+    await message.reply("Escribe tu mensaje para el equipo de soporte. Te responderán lo antes posible.")
+
+@dp.message(SupportStates.waiting_for_support_message)
+async def process_support_message(message: types.Message, state: FSMContext):
+    user_info = message.from_user
+    support_message = f"<b>Nuevo mensaje de soporte:</b>\n\n" \
+                      f"<b>De:</b> {user_info.full_name} (@{user_info.username if user_info.username else 'N/A'})\n" \
+                      f"<b>ID:</b> <code>{user_info.id}</code>\n" \
+                      f"<b>Mensaje:</b>\n" \
+                      f"{message.text}"
+    
+    try:
+        await bot.send_message(chat_id=ADMIN_ID, text=support_message, parse_mode=ParseMode.HTML)
+        await message.reply("✅ Tu mensaje ha sido enviado. Gracias por contactarnos.")
+    except Exception as e:
+        await message.reply("❌ Hubo un error al enviar tu mensaje. Por favor, inténtalo de nuevo más tarde.")
+        logging.error(f"Error al reenviar mensaje de soporte al administrador: {e}")
+    finally:
+        await state.clear()
+
+@dp.message(Command("start"))
+async def start_command(message: types.Message, state: FSMContext):
+    user_id = message.from_user.id
+    chat_id = message.chat.id
+    
+    await state.clear()
+    
+    if str(user_id) == ADMIN_ID:
+        keyboard = types.ReplyKeyboardMarkup(
+            keyboard=[
+                [types.KeyboardButton(text="➕ Agregar película"), types.KeyboardButton(text="📋 Ver catálogo")],
+                [types.KeyboardButton(text="⚙️ Configuración auto-publicación"), types.KeyboardButton(text="📰 Configurar noticias")] # NUEVO: Botón para configurar noticias
+            ],
+            resize_keyboard=True
+        )
+        sent_message = await message.reply(
+            "¡Hola, Administrador! Elige una opción:",
+            reply_markup=keyboard,
+        )
+        user_message_ids[user_id] = [sent_message.message_id]
+
+    else:
+        if user_id in user_message_ids:
+            for msg_id in user_message_ids[user_id]:
+                try:
+                    await bot.delete_message(chat_id=chat_id, message_id=msg_id)
+                except Exception:
+                    pass
+        user_message_ids[user_id] = []
+        
+        user_keyboard = types.ReplyKeyboardMarkup(
+            keyboard=[
+                [types.KeyboardButton(text="🔍 Buscar película"), types.KeyboardButton(text="🎞️ Estrenos")],
+                [types.KeyboardButton(text="✨ Recomiéndame"), types.KeyboardButton(text="📌 Pedir película")],
+                [types.KeyboardButton(text="🆘 Soporte")]
+            ],
+            resize_keyboard=True
+        )
+        
+        caption = "¡Hola! Soy un bot que te ayuda a encontrar tus películas favoritas. ¡Usa el menú de abajo para empezar!"
+        
+        sent_message = await bot.send_photo(
+            chat_id=message.chat.id,
+            photo=WELCOME_IMAGE_URL,
+            caption=caption,
+            reply_markup=user_keyboard,
+            parse_mode=ParseMode.MARKDOWN
+        )
+        user_message_ids[user_id].append(sent_message.message_id)
+
+
+# --- CORRECCIÓN DE FLUJO DE AGREGAR PELÍCULA ---
+@dp.message(F.text == "➕ Agregar película")
+async def add_movie_start_by_text(message: types.Message, state: FSMContext):
+    if str(message.from_user.id) != ADMIN_ID:
+        await message.reply("No tienes permiso para esta acción.")
+        return
+    await state.clear()
+    await message.reply(
+        "Por favor, escribe el nombre completo de la película que quieres agregar. Puedes incluir el año para un resultado más preciso."
+    )
+    await state.set_state(MovieUploadStates.waiting_for_admin_movie_name)
+
+@dp.message(MovieUploadStates.waiting_for_admin_movie_name)
+async def admin_search_movie_to_add(message: types.Message, state: FSMContext):
+    search_query = message.text.strip()
+    await message.reply(f"Buscando '{search_query}'...")
+
+    tmdb_results, _ = await get_movie_results_by_title(search_query)
+
+    if not tmdb_results:
+        await message.reply(
+            "No se encontraron resultados. Por favor, intenta con un nombre o año diferente."
+        )
+        return
+    
+    for movie in tmdb_results[:SEARCH_RESULTS_PER_PAGE]:
+        tmdb_id = movie.get("id")
+        tmdb_data = await get_movie_details(tmdb_id)
+        if not tmdb_data:
+            continue
+            
+        text, poster_url, _ = create_movie_message(tmdb_data)
+
+        # AQUI ESTA EL CAMBIO: VERIFICA SI LA PELICULA YA EXISTE EN LA DB
+        movie_in_db = await get_movie_by_tmdb_id(tmdb_id)
+
+        if movie_in_db:
+            keyboard = movie_card_keyboard("admin_exists", tmdb_id)
+        else:
+            keyboard = movie_card_keyboard("admin_add", tmdb_id)
+            
+        try:
+            if poster_url:
+                await bot.send_photo(
+                    chat_id=message.chat.id,
+                    photo=poster_url,
+                    caption=text,
+                    reply_markup=keyboard,
+                    parse_mode=ParseMode.HTML
+                )
+            else:
+                await bot.send_message(
+                    chat_id=message.chat.id,
+                    text=text,
+                    reply_markup=keyboard,
+                    parse_mode=ParseMode.HTML
+                )
+        except Exception as e:
+            logging.error(f"Error al enviar el resultado de búsqueda del administrador: {e}")
+
+    await state.set_state(MovieUploadStates.waiting_for_admin_movie_name)
+
+@dp.callback_query(CallbackRoute("movie_exists_dummy"))
+async def dummy_callback_handler(callback_query: types.CallbackQuery):
+    await bot.answer_callback_query(callback_query.id, "Esta película ya está en el catálogo.", show_alert=True)
+
+@dp.callback_query(CallbackRoute("admin_add_movie"))
+async def admin_add_movie_callback(callback_query: types.CallbackQuery, state: FSMContext, callback_args):
+    await bot.answer_callback_query(callback_query.id)
+    tmdb_id = callback_args.tmdb_id
+    
+    tmdb_data = await get_movie_details(tmdb_id)
+    if not tmdb_data:
+        await bot.send_message(callback_query.message.chat.id, "Error al obtener la información de la película.")
+        return
+
+    await state.update_data(tmdb_data=tmdb_data, tmdb_id=tmdb_id)
+    await state.set_state(MovieUploadStates.waiting_for_admin_movie_link)
+    
+    await bot.send_message(
+        callback_query.message.chat.id,
+        f"Has seleccionado **{tmdb_data.get('title')}**. Por favor, envía el enlace de la película.",
+        parse_mode=ParseMode.MARKDOWN
+    )
+
+@dp.message(MovieUploadStates.waiting_for_admin_movie_link)
+async def admin_process_movie_link(message: types.Message, state: FSMContext):
+    movie_link = message.text.strip()
+    user_data = await state.get_data()
+    tmdb_data = user_data.get('tmdb_data')
+
+    if not tmdb_data:
+        await message.reply("Ocurrió un error. Por favor, reinicia el proceso.")
+        await state.clear()
+        return
+
+    names = [tmdb_data.get('title')]
+    if tmdb_data.get('original_title') and tmdb_data.get('original_title') != tmdb_data.get('title'):
+        names.append(tmdb_data.get("original_title"))
+
+    movie_data = {
+        "id": tmdb_data.get("id"),
+        "title": tmdb_data.get("title"),
+        "names": ", ".join(names),
+        "link": movie_link,
+        "last_message_id": None,
+        "last_message_id_public": None, # Asegurarse que exista
+        "last_posted_at": None, # Asegurarse que exista
+        "added_at": datetime.datetime.now().isoformat()
+    }
+    movie_data.update(movie_metadata_snapshot(tmdb_data))
+    
+    await save_movie_to_db(movie_data)
+    await resolve_pending_requests(movie_data["id"], movie_data["title"], link=movie_link)
+
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="📌 Publicar ahora", callback_data=callback_data("publish_now_admin", movie_data['id']))],
+        [types.InlineKeyboardButton(text="➕ Agregar otra película", callback_data=callback_data("add_another_movie"))],
+        [types.InlineKeyboardButton(text="⏰ Publicar con temporizador", callback_data=callback_data("schedule_movie", movie_data['id']))]
+    ])
+    
+    await message.reply(
+        f"✅ La película **{tmdb_data.get('title')}** se agregó correctamente. ¿Qué deseas hacer ahora?", 
+        reply_markup=keyboard, 
+        parse_mode=ParseMode.MARKDOWN
+    )
+    await state.clear()
+
+
+@dp.callback_query(CallbackRoute("publish_now_admin"))
+async def publish_now_admin(callback_query: types.CallbackQuery, callback_args):
+    await bot.answer_callback_query(callback_query.id, "Publicando la película...")
+    movie_id = callback_args.tmdb_id
+    movie_info = await get_movie_by_tmdb_id(movie_id)
+
+    if not movie_info:
+        await bot.send_message(callback_query.message.chat.id, "Error: película no encontrada en la base de datos.")
+        await callback_query.answer()
+        return
+
+    tmdb_data = await get_catalog_movie_metadata(movie_info)
+    if not tmdb_data:
+        await bot.send_message(callback_query.message.chat.id, "Error: no se pudo obtener información de TMDB.")
+        return
+
+    await delete_old_post(movie_id)
+
+    post_keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="🎬 Ver ahora", url=movie_info.get("link"))],
+        [types.InlineKeyboardButton(text="✨ Pedir otra película", url="https://t.me/sdmin_dy_bot?start=request")]
+    ])
+
+    success, message_id = await send_movie_post(TELEGRAM_MAIN_CHANNEL_ID, tmdb_data, movie_info.get("link"), post_keyboard)
+
+    if success:
+        await bot.send_message(callback_query.message.chat.id, "✅ Película publicada con éxito.")
+        await resolve_pending_requests(movie_id, tmdb_data.get("title"), message_id)
+    else:
+        await bot.send_message(callback_query.message.chat.id, "Ocurrió un error al publicar la película.")
+
+    await callback_query.answer()
+
+@dp.callback_query(CallbackRoute("add_another_movie"))
+async def handle_add_another_movie(callback_query: types.CallbackQuery, state: FSMContext):
+    await bot.answer_callback_query(callback_query.id)
+    await state.clear()
+    await bot.send_message(callback_query.message.chat.id, "Por favor, escribe el nombre completo de la siguiente película.")
+    await state.set_state(MovieUploadStates.waiting_for_admin_movie_name)
+
+
+# --- INICIO DEL NUEVO FLUJO DE CATÁLOGO ---
+
+@dp.message(F.text == "📋 Ver catálogo")
+async def view_catalog_by_text(message: types.Message, state: FSMContext):
+    await state.clear()
+    if str(message.from_user.id) != ADMIN_ID:
+        await message.reply("No tienes permiso para esta acción.")
+        return
+    
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="🔍 Buscar en catálogo", callback_data=callback_data("admin_search_catalog"))],
+        [types.InlineKeyboardButton(text="➡️ Ver todo el catálogo", callback_data=callback_data("admin_view_all_catalog"))]
+    ])
+    
+    await message.reply(
+        "Elige una opción para gestionar el catálogo:",
+        reply_markup=keyboard
+    )
+
+
+@dp.callback_query(CallbackRoute("admin_search_catalog"))
+async def admin_search_catalog_start(callback_query: types.CallbackQuery, state: FSMContext):
+    await bot.answer_callback_query(callback_query.id)
+    await state.set_state(AdminStates.waiting_for_catalog_search_query)
+    await bot.send_message(
+        callback_query.message.chat.id,
+        "Por favor, escribe el **nombre** de la película que deseas buscar en tu catálogo.",
+        parse_mode=ParseMode.MARKDOWN
+    )
+    
+@dp.message(AdminStates.waiting_for_catalog_search_query)
+async def admin_process_catalog_search(message: types.Message, state: FSMContext):
+    search_query = message.text.strip()
+    await message.reply(f"Buscando '{search_query}' en el catálogo...")
+    
+    movie_data = await find_movie_in_db_by_name(search_query)
+    
+    if not movie_data:
+        await message.reply("❌ No se encontró una película con ese nombre en tu catálogo. Intenta con un nombre diferente.")
+    else:
+        title = movie_data.get("title") if movie_data.get("title") else "Título desconocido"
+        tmdb_id = movie_data.get("id")
+        
+        keyboard = movie_card_keyboard("admin_catalog", tmdb_id)
+        
+        message_text = (
+            f"✅ **Película Encontrada:**\n"
+            f"**Título:** {title}\n"
+            f"**ID:** `{tmdb_id}`\n"
+            f"**Enlace:** <a href='{movie_data.get('link', 'No disponible')}'>Click para ver el enlace</a>"
+        )
+        
+        await message.reply(
+            message_text,
+            reply_markup=keyboard,
+            parse_mode=ParseMode.HTML,
+            disable_web_page_preview=True
+        )
+        
+    await state.clear()
+
+
+@dp.callback_query(CallbackRoute("admin_view_all_catalog"))
+async def admin_view_all_catalog_callback(callback_query: types.CallbackQuery):
+    await bot.answer_callback_query(callback_query.id)
+    all_movies = await get_all_movies()
+    if not all_movies:
+        await bot.send_message(callback_query.message.chat.id, "Aún no hay películas en la base de datos.")
+        return
+    
+    # Se borra el mensaje de opciones (Buscar/Ver todo) para iniciar el catálogo
+    try:
+        await bot.delete_message(chat_id=callback_query.message.chat.id, message_id=callback_query.message.message_id)
+    except Exception:
+        pass
+        
+    await send_catalog_page(callback_query.message.chat.id, 0)
+
+
+async def send_catalog_page(chat_id, page):
+    movie_items = await get_all_movies()
+    start = page * MOVIES_PER_PAGE
+    end = start + MOVIES_PER_PAGE
+    page_movies = movie_items[start:end]
+    total_movies = len(movie_items)
+    total_pages = (total_movies + MOVIES_PER_PAGE - 1) // MOVIES_PER_PAGE
+    
+    # Si no hay películas para la página actual, regresar o notificar.
+    if not page_movies and total_movies > 0 and page > 0:
+        await bot.send_message(chat_id, "No hay más películas en esta página.")
+        return
+    
+    text = f"**Catálogo de Películas** (Página {page + 1}/{total_pages})\n\n"
+    
+    await bot.send_message(chat_id, text, parse_mode=ParseMode.MARKDOWN)
+
+    for data in page_movies:
+        title = data.get("title") if data.get("title") else "Título desconocido"
+        tmdb_id = data.get("id")
+        
+        keyboard = movie_card_keyboard("admin_catalog", tmdb_id)
+        
+        message_text = f"**{title}**\nID: `{tmdb_id}`"
+        
+        await bot.send_message(
+            chat_id, 
+            message_text,
+            reply_markup=keyboard,
+            parse_mode=ParseMode.MARKDOWN
+        )
+
+    pagination_buttons = []
+    if page > 0:
+        pagination_buttons.append(types.InlineKeyboardButton(text="⬅️ Anterior", callback_data=callback_data("catalog_page", page - 1)))
+    if page + 1 < total_pages:
+        pagination_buttons.append(types.InlineKeyboardButton(text="Siguiente ➡️", callback_data=callback_data("catalog_page", page + 1)))
+    
+    if pagination_buttons:
+        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[pagination_buttons])
+        await bot.send_message(chat_id, "Navegación:", reply_markup=keyboard)
+
+
+@dp.callback_query(CallbackRoute("catalog_page"))
+async def navigate_catalog(callback_query: types.CallbackQuery, callback_args):
+    page = callback_args.page
+    try:
+        await bot.delete_message(chat_id=callback_query.message.chat.id, message_id=callback_query.message.message_id)
+    except Exception as e:
+        logging.error(f"Error al borrar mensaje de catálogo: {e}")
+    await send_catalog_page(callback_query.message.chat.id, page)
+
+@dp.callback_query(CallbackRoute("edit_movie"))
+async def handle_edit_movie(callback_query: types.CallbackQuery):
+    await bot.answer_callback_query(callback_query.id)
+    await bot.send_message(callback_query.message.chat.id, "La función de edición está en desarrollo. ¡Pronto estará disponible!")
+
+@dp.callback_query(CallbackRoute("delete_movie"))
+async def handle_delete_movie(callback_query: types.CallbackQuery, callback_args):
+    await bot.answer_callback_query(callback_query.id)
+    movie_id = callback_args.tmdb_id
+    
+    movie_to_delete = await get_movie_by_tmdb_id(movie_id)
+    if movie_to_delete:
+        # Usar la función de borrado de post que borra de AMBOS canales
+        await delete_old_post(movie_id)
+        
+        await delete_movie_from_db(movie_id)
+        await bot.send_message(callback_query.message.chat.id, f"✅ La película **{movie_to_delete.get('title')}** ha sido eliminada del catálogo y del canal.", parse_mode=ParseMode.MARKDOWN)
+    else:
+        await bot.send_message(callback_query.message.chat.id, "No se encontró la película para eliminar.")
+
+@dp.callback_query(CallbackRoute("publish_from_catalog"))
+async def publish_from_catalog(callback_query: types.CallbackQuery, callback_args):
+    movie_id = callback_args.tmdb_id
+    movie_info = await get_movie_by_tmdb_id(movie_id)
+    if not movie_info:
+        await bot.answer_callback_query(callback_query.id, "Error: película no encontrada en la base de datos.", show_alert=True)
+        return
+    tmdb_data = await get_catalog_movie_metadata(movie_info)
+    if not tmdb_data:
+        await bot.answer_callback_query(callback_query.id, "No se pudo obtener la información de la película. No se puede publicar.", show_alert=True)
+        return
+    await delete_old_post(movie_id)
+    text, poster_url, post_keyboard = create_movie_message(tmdb_data, movie_info.get("link"))
+    success, _ = await send_movie_post(TELEGRAM_MAIN_CHANNEL_ID, tmdb_data, movie_info.get("link"), post_keyboard)
+    if success:
+        await bot.answer_callback_query(callback_query.id, "✅ Película publicada con éxito.", show_alert=True)
+    else:
+        await bot.answer_callback_query(callback_query.id, "Ocurrió un error al publicar la película.", show_alert=True)
+        
+# --- FIN DEL NUEVO FLUJO DE CATÁLOGO ---
+
+# --- Importación masiva del catálogo (movies.json) ---
+
+def iter_movies_json(stream, chunk_size=65536):
+    """
+    Lee un fichero con el formato de movies.json ({"título": {"names", "id", "link", ...}}) o una
+    lista de objetos, sin cargarlo entero en memoria. Devuelve pares (clave, entrada).
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, position, eof
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            eof = True
+        buffer = buffer[position:] + chunk
+        position = 0
+
+    def skip_whitespace():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position] in " \t\r\n":
+                position += 1
+            if position < len(buffer) or eof:
+                return
+            fill()
+
+    def next_char():
+        skip_whitespace()
+        return buffer[position] if position < len(buffer) else ""
+
+    def decode_value():
+        nonlocal position
+        skip_whitespace()
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+                # Un valor que toca el final del buffer puede estar cortado (p. ej. un número)
+                if end < len(buffer) or eof:
+                    position = end
+                    return value
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+
+    def expect(char):
+        nonlocal position
+        if next_char() != char:
+            raise ValueError(f"JSON inválido: se esperaba '{char}' en la posición {position}.")
+        position += 1
+
+    opening = next_char()
+    if opening not in ("{", "["):
+        raise ValueError("El fichero debe contener un objeto o una lista JSON.")
+    position += 1
+    closing = "}" if opening == "{" else "]"
+    index = 0
+    while True:
+        if next_char() == closing:
+            return
+        if index:
+            expect(",")
+        if opening == "{":
+            key = decode_value()
+            expect(":")
+        else:
+            key = None
+        yield key, decode_value()
+        index += 1
+
+def normalize_movie_names(names, key=None):
+    """Primera línea de cada nombre, espacios colapsados y sin duplicados (sin distinguir mayúsculas)."""
+    if isinstance(names, str):
+        names = names.split(", ")
+    candidates = list(names or [])
+    if key:
+        candidates.append(key)
+    normalized, seen = [], set()
+    for name in candidates:
+        if not isinstance(name, str):
+            continue
+        lines = [line.strip() for line in name.splitlines() if line.strip()]
+        if not lines:
+            continue
+        clean = " ".join(lines[0].split())
+        if clean.casefold() not in seen:
+            seen.add(clean.casefold())
+            normalized.append(clean)
+    return normalized
+
+async def enrich_import_record(record, semaphore):
+    """Completa con TMDB el ID (buscando por nombre) o el título que falten en una entrada."""
+    async with semaphore:
+        if record["id"] is None:
+            for name in record["names"][:2]:
+                results, _ = await get_movie_results_by_title(name)
+                if results:
+                    record["id"] = results[0].get("id")
+                    record["title"] = results[0].get("title") or record["title"]
+                    record["enriched"] = True
+                    break
+        elif not record["title"]:
+            tmdb_data = await get_movie_details(record["id"])
+            if tmdb_data:
+                record["title"] = tmdb_data.get("title")
+                record["names"] = normalize_movie_names(record["names"] + [tmdb_data.get("title"), tmdb_data.get("original_title")])
+                record["enriched"] = True
+    return record
+
+def import_record_operation(record, now):
+    update = {
+        "$set": {"names": ", ".join(record["names"])},
+        # Los campos de publicación solo se inicializan en películas nuevas
+        "$setOnInsert": {
+            "id": record["id"],
+            "last_message_id": record["last_message_id"],
+            "last_message_id_public": None,
+            "last_posted_at": None,
+            "added_at": now,
+        },
+    }
+    if record["title"]:
+        update["$set"]["title"] = record["title"]
+    if record["link"]:
+        update["$set"]["link"] = record["link"]
+        update["$unset"] = {field: "" for field in LINK_CHECK_FIELDS}
+    return UpdateOne({"id": record["id"]}, update, upsert=True)
+
+async def import_movies_stream(stream, progress=None, batch_size=IMPORT_BATCH_SIZE, tmdb_concurrency=IMPORT_TMDB_CONCURRENCY):
+    """
+    Importa un fichero tipo movies.json en lotes de `batch_size` upserts con bulk_write.
+    `progress(stats)` se llama tras cada lote. Devuelve las estadísticas finales.
+    """
+    collection = get_mongo_db_collection()
+    if collection is None:
+        raise RuntimeError("No hay conexión con la base de datos.")
+    # Sin índice en "id" cada upsert recorre la colección entera
+    await collection.create_index("id")
+
+    stats = {"read": 0, "inserted": 0, "updated": 0, "duplicates": 0, "enriched": 0, "skipped": 0, "batches": 0}
+    seen_ids = set()
+    semaphore = asyncio.Semaphore(max(tmdb_concurrency, 1))
+    batch = []
+
+    async def flush():
+        records = await asyncio.gather(*(
+            enrich_import_record(record, semaphore) if record["id"] is None or not record["title"] else asyncio.sleep(0, record)
+            for record in batch
+        ))
+        batch.clear()
+        now = datetime.datetime.now().isoformat()
+        operations, written = [], []
+        for record in records:
+            stats["enriched"] += record.get("enriched", False)
+            if record["id"] is None:
+                stats["skipped"] += 1
+                continue
+            if record["id"] in seen_ids:
+                stats["duplicates"] += 1
+                continue
+            seen_ids.add(record["id"])
+            operations.append(import_record_operation(record, now))
+            written.append(record)
+        if operations:
+            result = await collection.bulk_write(operations, ordered=False)
+            stats["inserted"] += result.upserted_count
+            stats["updated"] += result.matched_count
+            for record in written:
+                invalidate_rendered_movie(record["id"])
+            catalog_index.upsert_many(
+                {"id": record["id"], "title": record["title"], "names": record["names"], "link": record["link"]}
+                for record in written
+            )
+            await resolve_pending_requests_many(record for record in written if record["link"])
+        stats["batches"] += 1
+        if progress:
+            await progress(dict(stats))
+
+    for key, entry in iter_movies_json(stream):
+        stats["read"] += 1
+        if not isinstance(entry, dict):
+            stats["skipped"] += 1
+            continue
+        try:
+            tmdb_id = int(entry["id"]) if entry.get("id") is not None else None
+        except (TypeError, ValueError):
+            tmdb_id = None
+        # Los duplicados con ID conocido se descartan antes de gastar llamadas a TMDB
+        if tmdb_id is not None and tmdb_id in seen_ids:
+            stats["duplicates"] += 1
+            continue
+        names = normalize_movie_names(entry.get("names"), key)
+        if tmdb_id is None and not names:
+            stats["skipped"] += 1
+            continue
+        batch.append({
+            "id": tmdb_id,
+            "title": entry.get("title") or (names[0] if names else None),
+            "names": names,
+            "link": entry.get("link"),
+            "last_message_id": entry.get("last_message_id"),
+        })
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+    return stats
+
+async def import_movies_file(path, progress=None, **kwargs):
+    with open(path, encoding="utf-8") as f:
+        return await import_movies_stream(f, progress, **kwargs)
+
+def format_import_stats(stats):
+    return (
+        f"Leídas: {stats['read']} · nuevas: {stats['inserted']} · actualizadas: {stats['updated']}\n"
+        f"Duplicadas: {stats['duplicates']} · completadas con TMDB: {stats['enriched']} · descartadas: {stats['skipped']}"
+    )
+
+import_tasks = set()
+
+@dp.message(F.document.file_name.endswith(".json"))
+async def admin_import_movies_document(message: types.Message):
+    if str(message.from_user.id) != ADMIN_ID:
+        return
+    # La importación puede durar minutos: se ejecuta aparte para no retener el webhook
+    task = asyncio.create_task(run_admin_import(message.chat.id, message.document))
+    import_tasks.add(task)
+    task.add_done_callback(import_tasks.discard)
+
+async def run_admin_import(chat_id, document):
+    status = await bot.send_message(chat_id, f"📥 Importando <b>{html.quote(document.file_name)}</b>...", parse_mode=ParseMode.HTML)
+    last_edit = 0.0
+
+    async def progress(stats):
+        nonlocal last_edit
+        if time.monotonic() - last_edit < IMPORT_PROGRESS_SECONDS:
+            return
+        last_edit = time.monotonic()
+        try:
+            await bot.edit_message_text(f"📥 Importando...\n{format_import_stats(stats)}", chat_id=chat_id, message_id=status.message_id)
+        except TelegramBadRequest:
+            pass
+
+    with tempfile.NamedTemporaryFile(suffix=".json") as temporary:
+        try:
+            await bot.download(document, destination=temporary.name)
+            stats = await import_movies_file(temporary.name, progress)
+            text = f"✅ Importación completada.\n{format_import_stats(stats)}"
+        except Exception as e:
+            logging.error(f"Error al importar el catálogo: {e}")
+            text = f"❌ Error al importar el catálogo: {html.quote(str(e))}"
+    try:
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=status.message_id, parse_mode=ParseMode.HTML)
+    except TelegramBadRequest:
+        await bot.send_message(chat_id, text, parse_mode=ParseMode.HTML)
+
+
+# --- Opciones de auto-publicación actualizadas ---
+@dp.message(F.text == "⚙️ Configuración auto-publicación")
+async def auto_post_config(message: types.Message, state: FSMContext):
+    await state.clear()
+    if str(message.from_user.id) != ADMIN_ID:
+        await message.reply("No tienes permiso para esta acción.")
+        return
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="8 películas al día (Cada 3 hrs)", callback_data=callback_data("set_auto", 8))],
+        [types.InlineKeyboardButton(text="12 películas al día (Cada 2 hrs)", callback_data=callback_data("set_auto", 12))],
+        [types.InlineKeyboardButton(text="16 películas al día", callback_data=callback_data("set_auto", 16))],
+        [types.InlineKeyboardButton(text="24 películas al día (Cada 1 hr)", callback_data=callback_data("set_auto", 24))]
+    ])
+    await message.reply("Elige cuántas películas quieres que se publiquen automáticamente cada día:", reply_markup=keyboard)
+
+@dp.callback_query(CallbackRoute("set_auto"))
+async def set_auto_post_count(callback_query: types.CallbackQuery, callback_args):
+    global AUTO_POST_COUNT
+    AUTO_POST_COUNT = callback_args.count
+    await bot.answer_callback_query(callback_query.id, f"Publicación automática configurada para {AUTO_POST_COUNT} películas al día.")
+    await bot.edit_message_text(
+        chat_id=callback_query.message.chat.id,
+        message_id=callback_query.message.message_id,
+        text=f"✅ Publicación automática configurada para {AUTO_POST_COUNT} películas al día."
+    )
+
+@dp.message(Command("profiling"))
+async def set_profiling_sample_rate(message: types.Message, command: CommandObject):
+    global PROFILE_SAMPLE_EVERY
+    if str(message.from_user.id) != ADMIN_ID:
+        await message.reply("No tienes permiso para esta acción.")
+        return
+    try:
+        PROFILE_SAMPLE_EVERY = max(int(command.args or "0"), 0)
+    except ValueError:
+        await message.reply("Uso: /profiling N (perfila 1 de cada N updates; 0 lo desactiva).")
+        return
+    if PROFILE_SAMPLE_EVERY:
+        await message.reply(f"✅ cProfile activado para 1 de cada {PROFILE_SAMPLE_EVERY} updates.")
+    else:
+        await message.reply("✅ cProfile desactivado.")
+
+@dp.message(Command("spam_add", "spam_remove"))
+async def edit_spam_blocklist(message: types.Message, command: CommandObject):
+    if str(message.from_user.id) != ADMIN_ID:
+        await message.reply("No tienes permiso para esta acción.")
+        return
+    pattern = normalize_spam_pattern(command.args)
+    if not pattern:
+        await message.reply(f"Uso: /{command.command} texto (por ejemplo, un dominio).")
+        return
+    if command.command == "spam_add":
+        await spam_filter.add(pattern)
+        await message.reply(f"✅ «{html.quote(pattern)}» añadido a la lista de spam ({len(spam_filter)} patrones).")
+    else:
+        await spam_filter.remove(pattern)
+        await message.reply(f"✅ «{html.quote(pattern)}» quitado de la lista de spam ({len(spam_filter)} patrones).")
+
+@dp.message(Command("spam_list"))
+async def show_spam_blocklist(message: types.Message):
+    if str(message.from_user.id) != ADMIN_ID:
+        await message.reply("No tienes permiso para esta acción.")
+        return
+    stats = await spam_filter.stats()
+    if not stats:
+        await message.reply("La lista de spam está vacía.")
+        return
+    lines = [f"• {html.quote(pattern)} — {hits} mensajes borrados" for pattern, hits in stats]
+    await message.reply("🚫 <b>Lista de spam</b>\n" + "\n".join(lines))
+
+@dp.message(Command("dead_links"))
+async def show_dead_links(message: types.Message):
+    if str(message.from_user.id) != ADMIN_ID:
+        await message.reply("No tienes permiso para esta acción.")
+        return
+    collection = get_mongo_db_collection()
+    if collection is None:
+        await message.reply("No hay conexión con la base de datos.")
+        return
+    dead = await collection.find({"link_status": "dead"}, {"id": 1, "title": 1, "link_http_status": 1, "link_checked_at": 1}).to_list(50)
+    if not dead:
+        await message.reply("✅ No hay enlaces caídos en el catálogo.")
+        return
+    lines = [
+        f"• {html.quote(movie.get('title') or '')} (ID {movie.get('id')}) — HTTP {movie.get('link_http_status') or 'sin respuesta'}, {str(movie.get('link_checked_at', ''))[:10]}"
+        for movie in dead
+    ]
+    await message.reply(f"🔗 <b>Enlaces caídos</b> ({len(dead)}{'+' if len(dead) == 50 else ''}). Se saltan en la auto-publicación; vuelve a añadir la película con un enlace nuevo para reemplazarlo.\n" + "\n".join(lines))
+
+# --- (ESTA ES LA FUNCIÓN MODIFICADA) ---
+@dp.message(F.text == "📰 Configurar noticias")
+async def news_post_config(message: types.Message, state: FSMContext):
+    if str(message.from_user.id) != ADMIN_ID:
+        await message.reply("No tienes permiso para esta acción.")
+        return
+    await state.clear()
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="3 noticias/memes al día (Cada 8 hrs)", callback_data=callback_data("set_news", 3))],
+        [types.InlineKeyboardButton(text="4 noticias/memes al día (Cada 6 hrs)", callback_data=callback_data("set_news", 4))],
+        [types.InlineKeyboardButton(text="6 noticias/memes al día (Cada 4 hrs)", callback_data=callback_data("set_news", 6))]
+    ])
+    await message.reply("Elige cuántas noticias y memes quieres que se publiquen automáticamente cada día:", reply_markup=keyboard)
+
+@dp.callback_query(CallbackRoute("set_news"))
+async def set_news_post_count(callback_query: types.CallbackQuery, callback_args):
+    global NEWS_POST_COUNT
+    NEWS_POST_COUNT = callback_args.count
+    await bot.answer_callback_query(callback_query.id, f"Publicación de noticias y memes configurada para {NEWS_POST_COUNT} al día.")
+    await bot.edit_message_text(
+        chat_id=callback_query.message.chat.id,
+        message_id=callback_query.message.message_id,
+        text=f"✅ Publicación de noticias y memes configurada para {NEWS_POST_COUNT} al día."
+    )
+
+
+@dp.message(F.text == "🎞️ Estrenos")
+async def show_estrenos_by_text(message: types.Message, state: FSMContext):
+    await state.clear()
+    await show_estrenos_page(message.chat.id, page=1, is_start_message=True)
+
+@dp.callback_query(CallbackRoute("estrenos_page"))
+async def navigate_estrenos_page(callback_query: types.CallbackQuery, callback_args):
+    page = callback_args.page
+    await bot.answer_callback_query(callback_query.id)
+    await show_estrenos_page(callback_query.message.chat.id, page)
+
+async def show_estrenos_page(chat_id, page, is_start_message=False):
+    if is_start_message:
+        await bot.send_message(chat_id, "Buscando los últimos estrenos... 🎬")
+
+    upcoming_movies, total_pages = await get_upcoming_movies(page)
+    
+    if not upcoming_movies:
+        await bot.send_message(chat_id, "No se encontraron más estrenos recientes en este momento. Vuelve a intentarlo más tarde.")
+        return
+
+    for movie in upcoming_movies[:ESTRENOS_PER_PAGE]:
+        tmdb_id = movie.get("id")
+        tmdb_data = await get_movie_details(tmdb_id)
+        if not tmdb_data:
+            continue
+        
+        movie_in_db = await get_movie_by_tmdb_id(tmdb_id)
+        
+        if movie_in_db:
+            keyboard = movie_card_keyboard("watch_publish", tmdb_id, movie_in_db.get("link"))
+        else:
+            keyboard = movie_card_keyboard("request", tmdb_id)
+            
+        text, poster_url, _ = create_movie_message(tmdb_data)
+        
+        try:
+            if poster_url:
+                await bot.send_photo(chat_id, photo=poster_url, caption=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+            else:
+                await bot.send_message(chat_id, text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+        except Exception as e:
+            logging.error(f"Error al enviar estreno: {e}")
+    
+    if page < total_pages:
+        keyboard_next = types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text="Ver más estrenos ➡️", callback_data=callback_data("estrenos_page", page + 1))]
+        ])
+        await bot.send_message(chat_id, "Mira lo que sigue:", reply_markup=keyboard_next)
+
+@dp.message(F.text == "🔍 Buscar película")
+async def show_search_options_by_text(message: types.Message, state: FSMContext):
+    await state.clear()
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="Por Género", callback_data=callback_data("search_by_genre"))],
+        [types.InlineKeyboardButton(text="Por Actor", callback_data=callback_data("search_by_actor"))],
+        [types.InlineKeyboardButton(text="Buscar Película", callback_data=callback_data("search_by_name"))],
+    ])
+    await message.reply(
+        "¿Cómo quieres buscar la película? 🔎",
+        reply_markup=keyboard
+    )
+    
+@dp.callback_query(CallbackRoute("search_by_actor"))
+async def search_by_actor_start(callback_query: types.CallbackQuery, state: FSMContext):
+    await bot.answer_callback_query(callback_query.id)
+    await state.clear()
+    await state.set_state(MovieRequestStates.waiting_for_actor_name)
+    await bot.send_message(callback_query.message.chat.id, "Por favor, escribe el nombre del actor. 🎭")
+
+@dp.message(MovieRequestStates.waiting_for_actor_name)
+async def search_by_actor_process(message: types.Message, state: FSMContext):
+    actor_name = message.text.strip()
+    await message.reply(f"Buscando películas de '{actor_name}'...")
+    movies, total_pages = await get_movies_by_actor(actor_name)
+    
+    if not movies:
+        await message.reply("No se encontraron películas para este actor. Intenta con un nombre diferente.")
+        await state.clear()
+        return
+
+    for movie in movies[:SEARCH_RESULTS_PER_PAGE]:
+        tmdb_id = movie.get("id")
+        tmdb_data = await get_movie_details(tmdb_id)
+        if not tmdb_data:
+            continue
+        
+        movie_in_db = await get_movie_by_tmdb_id(tmdb_id)
+        
+        if movie_in_db:
+            keyboard = movie_card_keyboard("watch", tmdb_id, movie_in_db.get("link"))
+        else:
+            keyboard = movie_card_keyboard("request", tmdb_id)
+            
+        text, poster_url, _ = create_movie_message(tmdb_data)
+        
+        try:
+            if poster_url:
+                await bot.send_photo(chat_id=message.chat.id, photo=poster_url, caption=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+            else:
+                await bot.send_message(chat_id=message.chat.id, text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+        except Exception as e:
+            logging.error(f"Error al enviar la publicación de actor: {e}")
+    
+    await state.clear()
+
+
+async def send_catalog_matches(chat_id, query):
+    """
+    Avisa al momento, sin esperar a TMDB, de las películas del catálogo que coinciden con
+    la búsqueda (aunque tenga erratas o le falten acentos). Devuelve cuántas se mostraron.
+    """
+    matches = [
+        catalog_index.movies[tmdb_id]
+        for tmdb_id in catalog_index.search_fuzzy(query, limit=CATALOG_MATCHES_PER_SEARCH)
+        if catalog_index.movies[tmdb_id].get("link")
+    ]
+    if not matches:
+        return 0
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text=f"🎬 {movie.get('title') or 'Ver ahora'}", url=movie["link"])]
+        for movie in matches
+    ])
+    try:
+        await bot.send_message(chat_id, "✅ Ya disponible en el catálogo:", reply_markup=keyboard)
+    except Exception as e:
+        logging.error(f"Error al enviar las coincidencias del catálogo: {e}")
+        return 0
+    return len(matches)
+
+@dp.callback_query(CallbackRoute("search_by_name"))
+async def search_by_name_start(callback_query: types.CallbackQuery, state: FSMContext):
+    await bot.answer_callback_query(callback_query.id)
+    await state.clear()
+    await state.set_state(MovieRequestStates.waiting_for_search_query)
+    await bot.send_message(callback_query.message.chat.id, "Por favor, escribe el nombre de la película. 🎬")
+
+@dp.message(MovieRequestStates.waiting_for_search_query)
+async def search_by_name_process(message: types.Message, state: FSMContext):
+    query = message.text.strip()
+    await message.reply(f"Buscando '{query}'...")
+    catalog_matches = await send_catalog_matches(message.chat.id, query)
+    results, total_pages = await get_movie_results_by_title(query)
+    
+    if not results:
+        if not catalog_matches:
+            await message.reply("No se encontraron películas con ese nombre. Intenta con otro.")
+        await state.clear()
+        return
+        
+    tmdb_ids = [movie["id"] for movie in results if movie.get("id") is not None]
+    await send_search_result_cards(message.chat.id, tmdb_ids, 0)
+    await state.clear()
+
+async def send_search_result_cards(chat_id, tmdb_ids, offset, token=None):
+    """Tarjetas de tmdb_ids[offset:offset + SEARCH_RESULTS_PER_PAGE] y, si quedan más, un botón "Ver más"."""
+    for tmdb_id in tmdb_ids[offset:offset + SEARCH_RESULTS_PER_PAGE]:
+        tmdb_data = await get_movie_details(tmdb_id)
+        if not tmdb_data:
+            continue
+        
+        movie_in_db = await get_movie_by_tmdb_id(tmdb_id)
+        
+        if movie_in_db:
+            keyboard = movie_card_keyboard("watch_publish", tmdb_id, movie_in_db.get("link"))
+        else:
+            keyboard = movie_card_keyboard("request", tmdb_id)
+            
+        text, poster_url, _ = create_movie_message(tmdb_data)
+        
+        try:
+            if poster_url:
+                await bot.send_photo(chat_id=chat_id, photo=poster_url, caption=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+            else:
+                await bot.send_message(chat_id=chat_id, text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+        except Exception as e:
+            logging.error(f"Error al enviar la publicación de búsqueda: {e}")
+
+    next_offset = offset + SEARCH_RESULTS_PER_PAGE
+    if next_offset < len(tmdb_ids):
+        # El botón solo lleva un token: la lista completa de resultados queda en result_sets
+        token = token or await result_sets.put(tmdb_ids)
+        keyboard_next = types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text="Ver más resultados ➡️", callback_data=callback_data("search_more", token, next_offset))]
+        ])
+        await bot.send_message(chat_id, "¿No es ninguna de estas?", reply_markup=keyboard_next)
+
+@dp.callback_query(CallbackRoute("search_more"))
+async def show_more_search_results(callback_query: types.CallbackQuery, callback_args):
+    await bot.answer_callback_query(callback_query.id)
+    tmdb_ids = await result_sets.get(callback_args.token)
+    if tmdb_ids is None:
+        await bot.send_message(callback_query.message.chat.id, "Esta búsqueda ha caducado. Vuelve a buscar la película. 🔍")
+        return
+    try:
+        await bot.delete_message(chat_id=callback_query.message.chat.id, message_id=callback_query.message.message_id)
+    except Exception as e:
+        logging.warning(f"No se pudo borrar el botón de más resultados: {e}")
+    await send_search_result_cards(callback_query.message.chat.id, tmdb_ids, callback_args.offset, callback_args.token)
+
+
+# --- Búsqueda inline: @bot título, respondida desde el índice en memoria ---
+
+def inline_movie_result(movie):
+    link = movie.get("link")
+
+    def render():
+        title = movie.get("title") or "Título desconocido"
+        other_names = [name for name in dict.fromkeys(CatalogIndex.movie_names(movie)) if name != title]
+        return types.InlineQueryResultArticle(
+            id=str(movie["id"]),
+            title=title,
+            description=", ".join(other_names)[:100] or None,
+            thumbnail_url=get_movie_poster_url(movie.get("poster_path")),
+            input_message_content=types.InputTextMessageContent(message_text=f"🎬 <b>{html.quote(title)}</b>", parse_mode=ParseMode.HTML),
+            reply_markup=types.InlineKeyboardMarkup(inline_keyboard=[[types.InlineKeyboardButton(text="🎬 Ver ahora", url=link)]]),
+        )
+
+    signature = (movie.get("title"), movie.get("original_title"), str(movie.get("names")), movie.get("poster_path"))
+    return rendered_movies.get("inline", (movie["id"], "inline", link), signature, render)
+
+@dp.inline_query()
+async def inline_catalog_search(inline_query: types.InlineQuery):
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    matches = [tmdb_id for tmdb_id in catalog_index.search_prefix(inline_query.query) if catalog_index.movies[tmdb_id].get("link")]
+    page = matches[offset:offset + INLINE_RESULTS_PER_PAGE]
+    next_offset = str(offset + INLINE_RESULTS_PER_PAGE) if offset + INLINE_RESULTS_PER_PAGE < len(matches) else ""
+    # Mismas consultas, mismas respuestas: Telegram puede cachearlas para todos los usuarios
+    await inline_query.answer(
+        [inline_movie_result(catalog_index.movies[tmdb_id]) for tmdb_id in page],
+        cache_time=INLINE_CACHE_SECONDS,
+        is_personal=False,
+        next_offset=next_offset
+    )
+
+
+@dp.message(F.text == "✨ Recomiéndame")
+async def show_recomendar_by_text(message: types.Message, state: FSMContext):
+    await state.clear()
+    await show_recomendar_page(message.chat.id, page=1, is_start_message=True)
+
+@dp.callback_query(CallbackRoute("recomendar_page"))
+async def navigate_recomendar_page(callback_query: types.CallbackQuery, callback_args):
+    page = callback_args.page
+    await bot.answer_callback_query(callback_query.id)
+    await show_recomendar_page(callback_query.message.chat.id, page)
+
+async def show_recomendar_page(chat_id, page, is_start_message=False):
+    if is_start_message:
+        await bot.send_message(chat_id, "Obteniendo recomendaciones... ✨")
+
+    popular_movies, total_pages = await get_popular_movies(page)
+    
+    if not popular_movies:
+        await bot.send_message(chat_id, "No se pudieron obtener más recomendaciones en este momento. Vuelve a intentarlo más tarde.")
+        return
+
+    for movie in popular_movies[:RECOMENDACIONES_PER_PAGE]:
+        tmdb_id = movie.get("id")
+        tmdb_data = await get_movie_details(tmdb_id)
+        if not tmdb_data:
+            continue
+
+        movie_in_db = await get_movie_by_tmdb_id(tmdb_id)
+
+        if movie_in_db:
+            keyboard = movie_card_keyboard("watch_publish", tmdb_id, movie_in_db.get("link"))
+        else:
+            keyboard = movie_card_keyboard("request", tmdb_id)
+            
+        text, poster_url, _ = create_movie_message(tmdb_data)
+        
+        try:
+            if poster_url:
+                await bot.send_photo(chat_id, photo=poster_url, caption=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+            else:
+                await bot.send_message(chat_id, text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+        except Exception as e:
+            logging.error(f"Error al enviar recomendación: {e}")
+    
+    if page < total_pages:
+        keyboard_next = types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text="Ver más recomendaciones ➡️", callback_data=callback_data("recomendar_page", page + 1))]
+        ])
+        await bot.send_message(chat_id, "Mira lo que sigue:", reply_markup=keyboard_next)
+
+@dp.message(F.text == "📰 Noticias")
+async def send_latest_news_handler(message: types.Message, state: FSMContext):
+    await state.clear()
+    await message.reply("Buscando las últimas noticias de cine...")
+    articles = await news_pool.latest(3)
+    if not articles:
+        await message.reply("Lo siento, no se encontraron noticias de cine en este momento.")
+        return
+
+    for article in articles:
+        title = article.get("title") or "Sin título"
+        description = article.get("description") or "Sin descripción"
+        url = article.get("url", "#")
+        image_url = article.get("urlToImage") if article.get("image_ok") else None
+
+        news_text = (
+            f"<b>{html.quote(title)}</b>\n\n"
+            f"<i>{html.quote(description)}</i>\n\n"
+            f"<a href='{html.quote(url)}'>Leer más</a>"
+        )
+        try:
+            if image_url:
+                await bot.send_photo(
+                    chat_id=message.chat.id,
+                    photo=image_url,
+                    caption=news_text,
+                    parse_mode=ParseMode.HTML
+                )
+            else:
+                await bot.send_message(
+                    chat_id=message.chat.id,
+                    text=news_text,
+                    parse_mode=ParseMode.HTML,
+                    disable_web_page_preview=True
+                )
+        except Exception as e:
+            logging.error(f"Error al enviar la noticia: {e}")
+            await bot.send_message(
+                chat_id=message.chat.id,
+                text=news_text,
+                parse_mode=ParseMode.HTML,
+                disable_web_page_preview=True
+            )
+
+@dp.callback_query(CallbackRoute("search_by_genre"))
+async def search_by_genre_callback(callback_query: types.CallbackQuery, state: FSMContext):
+    await bot.answer_callback_query(callback_query.id)
+    await state.clear()
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text=genre, callback_data=callback_data("genre", id)) for genre, id in list(GENRES.items())[i:i+3]] for i in range(0, len(GENRES), 3)
+    ] + [[types.InlineKeyboardButton(text="⬅️ Regresar", callback_data=callback_data("back_to_search_menu"))]])
+    await bot.send_message(callback_query.message.chat.id, "Elige un género:", reply_markup=keyboard)
+
+@dp.callback_query(CallbackRoute("back_to_search_menu"))
+async def back_to_search_menu(callback_query: types.CallbackQuery, state: FSMContext):
+    await bot.answer_callback_query(callback_query.id)
+    await state.clear()
+    await show_search_options_by_text(callback_query.message)
+
+
+@dp.callback_query(CallbackRoute("genre"))
+async def show_movies_by_genre(callback_query: types.CallbackQuery, callback_args, page=1):
+    await bot.answer_callback_query(callback_query.id)
+    genre_id = callback_args.genre_id
+    
+    movies, total_pages = await get_movies_by_genre(genre_id, page=page)
+
+    if not movies:
+        await bot.send_message(callback_query.message.chat.id, "No se encontraron más películas para este género.")
+        return
+
+    await bot.send_message(callback_query.message.chat.id, f"**Aquí tienes algunas películas de {next((k for k, v in GENRES.items() if v == genre_id), 'este género')}:**", parse_mode=ParseMode.MARKDOWN)
+
+    for movie in movies[:5]:
+        tmdb_id = movie.get("id")
+        tmdb_data = await get_movie_details(tmdb_id)
+        if not tmdb_data:
+            continue
+        
+        movie_in_db = await get_movie_by_tmdb_id(tmdb_id)
+        
+        if movie_in_db:
+            keyboard = movie_card_keyboard("watch_publish", tmdb_id, movie_in_db.get("link"))
+        else:
+            keyboard = movie_card_keyboard("request", tmdb_id)
+
+        text, poster_url, _ = create_movie_message(tmdb_data)
+        
+        try:
+            if poster_url:
+                await bot.send_photo(chat_id=callback_query.message.chat.id, photo=poster_url, caption=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+            else:
+                await bot.send_message(chat_id=callback_query.message.chat.id, text=text, reply_markup=keyboard, parse_mode=ParseMode.HTML)
+        except Exception as e:
+            logging.error(f"Error al enviar la publicación en el catálogo: {e}")
+
+    keyboard_buttons = []
+    if page > 1:
+        keyboard_buttons.append(types.InlineKeyboardButton(text="⬅️ Anterior", callback_data=callback_data("genre_page", genre_id, page - 1)))
+    if page + 1 < total_pages:
+        keyboard_buttons.append(types.InlineKeyboardButton(text="Siguiente ➡️", callback_data=callback_data("genre_page", genre_id, page + 1)))
+    
+    keyboard_buttons.append(types.InlineKeyboardButton(text="⬅️ Regresar", callback_data=callback_data("back_to_search_menu")))
+
+    keyboard_pag = types.InlineKeyboardMarkup(inline_keyboard=[keyboard_buttons])
+    await bot.send_message(callback_query.message.chat.id, "Navega en los resultados:", reply_markup=keyboard_pag)
+
+@dp.callback_query(CallbackRoute("genre_page"))
+async def navigate_genre_page(callback_query: types.CallbackQuery, callback_args):
+    genre_id = callback_args.genre_id
+    page = callback_args.page
+    try:
+        await bot.delete_message(chat_id=callback_query.message.chat.id, message_id=callback_query.message.message_id)
+    except Exception as e:
+        logging.error(f"Error al borrar mensaje de catálogo: {e}")
+    await show_movies_by_genre(callback_query, callback_args, page=page)
+
+
+@dp.message(F.text == "📌 Pedir película")
+async def start_request_flow(message: types.Message, state: FSMContext):
+    user_id = message.from_user.id
+    if await request_counters.get("user", user_id) >= USER_REQUEST_LIMIT:
+        await message.reply("🚫 Has alcanzado el límite de solicitudes diarias. Inténtalo de nuevo mañana.")
+        await state.clear()
+        return
+        
+    await state.set_state(MovieRequestStates.waiting_for_movie_name_to_request)
+    await message.reply(
+        "Por favor, escribe el nombre de la película que te gustaría solicitar. Buscaremos las mejores opciones para ti."
+    )
+
+@dp.callback_query(CallbackRoute("request_movie_from_main_menu"))
+async def start_request_flow_callback(callback_query: types.CallbackQuery, state: FSMContext):
+    await bot.answer_callback_query(callback_query.id)
+    await state.clear()
+    await state.set_state(MovieRequestStates.waiting_for_movie_name_to_request)
+    await bot.send_message(
+        callback_query.message.chat.id,
+        "Por favor, escribe el nombre de la película que te gustaría solicitar. Buscaremos las mejores opciones para ti."
+    )
+    try:
+        await bot.delete_message(chat_id=callback_query.message.chat.id, message_id=callback_query.message.message_id)
+    except Exception as e:
+        logging.warning(f"No se pudo borrar el mensaje original al solicitar otra película: {e}")
+
+
+@dp.message(MovieRequestStates.waiting_for_movie_name_to_request)
+async def process_movie_name_for_request(message: types.Message, state: FSMContext):
+    user_id = message.from_user.id
+    movie_title = message.text.strip()
+    await message.reply(f"Buscando **{movie_title}** en la base de datos... 🔍")
+    catalog_matches = await send_catalog_matches(message.chat.id, movie_title)
+    
+    tmdb_results, _ = await get_movie_results_by_title(movie_title, page=1)
+    
+    if not tmdb_results:
+        if not catalog_matches:
+            await message.reply(
+                f"Lo siento, no se encontraron resultados para **{movie_title}**. Intenta con un nombre diferente o más preciso."
+            )
+        return
+        
+    await message.reply("Hemos encontrado algunas opciones. ¿Cuál de estas es la que buscas?")
+    
+    for movie in tmdb_results[:SEARCH_RESULTS_PER_PAGE]:
+        tmdb_id = movie.get("id")
+        tmdb_data = await get_movie_details(tmdb_id)
+        if not tmdb_data:
+            continue
+            
+        text, poster_url, _ = create_movie_message(tmdb_data)
+        
+        movie_in_db = await get_movie_by_tmdb_id(tmdb_id)
+        
+        if movie_in_db and await request_counters.get("movie", tmdb_id) >= REQUEST_LIMIT:
+            keyboard = movie_card_keyboard("watch", tmdb_id, movie_in_db.get("link"))
+            text += "\n\n🚫 Esta película ha superado el límite de solicitudes diarias. Haz clic en 'Ver ahora' para acceder al enlace."
+        else:
+            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+                [types.InlineKeyboardButton(text="✅ Solicitar esta", callback_data=callback_data("request_movie", tmdb_id, message.from_user.id))]
+            ])
+
+        try:
+            if poster_url:
+                await bot.send_photo(
+                    chat_id=message.chat.id,
+                    photo=poster_url,
+                    caption=text,
+                    reply_markup=keyboard,
+                    parse_mode=ParseMode.HTML
+                )
+            else:
+                await bot.send_message(
+                    chat_id=message.chat.id,
+                    text=text,
+                    reply_markup=keyboard,
+                    parse_mode=ParseMode.HTML
+                )
+        except Exception as e:
+            logging.error(f"Error al enviar la opción de película para solicitud: {e}")
+
+    await state.clear()
+    
+@dp.callback_query(CallbackRoute("request_movie_by_id"))
+async def handle_movie_request_by_id(callback_query: types.CallbackQuery, callback_args):
+    await bot.answer_callback_query(callback_query.id)
+    
+    tmdb_id = callback_args.tmdb_id
+    requester_id = callback_query.from_user.id
+    await process_movie_request(callback_query, tmdb_id, requester_id, source="by_id")
+
+
+@dp.callback_query(CallbackRoute("request_movie"))
+async def handle_movie_request_callback(callback_query: types.CallbackQuery, callback_args):
+    await bot.answer_callback_query(callback_query.id)
+    
+    tmdb_id = callback_args.tmdb_id
+    requester_id = callback_args.user_id
+    await process_movie_request(callback_query, tmdb_id, requester_id, source="callback")
+
+
+async def process_movie_request(callback_query: types.CallbackQuery, tmdb_id, requester_id, source):
+    def log_request(outcome, title=None):
+        request_log.log("request", user_id=requester_id, tmdb_id=tmdb_id, title=title, outcome=outcome, source=source)
+
+    if await request_counters.get("user", requester_id) >= USER_REQUEST_LIMIT:
+        log_request("user_limit")
+        await bot.send_message(callback_query.message.chat.id, "🚫 Has alcanzado el límite de solicitudes diarias. Inténtalo de nuevo mañana.")
+        return
+
+    tmdb_data = await get_movie_details(tmdb_id)
+    if not tmdb_data:
+        log_request("tmdb_error")
+        await bot.send_message(callback_query.message.chat.id, "No se pudo obtener la información de la película. Por favor, inténtalo de nuevo.")
+        return
+
+    movie_in_db = await get_movie_by_tmdb_id(tmdb_id)
+        
+    if movie_in_db and await request_counters.get("movie", tmdb_id) >= REQUEST_LIMIT:
+        log_request("movie_limit", tmdb_data.get("title"))
+        await bot.send_message(callback_query.message.chat.id, f"🚫 Esta película ha superado el límite de solicitudes diarias. Aquí tienes el enlace para verla:")
+        keyboard = movie_card_keyboard("watch", tmdb_id, movie_in_db.get("link"))
+        await bot.send_message(callback_query.message.chat.id, f"**{movie_in_db.get('title')}**", reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
+    
+    elif movie_in_db:
+        log_request("republished", tmdb_data.get("title"))
+        await bot.send_message(callback_query.message.chat.id, f"La película **{movie_in_db.get('title')}** ya existe en el catálogo. Publicándola en el canal...")
+        await request_counters.incr("movie", tmdb_id)
+        await request_counters.incr("user", requester_id)
+        
+        await delete_old_post(tmdb_id)
+        
+        text, poster_url, post_keyboard = create_movie_message(tmdb_data, movie_in_db.get("link"))
+        success, message_id = await send_movie_post(TELEGRAM_MAIN_CHANNEL_ID, tmdb_data, movie_in_db.get("link"), post_keyboard)
+        
+        if success:
+            notification_message = (
+                f"Tu película fue publicada en el canal principal. Haz clic aquí para verla"
+            )
+            keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+                [types.InlineKeyboardButton(text="📢 Ver en el canal", url=f"https://t.me/{MAIN_CHANNEL_USERNAME}/{message_id}")]
+            ])
+            await bot.send_message(callback_query.from_user.id, notification_message, reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
+    
+    else:
+        requester_name = callback_query.from_user.full_name
+        try:
+            new_card = await add_pending_request(tmdb_id, tmdb_data, requester_id, requester_name)
+        except Exception as e:
+            # La solicitud queda registrada y la tarjeta se reintenta con la siguiente; no gasta cupo
+            logging.error(f"Error al enviar la tarjeta de solicitud de {tmdb_id} al admin: {e}")
+            log_request("card_failed", tmdb_data.get("title"))
+            await bot.send_message(callback_query.message.chat.id, "❌ No se pudo avisar al administrador ahora mismo. Inténtalo de nuevo en unos minutos.")
+            return
+        await request_counters.incr("user", requester_id)
+        log_request("sent_to_admin" if new_card else "coalesced", tmdb_data.get("title"))
+        await bot.send_message(callback_query.message.chat.id, f"✅ Tu solicitud para **{tmdb_data.get('title')}** ha sido enviada al administrador. ¡Te avisaremos cuando esté lista!")
+
+
+# --- Solicitudes pendientes agrupadas por película ---
+# Un documento por tmdb_id en "pending_requests" con todos los solicitantes. El admin recibe una
+# sola tarjeta por película, que se edita (con debounce) para mostrar el número de solicitudes.
+
+def pending_request_caption(title, tmdb_id, count, last_requester_name):
+    return (
+        f"✨ <b>Nueva solicitud de película</b>\n\n"
+        f"🎬 <b>{html.quote(title or 'Título desconocido')}</b>\n"
+        f"ID de la película: <code>{tmdb_id}</code>\n\n"
+        f"👥 Solicitudes: <b>{count}</b>\n"
+        f"Última de: {html.quote(last_requester_name or 'desconocido')}"
+    )
+
+async def send_pending_request_card(tmdb_id, tmdb_data, count, requester_name):
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="📌 Publicar ahora esta película", callback_data=callback_data("publish_now_from_trakt", tmdb_id))]
+    ])
+    caption = pending_request_caption(tmdb_data.get("title"), tmdb_id, count, requester_name)
+    poster_url = get_movie_poster_url(tmdb_data.get("poster_path"))
+    if poster_url:
+        return await bot.send_photo(ADMIN_ID, photo=poster_url, caption=caption, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+    return await bot.send_message(ADMIN_ID, text=caption, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+
+pending_requests_indexes_ready = False
+
+async def get_pending_requests_collection():
+    global pending_requests_indexes_ready
+    collection = get_mongo_db_collection("pending_requests")
+    if collection is not None and not pending_requests_indexes_ready:
+        # Las solicitudes de películas que nunca se añaden no se quedan para siempre
+        await collection.create_index("updated_at", expireAfterSeconds=int(PENDING_REQUEST_TTL_DAYS * 86400))
+        pending_requests_indexes_ready = True
+    return collection
+
+async def send_first_pending_card(collection, tmdb_id, tmdb_data, count, requester_name):
+    """
+    Envía la tarjeta del admin de una película y guarda su message_id. Si el envío falla, la
+    marca como "failed" para que la siguiente solicitud vuelva a intentarlo, y relanza el error.
+    Si el proceso muere a medias, el reclamo "sending" caduca a los PENDING_CARD_CLAIM_SECONDS.
+    """
+    try:
+        message = await send_pending_request_card(tmdb_id, tmdb_data, count, requester_name)
+    except Exception:
+        await collection.update_one({"_id": tmdb_id}, {"$set": {"card_status": "failed"}})
+        raise
+    await collection.update_one(
+        {"_id": tmdb_id},
+        {"$set": {"admin_message_id": message.message_id, "admin_card_photo": bool(message.photo), "card_status": "sent"}}
+    )
+    # Otras solicitudes pudieron llegar mientras se enviaba la tarjeta
+    pending_request_cards.schedule(tmdb_id)
+
+@profiled("mongo")
+async def add_pending_request(tmdb_id, tmdb_data, requester_id, requester_name):
+    """Registra al solicitante. Devuelve True si se envió una tarjeta nueva al admin."""
+    collection = await get_pending_requests_collection()
+    if collection is None:
+        # Sin base de datos: una tarjeta por solicitud, como antes
+        await send_pending_request_card(tmdb_id, tmdb_data, 1, requester_name)
+        return True
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    try:
+        previous = await collection.find_one_and_update(
+            {"_id": tmdb_id},
+            {
+                "$addToSet": {"requesters": requester_id},
+                "$set": {"last_requester_name": requester_name, "updated_at": now},
+                "$setOnInsert": {"title": tmdb_data.get("title"), "created_at": now, "card_status": "sending", "card_claimed_at": now},
+            },
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        )
+    except DuplicateKeyError:
+        # Dos primeras solicitudes simultáneas: la otra ya creó el documento
+        previous = await collection.find_one_and_update(
+            {"_id": tmdb_id},
+            {"$addToSet": {"requesters": requester_id}, "$set": {"last_requester_name": requester_name, "updated_at": now}}
+        )
+    except Exception as e:
+        logging.error(f"Error al registrar la solicitud pendiente: {e}")
+        await send_pending_request_card(tmdb_id, tmdb_data, 1, requester_name)
+        return True
+
+    if previous is None:
+        await send_first_pending_card(collection, tmdb_id, tmdb_data, 1, requester_name)
+        return True
+
+    if previous.get("card_status") in ("failed", "sending"):
+        # La tarjeta no llegó al admin (falló, o quien la enviaba se cayó): esta solicitud la reintenta (solo una a la vez)
+        cutoff = now - datetime.timedelta(seconds=PENDING_CARD_CLAIM_SECONDS)
+        claimed = await collection.update_one(
+            {
+                "_id": tmdb_id,
+                "$or": [
+                    {"card_status": "failed"},
+                    {"card_status": "sending", "card_claimed_at": {"$lt": cutoff}},
+                    {"card_status": "sending", "card_claimed_at": {"$exists": False}},
+                ],
+            },
+            {"$set": {"card_status": "sending", "card_claimed_at": now}}
+        )
+        if claimed.modified_count:
+            count = len(set(previous.get("requesters", [])) | {requester_id})
+            await send_first_pending_card(collection, tmdb_id, tmdb_data, count, requester_name)
+            return True
+
+    if requester_id not in previous.get("requesters", []):
+        pending_request_cards.schedule(tmdb_id)
+    return False
+
+@profiled("mongo")
+async def pop_pending_requesters(tmdb_id):
+    """Cierra las solicitudes pendientes de una película: borra el registro y la tarjeta del admin."""
+    collection = get_mongo_db_collection("pending_requests")
+    if collection is None:
+        return []
+    try:
+        record = await collection.find_one_and_delete({"_id": tmdb_id})
+    except Exception as e:
+        logging.error(f"Error al cerrar las solicitudes pendientes de {tmdb_id}: {e}")
+        return []
+    if not record:
+        return []
+    if record.get("admin_message_id"):
+        try:
+            await bot.delete_message(chat_id=ADMIN_ID, message_id=record["admin_message_id"])
+        except Exception as e:
+            logging.error(f"No se pudo borrar la tarjeta de solicitud de {tmdb_id}: {e}")
+    return record.get("requesters", [])
+
+async def resolve_pending_requests(tmdb_id, movie_title, message_id=None, link=None, extra_requesters=()):
+    """
+    Llamada en cada camino que añade una película al catálogo: avisa a quienes la pidieron
+    (con la publicación del canal si la hay, o con el enlace directo) y cierra la solicitud.
+    """
+    requesters = await pop_pending_requesters(tmdb_id)
+    for requester_id in extra_requesters:
+        if requester_id and requester_id not in requesters:
+            requesters.append(requester_id)
+    if requesters and (message_id or link):
+        start_requesters_notification(requesters, movie_title, message_id, link)
+
+async def resolve_pending_requests_many(movies):
+    """Versión por lotes para la importación: una sola consulta para saber qué películas tenían solicitudes."""
+    collection = get_mongo_db_collection("pending_requests")
+    if collection is None:
+        return
+    by_id = {movie["id"]: movie for movie in movies}
+    try:
+        pending = await collection.find({"_id": {"$in": list(by_id)}}, {"_id": 1}).to_list(None)
+    except Exception as e:
+        logging.error(f"Error al buscar solicitudes pendientes de la importación: {e}")
+        return
+    for record in pending:
+        movie = by_id[record["_id"]]
+        await resolve_pending_requests(movie["id"], movie.get("title"), link=movie.get("link"))
+
+class PendingRequestCards:
+    """Agrupa las ediciones de la tarjeta del admin: como mucho una cada PENDING_CARD_DEBOUNCE_SECONDS por película."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._scheduled = {}
+
+    def __len__(self):
+        return len(self._scheduled)
+
+    def schedule(self, tmdb_id):
+        if tmdb_id not in self._scheduled:
+            self._scheduled[tmdb_id] = asyncio.create_task(self._refresh_later(tmdb_id))
+
+    async def _refresh_later(self, tmdb_id):
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self._scheduled.pop(tmdb_id, None)
+        try:
+            await self.refresh(tmdb_id)
+        except Exception as e:
+            logging.error(f"Error al actualizar la tarjeta de solicitud {tmdb_id}: {e}")
+
+    async def refresh(self, tmdb_id):
+        collection = get_mongo_db_collection("pending_requests")
+        if collection is None:
+            return
+        record = await collection.find_one({"_id": tmdb_id})
+        if not record or not record.get("admin_message_id"):
+            return
+        caption = pending_request_caption(record.get("title"), tmdb_id, len(record.get("requesters", [])), record.get("last_requester_name"))
+        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text="📌 Publicar ahora esta película", callback_data=callback_data("publish_now_from_trakt", tmdb_id))]
+        ])
+        try:
+            if record.get("admin_card_photo"):
+                await bot.edit_message_caption(chat_id=ADMIN_ID, message_id=record["admin_message_id"], caption=caption, parse_mode=ParseMode.HTML, reply_markup=keyboard)
+            else:
+                await bot.edit_message_text(caption, chat_id=ADMIN_ID, message_id=record["admin_message_id"], parse_mode=ParseMode.HTML, reply_markup=keyboard)
+        except TelegramBadRequest as e:
+            if "not modified" not in str(e):
+                raise
+
+pending_request_cards = PendingRequestCards(PENDING_CARD_DEBOUNCE_SECONDS)
+notification_tasks = set()
+
+async def notify_requesters(user_ids, text, keyboard):
+    """Envía el aviso a cada solicitante respetando NOTIFY_RATE_PER_SECOND y los RetryAfter de Telegram."""
+    interval = 1 / NOTIFY_RATE_PER_SECOND if NOTIFY_RATE_PER_SECOND > 0 else 0
+    delivered = 0
+    for user_id in user_ids:
+        for attempt in range(3):
+            try:
+                await bot.send_message(user_id, text, reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
+                delivered += 1
+                break
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
+            except (TelegramForbiddenError, TelegramBadRequest):
+                # El usuario bloqueó al bot o el chat ya no existe
+                break
+            except Exception as e:
+                logging.error(f"Error al notificar al usuario {user_id}: {e}")
+                break
+        await asyncio.sleep(interval)
+    return delivered
+
+def start_requesters_notification(user_ids, movie_title, message_id, link=None):
+    text = (
+        f"🎉 ¡Tu película solicitada, **{movie_title}**, ya está disponible en el canal!\n\n"
+        f"Haz clic en el botón de abajo para verla."
+    )
+    # Sin publicación en el canal (añadida sin publicar o importada), el botón lleva al enlace directo
+    watch_url = f"https://t.me/{MAIN_CHANNEL_USERNAME}/{message_id}" if message_id else link
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="🎬 Ver ahora", url=watch_url)],
+        [types.InlineKeyboardButton(text="➡️ Ir al Canal", url=MAIN_CHANNEL_INVITE_LINK)],
+        [types.InlineKeyboardButton(text="✨ Pedir otra película", url="https://t.me/sdmin_dy_bot?start=request")]
+    ])
+
+    async def run():
+        delivered = await notify_requesters(user_ids, text, keyboard)
+        logging.info(f"Aviso de '{movie_title}' entregado a {delivered}/{len(user_ids)} solicitantes.")
+        try:
+            await bot.send_message(ADMIN_ID, f"📣 Aviso de «{html.quote(movie_title)}» entregado a {delivered}/{len(user_ids)} solicitantes.", parse_mode=ParseMode.HTML)
+        except Exception as e:
+            logging.error(f"Error al informar al admin del aviso a solicitantes: {e}")
+
+    # El reparto puede durar minutos: no se retiene el webhook
+    task = asyncio.create_task(run())
+    notification_tasks.add(task)
+    task.add_done_callback(notification_tasks.discard)
+
+
+@dp.callback_query(CallbackRoute("publish_now_from_trakt"))
+async def publish_now_from_trakt_callback(callback_query: types.CallbackQuery, state: FSMContext, callback_args):
+    if str(callback_query.from_user.id) != ADMIN_ID:
+        await bot.answer_callback_query(callback_query.id, "No tienes permiso para esta acción.")
+        return
+    await bot.answer_callback_query(callback_query.id, "Preparando para agregar la película...", show_alert=True)
+    tmdb_id = callback_args.tmdb_id
+    requester_id = callback_args.requester_id
+    tmdb_data = await get_movie_details(tmdb_id)
+    if not tmdb_data:
+        await bot.send_message(callback_query.message.chat.id, "No se pudo obtener la información completa de la película desde TMDB. Por favor, reinicie el proceso manualmente.")
+        return
+    await state.update_data(
+        tmdb_id=tmdb_id,
+        movie_title=tmdb_data.get("title"),
+        original_request_id=callback_query.message.message_id,
+        requester_id=requester_id
+    )
+    poster_url = get_movie_poster_url(tmdb_data.get("poster_path"))
+    caption = f"Por favor, ahora envía el enlace de la película '{tmdb_data.get('title')}' para publicarla."
+    
+    if poster_url:
+        await bot.send_photo(
+            chat_id=ADMIN_ID,
+            photo=poster_url,
+            caption=caption,
+        )
+    else:
+        await bot.send_message(
+            chat_id=ADMIN_ID,
+            text=caption,
+        )
+
+    await state.set_state(MovieUploadStates.waiting_for_requested_movie_link)
+
+@dp.message(MovieUploadStates.waiting_for_requested_movie_link)
+async def process_requested_movie_link(message: types.Message, state: FSMContext):
+    if str(message.from_user.id) != ADMIN_ID:
+        await message.reply("No tienes permiso para usar esta función.")
+        await state.clear()
+        return
+    movie_link = message.text.strip()
+    user_data = await state.get_data()
+    tmdb_id = user_data.get("tmdb_id")
+    movie_title = user_data.get("movie_title")
+    original_request_id = user_data.get("original_request_id")
+    requester_id = user_data.get('requester_id')
+    if not tmdb_id or not movie_title:
+        await message.reply("Ocurrió un error. Por favor, reenvía el enlace. Si el problema persiste, inicia el proceso de nuevo.")
+        return
+    tmdb_data = await get_movie_details(tmdb_id)
+    if not tmdb_data:
+        await message.reply("No se pudo obtener la información de la película desde TMDB. Reenvía el enlace o cancela el proceso.")
+        return
+    main_title = tmdb_data.get("title")
+    names = [main_title]
+    if tmdb_data.get("original_title") and tmdb_data.get("original_title") != main_title:
+        names.append(tmdb_data.get("original_title"))
+    
+    new_movie = {
+        "title": main_title,
+        "names": ", ".join(names),
+        "id": tmdb_id,
+        "link": movie_link,
+        "last_message_id": None,
+        "last_message_id_public": None,
+        "last_posted_at": None,
+        "added_at": datetime.datetime.now().isoformat()
+    }
+    new_movie.update(movie_metadata_snapshot(tmdb_data))
+    await save_movie_to_db(new_movie)
+    await delete_old_post(tmdb_id)
+    text, poster_url, post_keyboard = create_movie_message(tmdb_data, movie_link)
+    success, message_id = await send_movie_post(TELEGRAM_MAIN_CHANNEL_ID, tmdb_data, movie_link, post_keyboard)
+    
+    await state.clear()
+    
+    if success:
+        await message.reply("✅ Película agregada a la base de datos y publicada con éxito.")
+        await resolve_pending_requests(tmdb_id, main_title, message_id, extra_requesters=(requester_id,))
+    else:
+        await message.reply("✅ Película agregada a la base de datos, pero ocurrió un error al publicarla en el canal.")
+    
+    if original_request_id:
+        try:
+            await bot.delete_message(chat_id=message.chat.id, message_id=original_request_id)
+        except Exception as e:
+            logging.error(f"No se pudo eliminar el mensaje original de la solicitud: {e}")
+
+@dp.callback_query(CallbackRoute("publish_now_manual"))
+async def publish_now_manual(callback_query: types.CallbackQuery, callback_args):
+    await bot.answer_callback_query(callback_query.id)
+    tmdb_id = callback_args.tmdb_id
+    movie_info = await get_movie_by_tmdb_id(tmdb_id)
+    if not movie_info:
+        await bot.send_message(callback_query.message.chat.id, "Error: película no encontrada en la base de datos.")
+        return
+    
+    tmdb_data = await get_catalog_movie_metadata(movie_info)
+    if not tmdb_data:
+        await bot.send_message(callback_query.message.chat.id, "Error al obtener la información de la película. No se puede publicar.")
+        return
+    
+    await delete_old_post(tmdb_id)
+    text, poster_url, post_keyboard = create_movie_message(tmdb_data, movie_info.get("link"))
+    success, message_id = await send_movie_post(TELEGRAM_MAIN_CHANNEL_ID, tmdb_data, movie_info.get("link"), post_keyboard)
+    
+    if success:
+        notification_message = "✅ Tu película fue publicada en el canal principal. Haz clic aquí para verla."
+        keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+            [types.InlineKeyboardButton(text="📢 Ver en el canal", url=f"https://t.me/{MAIN_CHANNEL_USERNAME}/{message_id}")]
+        ])
+        await bot.send_message(callback_query.from_user.id, notification_message, reply_markup=keyboard, parse_mode=ParseMode.MARKDOWN)
+    else:
+        await bot.send_message(callback_query.message.chat.id, "Ocurrió un error al publicar la película.")
+
+
+@dp.callback_query(CallbackRoute("schedule_movie"))
+async def schedule_callback(callback_query: types.CallbackQuery, state: FSMContext, callback_args):
+    movie_id = callback_args.tmdb_id
+    keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+        [types.InlineKeyboardButton(text="En 30 minutos", callback_data=callback_data("schedule_delay", "30m", movie_id))],
+        [types.InlineKeyboardButton(text="En 1 hora", callback_data=callback_data("schedule_delay", "1h", movie_id))],
+        [types.InlineKeyboardButton(text="En 3 horas", callback_data=callback_data("schedule_delay", "3h", movie_id))],
+        [types.InlineKeyboardButton(text="🕒 Otra fecha u hora", callback_data=callback_data("schedule_custom", movie_id))]
+    ])
+    await bot.answer_callback_query(callback_query.id)
+    await bot.send_message(
+        chat_id=callback_query.message.chat.id,
+        text="Elige cuándo quieres programar la publicación:",
+        reply_markup=keyboard
+    )
+    await bot.delete_message(chat_id=callback_query.message.chat.id, message_id=callback_query.message.message_id)
+
+@dp.callback_query(CallbackRoute("schedule_delay"))
+async def final_schedule_callback(callback_query: types.CallbackQuery, state: FSMContext, callback_args):
+    delay_minutes = SCHEDULE_DELAY_OPTIONS.get(callback_args.delay, 0)
+    movie_id = callback_args.tmdb_id
+    movie_info = await get_movie_by_tmdb_id(movie_id)
+    if not movie_info:
+        await bot.answer_callback_query(callback_query.id, "Error: película no encontrada en la base de datos.", show_alert=True)
+        return
+    due_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=delay_minutes)
+    await scheduled_post_timer.schedule(movie_id, due_at)
+    await bot.answer_callback_query(callback_query.id, f"✅ Publicación programada para dentro de {delay_minutes} minutos.", show_alert=True)
+    await bot.edit_message_text(
+        chat_id=callback_query.message.chat.id,
+        message_id=callback_query.message.message_id,
+        text=f"✅ Película programada para publicación ({format_schedule_time(due_at)})."
+    )
+
+@dp.callback_query(CallbackRoute("schedule_custom"))
+async def custom_schedule_callback(callback_query: types.CallbackQuery, state: FSMContext, callback_args):
+    movie_id = callback_args.tmdb_id
+    await bot.answer_callback_query(callback_query.id)
+    await state.set_state(AdminStates.waiting_for_schedule_time)
+    await state.update_data(schedule_movie_id=movie_id)
+    await bot.send_message(
+        callback_query.message.chat.id,
+        "Escribe cuándo publicar la película. Ejemplos:\n"
+        "• <code>45m</code>, <code>2h</code>, <code>1d</code> o <code>1h30m</code> (dentro de...)\n"
+        "• <code>21:30</code> (hoy o mañana a esa hora)\n"
+        "• <code>2025-12-24 20:00</code> o <code>24/12/2025 20:00</code>\n\n"
+        f"Zona horaria: {BOT_TIMEZONE.key}",
+        parse_mode=ParseMode.HTML
+    )
+
+@dp.message(AdminStates.waiting_for_schedule_time)
+async def process_custom_schedule_time(message: types.Message, state: FSMContext):
+    if str(message.from_user.id) != ADMIN_ID:
+        await state.clear()
+        return
+    due_at = parse_schedule_time(message.text or "")
+    if due_at is None:
+        await message.reply("❌ No entendí la fecha u hora, o ya pasó. Inténtalo de nuevo (por ejemplo <code>2h</code> o <code>21:30</code>).", parse_mode=ParseMode.HTML)
+        return
+    user_data = await state.get_data()
+    movie_id = user_data.get("schedule_movie_id")
+    movie_info = await get_movie_by_tmdb_id(movie_id) if movie_id else None
+    await state.clear()
+    if not movie_info:
+        await message.reply("Error: película no encontrada en la base de datos.")
+        return
+    await scheduled_post_timer.schedule(movie_id, due_at)
+    await message.reply(f"✅ <b>{html.quote(movie_info.get('title') or str(movie_id))}</b> se publicará el {format_schedule_time(due_at)}.", parse_mode=ParseMode.HTML)
+
+
+def parse_schedule_time(text):
+    """Convierte '45m', '1h30m', '21:30' o '2025-12-24 20:00' en un datetime UTC futuro."""
+    text = text.strip().lower()
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    relative = re.fullmatch(r"(?:\s*\d+\s*[dhm])+", text)
+    if relative:
+        units = {"d": 1440, "h": 60, "m": 1}
+        minutes = sum(int(amount) * units[unit] for amount, unit in re.findall(r"(\d+)\s*([dhm])", text))
+        return now + datetime.timedelta(minutes=minutes) if minutes > 0 else None
+
+    local_now = now.astimezone(BOT_TIMEZONE)
+    time_only = re.fullmatch(r"(\d{1,2}):(\d{2})", text)
+    if time_only:
+        hour, minute = int(time_only.group(1)), int(time_only.group(2))
+        if hour > 23 or minute > 59:
+            return None
+        due_local = local_now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        if due_local <= local_now:
+            due_local += datetime.timedelta(days=1)
+        return due_local.astimezone(datetime.timezone.utc)
+
+    for date_format in ("%Y-%m-%d %H:%M", "%d/%m/%Y %H:%M"):
+        try:
+            due_local = datetime.datetime.strptime(text, date_format).replace(tzinfo=BOT_TIMEZONE)
+        except ValueError:
+            continue
+        due_at = due_local.astimezone(datetime.timezone.utc)
+        return due_at if due_at > now else None
+    return None
+
+def format_schedule_time(due_at):
+    return due_at.astimezone(BOT_TIMEZONE).strftime("%d/%m/%Y %H:%M")
+
+
+# --- Tarea de auto-publicación (configurable + re-publicación) ---
+async def auto_post_scheduler():
+    while True:
+        try:
+            # 1. Vuelve a usar la variable global que configuras con los botones
+            total_posts_per_day = AUTO_POST_COUNT 
+            
+            if total_posts_per_day <= 0:
+                logging.warning("AUTO_POST_COUNT es 0 o menos, el auto-posting está desactivado. Revisando en 1 hora.")
+                await asyncio.sleep(3600)
+                continue
+
+            # 2. Calcula el intervalo basado en tu configuración
+            interval_seconds = (24 * 60 * 60) / total_posts_per_day
+            logging.info(f"Auto-post: {total_posts_per_day} películas/día. Próxima publicación en {interval_seconds/3600:.2f} horas.")
+
+            # 3. Lógica para seleccionar película (prioriza nuevas, luego re-publica).
+            # Las películas con el enlace caído se saltan hasta que se repare el enlace.
+            all_movies = [v for v in await get_all_movies() if v.get("link_status") != "dead"]
+            unposted_movies = [
+                v for v in all_movies
+                if str(v.get("last_message_id")) == 'None' or v.get("last_message_id") == ''
+            ]
+            
+            movie_info = None
+            if unposted_movies:
+                # Si hay películas "vírgenes", elige una al azar
+                movie_info = random.choice(unposted_movies)
+                logging.info(f"Auto-publicación: Seleccionando película NUEVA: {movie_info.get('title')}")
+            else:
+                # Si NO hay películas vírgenes, usa el catálogo COMPLETO
+                if all_movies:
+                    movie_info = random.choice(all_movies)
+                    logging.info(f"Auto-publicación: RE-PUBLICANDO película existente: {movie_info.get('title')}")
+                else:
+                    logging.warning("Auto-publicación: No hay películas en la base de datos para publicar.")
+            
+            # 4. Lógica de publicación (si se encontró una película)
+            if movie_info:
+                movie_id = movie_info.get("id")
+                tmdb_data = await get_catalog_movie_metadata(movie_info)
+                
+                if tmdb_data:
+                    # 5. Borra el post anterior (si existe) ANTES de publicar el nuevo
+                    await delete_old_post(movie_id)
+
+                    # Crear el teclado para el post
+                    post_keyboard = types.InlineKeyboardMarkup(inline_keyboard=[
+                        [types.InlineKeyboardButton(text="🎬 Ver ahora", url=movie_info.get("link"))],
+                        [types.InlineKeyboardButton(text="✨ Pedir otra película", url="https://t.me/sdmin_dy_bot?start=request")]
+                    ])
+                    
+                    # Enviar el post (la función send_movie_post ya actualiza el last_message_id y last_posted_at)
+                    success, _ = await send_movie_post(
+                        TELEGRAM_MAIN_CHANNEL_ID, 
+                        tmdb_data, 
+                        movie_info.get("link"), 
+                        post_keyboard
+                    )
+                    
+                    if success:
+                        logging.info(f"Publicación automática de '{tmdb_data.get('title')}' enviada con éxito.")
+                    else:
+                        logging.error("Error al enviar la publicación automática.")
+                else:
+                    logging.error(f"Error: No se pudo obtener TMDB data para {movie_id} en auto-publicación.")
+            
+            # 6. Espera el intervalo calculado
+            expected_wakeup = time.monotonic() + interval_seconds
+            await asyncio.sleep(interval_seconds)
+            SCHEDULER_LAG.labels("auto_post").set(time.monotonic() - expected_wakeup)
+
+        except Exception as e:
+            logging.error(f"Error grave en el programador de publicaciones automáticas: {e}")
+            await asyncio.sleep(60) # Espera 60 segundos si ocurre un error grave
+
+# --- Publicaciones programadas persistentes (min-heap + MongoDB) ---
+class ScheduledPostTimer:
+    """
+    Publicaciones programadas guardadas en la colección `scheduled_posts` (una por película).
+
+    Cada instancia mantiene un min-heap con las fechas pendientes y duerme exactamente hasta la
+    más próxima, sin sondeos. Al vencer, la publicación se reclama marcándola con `claimed_by` y
+    `claimed_at` (filtrando por token), así que solo una instancia publica aunque todas la tengan
+    cargada. El documento se borra solo tras publicar; si la instancia se cae antes, el reclamo
+    caduca a los SCHEDULE_CLAIM_TTL_SECONDS y otra la recoge. Si la publicación falla se reintenta
+    (hasta SCHEDULE_MAX_ATTEMPTS) y se avisa al admin.
+    La colección se vuelve a leer al arrancar y cada SCHEDULE_RECONCILE_SECONDS para recoger las
+    programaciones hechas en otras instancias.
+    """
+
+    def __init__(self, collection_name="scheduled_posts"):
+        self._collection_name = collection_name
+        self._heap = []  # (timestamp, token, movie_id)
+        self._tokens = {}  # movie_id -> token vigente conocido por esta instancia
+        self._wakeup = asyncio.Event()
+
+    def _push(self, movie_id, due_ts, token):
+        if self._tokens.get(movie_id) == token:
+            return
+        self._tokens[movie_id] = token
+        heapq.heappush(self._heap, (due_ts, token, movie_id))
+        self._wakeup.set()
+
+    def __len__(self):
+        return len(self._tokens)
+
+    async def schedule(self, movie_id, due_at):
+        token = uuid.uuid4().hex
+        collection = get_mongo_db_collection(self._collection_name)
+        if collection is not None:
+            try:
+                await collection.update_one(
+                    {"_id": movie_id},
+                    {
+                        "$set": {"due_at": due_at, "token": token, "attempts": 0, "created_at": datetime.datetime.now(datetime.timezone.utc)},
+                        "$unset": {"claimed_by": "", "claimed_at": ""},
+                    },
+                    upsert=True
+                )
+            except Exception as e:
+                logging.error(f"Error al guardar la publicación programada de {movie_id}: {e}")
+        self._push(movie_id, due_at.timestamp(), token)
+        logging.info(f"Publicación de la película {movie_id} programada para {due_at.isoformat()}.")
+
+    async def load(self):
+        collection = get_mongo_db_collection(self._collection_name)
+        if collection is None:
+            return
+        try:
+            async for document in collection.find({}):
+                due_at = document["due_at"]
+                if due_at.tzinfo is None:
+                    due_at = due_at.replace(tzinfo=datetime.timezone.utc)
+                self._push(document["_id"], due_at.timestamp(), document["token"])
+        except Exception as e:
+            logging.error(f"Error al cargar las publicaciones programadas: {e}")
+
+    async def _claim(self, movie_id, token):
+        """El documento reclamado, o None si se reprogramó o lo tiene otra instancia."""
+        if self._tokens.get(movie_id) == token:
+            del self._tokens[movie_id]
+        collection = get_mongo_db_collection(self._collection_name)
+        if collection is None:
+            return {"_id": movie_id, "token": token, "attempts": SCHEDULE_MAX_ATTEMPTS - 1}  # Sin DB no hay reintentos
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return await collection.find_one_and_update(
+            {
+                "_id": movie_id,
+                "token": token,
+                "$or": [
+                    {"claimed_at": {"$exists": False}},
+                    {"claimed_at": {"$lt": now - datetime.timedelta(seconds=SCHEDULE_CLAIM_TTL_SECONDS)}},
+                ],
+            },
+            {"$set": {"claimed_by": INSTANCE_ID, "claimed_at": now}},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _complete(self, movie_id, token):
+        collection = get_mongo_db_collection(self._collection_name)
+        if collection is not None:
+            await collection.delete_one({"_id": movie_id, "token": token})
+
+    async def _retry_or_drop(self, document, reason, retryable):
+        """Tras un fallo: la devuelve a la cola con un nuevo intento o la descarta, y avisa al admin."""
+        movie_id, token = document["_id"], document["token"]
+        attempts = document.get("attempts", 0) + 1
+        collection = get_mongo_db_collection(self._collection_name)
+        if retryable and collection is not None and attempts < SCHEDULE_MAX_ATTEMPTS:
+            retry_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=SCHEDULE_RETRY_SECONDS)
+            result = await collection.update_one(
+                {"_id": movie_id, "token": token},
+                {"$set": {"due_at": retry_at, "attempts": attempts}, "$unset": {"claimed_by": "", "claimed_at": ""}}
+            )
+            if result.modified_count:
+                self._push(movie_id, retry_at.timestamp(), token)
+            outcome = f"Se reintentará a las {retry_at.astimezone(BOT_TIMEZONE).strftime('%H:%M')} (intento {attempts + 1} de {SCHEDULE_MAX_ATTEMPTS})."
+        else:
+            await self._complete(movie_id, token)
+            outcome = "La programación se ha descartado; publícala de nuevo a mano."
+        logging.error(f"Publicación programada de {movie_id} fallida: {reason}. {outcome}")
+        try:
+            await bot.send_message(ADMIN_ID, f"⚠️ No se pudo hacer la publicación programada de la película <code>{movie_id}</code>: {html.quote(reason)}.\n{outcome}", parse_mode=ParseMode.HTML)
+        except Exception as e:
+            logging.error(f"Error al avisar al admin del fallo de la publicación programada: {e}")
+
+    async def _fire(self, movie_id, due_ts, token):
+        try:
+            document = await self._claim(movie_id, token)
+            if document is None:
+                return  # Reprogramada, o reclamada por otra instancia
+            lag = time.time() - due_ts
+            SCHEDULER_LAG.labels("scheduled_posts").set(lag)
+            logging.info(f"Publicación programada de {movie_id} iniciada con {lag:.2f}s de retraso.")
+            try:
+                success, reason, retryable = await publish_scheduled_movie(movie_id)
+            except Exception as e:
+                success, reason, retryable = False, str(e), True
+            if success:
+                await self._complete(movie_id, token)
+            else:
+                await self._retry_or_drop(document, reason, retryable)
+        except Exception as e:
+            logging.error(f"Error en la tarea de publicación programada: {e}")
+
+    async def run(self):
+        await self.load()
+        last_reconcile = time.monotonic()
+        while True:
+            try:
+                timeout = SCHEDULE_RECONCILE_SECONDS - (time.monotonic() - last_reconcile)
+                if self._heap:
+                    timeout = min(timeout, self._heap[0][0] - time.time())
+                self._wakeup.clear()
+                if timeout > 0:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+
+                if time.monotonic() - last_reconcile >= SCHEDULE_RECONCILE_SECONDS:
+                    await self.load()
+                    last_reconcile = time.monotonic()
+
+                now = time.time()
+                while self._heap and self._heap[0][0] <= now:
+                    due_ts, token, movie_id = heapq.heappop(self._heap)
+                    if self._tokens.get(movie_id, token) != token:
+                        continue  # Entrada reemplazada por una reprogramación local
+                    asyncio.create_task(self._fire(movie_id, due_ts, token))
+            except Exception as e:
+                logging.error(f"Error en el temporizador de publicaciones programadas: {e}")
+                await asyncio.sleep(5)
+
+scheduled_post_timer = ScheduledPostTimer()
+
+async def publish_scheduled_movie(movie_id):
+    """Publica la película. Devuelve (publicada, motivo del fallo, si tiene sentido reintentar)."""
+    movie_info = await get_movie_by_tmdb_id(movie_id)
+    if not movie_info:
+        return False, "la película ya no está en la base de datos", False
+    tmdb_data = await get_catalog_movie_metadata(movie_info)
+    if not tmdb_data:
+        return False, "no se pudo obtener la información de TMDB", True
+    await delete_old_post(movie_id)
+    text, poster_url, post_keyboard = create_movie_message(tmdb_data, movie_info.get("link"))
+    success, _ = await send_movie_post(TELEGRAM_MAIN_CHANNEL_ID, tmdb_data, movie_info.get("link"), post_keyboard)
+    if not success:
+        return False, "error al enviar la publicación al canal", True
+    logging.info(f"Publicación programada de '{tmdb_data.get('title')}' enviada con éxito.")
+    return True, None, False
+
+# --- TAREA: Limpieza automática de películas antiguas (después de 2 días) ---
+async def cleanup_old_movie_posts(collection, delete_after_days):
+    """Una pasada de limpieza: borra los posts con más de `delete_after_days` días y resetea la DB."""
+    all_movies = await get_all_movies()
+    now = datetime.datetime.now(datetime.timezone.utc)
+    
+    movies_to_reset = []
+
+    for movie in all_movies:
+        posted_at_str = movie.get("last_posted_at")
+        
+        # Si tiene un ID de mensaje pero no un timestamp, es de una versión antigua del bot.
+        # Lo marcaremos para borrado si tiene ID de mensaje.
+        if not posted_at_str and movie.get("last_message_id"):
+            logging.warning(f"Película '{movie.get('title')}' tiene post antiguo sin timestamp. Marcando para borrado.")
+            movies_to_reset.append(movie)
+            continue
+
+        if not posted_at_str:
+            continue # Nunca ha sido posteada, ignorar
+
+        try:
+            # Convertir a datetime con timezone-aware (ISO format guarda info de timezone)
+            posted_at_dt = datetime.datetime.fromisoformat(posted_at_str)
+            
+            # Asegurarse que ambos son aware o naive. ISO 8601 de python es "aware".
+            # Si 'now' no lo es, ajústalo. (Asegurémonos que 'now' sea aware)
+            if posted_at_dt.tzinfo is None:
+               posted_at_dt = posted_at_dt.replace(tzinfo=datetime.timezone.utc)
+            
+            time_diff = now - posted_at_dt
+            
+            if time_diff.days >= delete_after_days:
+                logging.info(f"Película '{movie.get('title')}' tiene {time_diff.days} días. Eliminando post...")
+                movies_to_reset.append(movie)
+
+        except Exception as e:
+            logging.error(f"Error procesando fecha de película {movie.get('id')} para limpieza: {e}")
+    
+    # Procesar todos los borrados
+    for movie in movies_to_reset:
+        movie_id = movie.get("id")
+        
+        # 1. Borrar los posts de los canales
+        await delete_old_post(movie_id) 
+        
+        # 2. Resetear los campos en la DB para que pueda ser re-publicada
+        await collection.update_one(
+            {"id": movie_id},
+            {"$set": {
+                "last_message_id": None,
+                "last_message_id_public": None,
+                "last_posted_at": None
+            }}
+        )
+        logging.info(f"Post de '{movie.get('title')}' eliminado y DB reseteada para futura re-publicación.")
+
+    return len(movies_to_reset)
+
+async def movie_cleanup_scheduler():
+    DELETE_AFTER_DAYS = 2
+    CHECK_INTERVAL_HOURS = 6 # Revisará cada 6 horas
+    collection = get_mongo_db_collection()
+    
+    if collection is None:
+        logging.error("Limpieza de películas: No se pudo conectar a la DB. La tarea no se iniciará.")
+        return
+
+    while True:
+        try:
+            logging.info(f"Ejecutando tarea de limpieza. Borrando películas con más de {DELETE_AFTER_DAYS} días.")
+            reset_count = await cleanup_old_movie_posts(collection, DELETE_AFTER_DAYS)
+            logging.info(f"Limpieza de películas completada. {reset_count} posts eliminados. Durmiendo por {CHECK_INTERVAL_HOURS} horas.")
+            await asyncio.sleep(CHECK_INTERVAL_HOURS * 3600)
+        
+        except Exception as e:
+            logging.error(f"Error grave en movie_cleanup_scheduler: {e}")
+            await asyncio.sleep(3600) # Esperar 1 hora si hay un error grave
+
+# --- TAREA de contenido (con auto-eliminación de 5 horas) ---
+async def channel_content_scheduler():
+    global NEWS_POST_COUNT
+    DELETE_NEWS_AFTER_HOURS = 5
+
+    while True:
+        try:
+            # Calcula los intervalos de publicación de noticias/memes en base al NEWS_POST_COUNT
+            interval_seconds = (24 * 3600) / NEWS_POST_COUNT if NEWS_POST_COUNT > 0 else 4 * 3600
+            
+            content_type = random.choice(["meme", "news"])
+            message_to_delete = None # Para guardar el mensaje que se publicará
+            
+            if content_type == "meme":
+                meme_url, meme_caption, meme_digest = await get_random_meme()
+                if meme_url:
+                    try:
+                        message_to_delete = await bot.send_photo(TELEGRAM_PUBLIC_CHANNEL_ID, photo=meme_url, caption=meme_caption)
+                        logging.info("Meme publicado con éxito en el canal público.")
+                        await meme_pool.mark_posted(meme_url, meme_digest)
+                    except Exception as e:
+                        logging.error(f"Error al publicar un meme en el canal público: {e}")
+                else:
+                    logging.warning("No se encontraron memes. Intentando publicar una noticia en su lugar.")
+                    content_type = "news" # Forzar que sea noticia si el meme falla
+
+            if content_type == "news":
+                article = await news_pool.next_unposted()
+                if article:
+                    text = (
+                        f"<b>{html.quote(article.get('title') or 'Sin título')}</b>\n\n"
+                        f"<i>{html.quote(article.get('description') or 'Sinopsis no disponible')}</i>\n\n"
+                        f"<a href='{html.quote(article.get('url'))}'>Leer más</a>"
+                    )
+                    poster_url = article.get("urlToImage") if article.get("image_ok") else None
+                    try:
+                        if poster_url:
+                            try:
+                                message_to_delete = await bot.send_photo(TELEGRAM_PUBLIC_CHANNEL_ID, photo=poster_url, caption=text, parse_mode=ParseMode.HTML)
+                            except TelegramBadRequest as e:
+                                logging.warning(f"Telegram rechazó la imagen de la noticia, se publica sin imagen: {e}")
+                                message_to_delete = await bot.send_message(TELEGRAM_PUBLIC_CHANNEL_ID, text, parse_mode=ParseMode.HTML)
+                        else:
+                            message_to_delete = await bot.send_message(TELEGRAM_PUBLIC_CHANNEL_ID, text, parse_mode=ParseMode.HTML)
+                        logging.info("Noticia de cine publicada con éxito en el canal público.")
+                        await news_pool.mark_posted(article["url"])
+                    except Exception as e:
+                        logging.error(f"Error al publicar una noticia en el canal público: {e}")
+                else:
+                    logging.warning("No hay noticias nuevas sin publicar.")
+
+            # Si se publicó un meme o noticia, programar su borrado
+            if message_to_delete:
+                await register_expiring_message(
+                    chat_id=TELEGRAM_PUBLIC_CHANNEL_ID,
+                    message_id=message_to_delete.message_id,
+                    delay_seconds=DELETE_NEWS_AFTER_HOURS * 3600
+                )
+
+            expected_wakeup = time.monotonic() + interval_seconds
+            await asyncio.sleep(interval_seconds)
+            SCHEDULER_LAG.labels("channel_content").set(time.monotonic() - expected_wakeup)
+        except Exception as e:
+            logging.error(f"Error en el programador de contenido del canal: {e}")
+            await asyncio.sleep(60)
+
+# --- Borrado diferido persistente de noticias y memes ---
+async def delete_message_later(chat_id, message_id, delay_seconds):
+    """Respaldo en memoria cuando no hay base de datos: se pierde si el proceso se reinicia."""
+    await asyncio.sleep(delay_seconds)
+    try:
+        await bot.delete_message(chat_id=chat_id, message_id=message_id)
+        logging.info(f"Contenido (noticia/meme) {message_id} eliminado de {chat_id}.")
+    except Exception as e:
+        logging.warning(f"No se pudo eliminar el mensaje {message_id} de {chat_id}: {e}")
+
+async def register_expiring_message(chat_id, message_id, delay_seconds):
+    collection = get_mongo_db_collection("expiring_posts")
+    if collection is None:
+        asyncio.create_task(delete_message_later(chat_id, message_id, delay_seconds))
+        return
+    try:
+        await collection.insert_one({
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "expires_at": datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=delay_seconds),
+            "attempts": 0
+        })
+    except Exception as e:
+        logging.error(f"Error al registrar el borrado del mensaje {message_id}, se usará una tarea en memoria: {e}")
+        asyncio.create_task(delete_message_later(chat_id, message_id, delay_seconds))
+
+async def sweep_expired_messages(collection):
+    """Borra un lote de mensajes vencidos. Devuelve cuántos documentos procesó."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    due = await collection.find({"expires_at": {"$lte": now}}).sort("expires_at", 1).to_list(EXPIRY_BATCH_SIZE)
+    if due:
+        oldest = due[0]["expires_at"]
+        if oldest.tzinfo is None:
+            oldest = oldest.replace(tzinfo=datetime.timezone.utc)
+        SCHEDULER_LAG.labels("content_expiry").set((now - oldest).total_seconds())
+    done_ids = []
+    retries = []
+    for document in due:
+        try:
+            await bot.delete_message(chat_id=document["chat_id"], message_id=document["message_id"])
+            logging.info(f"Contenido (noticia/meme) {document['message_id']} eliminado de {document['chat_id']}.")
+            done_ids.append(document["_id"])
+        except TelegramBadRequest as e:
+            # El mensaje ya no existe o ya no se puede borrar: no tiene sentido reintentar
+            logging.warning(f"No se pudo eliminar el mensaje {document['message_id']} de {document['chat_id']}: {e}")
+            done_ids.append(document["_id"])
+        except TelegramRetryAfter as e:
+            # Límite de Telegram: esperar lo que pide y aplazar este mensaje sin gastar un intento
+            logging.warning(f"Telegram pide esperar {e.retry_after}s antes de seguir borrando mensajes.")
+            await asyncio.sleep(e.retry_after)
+            retry_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=e.retry_after)
+            retries.append(UpdateOne({"_id": document["_id"]}, {"$set": {"expires_at": retry_at}}))
+        except Exception as e:
+            logging.warning(f"Error temporal al eliminar el mensaje {document['message_id']}: {e}")
+            attempts = document.get("attempts", 0) + 1
+            if attempts >= EXPIRY_MAX_ATTEMPTS:
+                done_ids.append(document["_id"])
+            else:
+                # Backoff exponencial: el documento no vuelve a vencer hasta pasada la espera
+                retry_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=EXPIRY_RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+                retries.append(UpdateOne({"_id": document["_id"]}, {"$set": {"expires_at": retry_at, "attempts": attempts}}))
+
+    if done_ids:
+        await collection.delete_many({"_id": {"$in": done_ids}})
+    if retries:
+        await collection.bulk_write(retries, ordered=False)
+    return len(due)
+
+async def expired_content_sweeper():
+    collection = get_mongo_db_collection("expiring_posts")
+    if collection is None:
+        logging.warning("Borrado de contenido: sin base de datos, se usan tareas en memoria.")
+        return
+    await collection.create_index("expires_at")
+
+    while True:
+        try:
+            processed = await sweep_expired_messages(collection)
+            # Si el lote vino lleno quedan más vencidos: seguir sin esperar
+            if processed < EXPIRY_BATCH_SIZE:
+                await asyncio.sleep(EXPIRY_SWEEP_SECONDS)
+        except Exception as e:
+            logging.error(f"Error en el barrido de contenido vencido: {e}")
+            await asyncio.sleep(EXPIRY_SWEEP_SECONDS)
+
+
+# --- Elección de líder para las tareas programadas ---
+async def try_acquire_lease(name):
+    """
+    Toma o renueva el lease `name`. Devuelve True si esta instancia es la líder,
+    False si otra instancia lo tiene y None si no se pudo consultar MongoDB.
+    """
+    collection = get_mongo_db_collection("scheduler_leases")
+    if collection is None:
+        return True  # Sin base de datos solo hay una instancia posible
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    try:
+        await collection.update_one(
+            {"_id": name, "$or": [{"owner": INSTANCE_ID}, {"expires_at": {"$lt": now}}]},
+            {"$set": {
+                "owner": INSTANCE_ID,
+                "expires_at": now + datetime.timedelta(seconds=LEASE_TTL_SECONDS),
+                "renewed_at": now
+            }},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+    except Exception as e:
+        logging.error(f"Error al renovar el lease '{name}': {e}")
+        return None
+
+async def release_lease(name):
+    collection = get_mongo_db_collection("scheduler_leases")
+    if collection is None:
+        return
+    try:
+        await collection.delete_one({"_id": name, "owner": INSTANCE_ID})
+    except Exception as e:
+        logging.error(f"Error al liberar el lease '{name}': {e}")
+
+async def run_with_leader_lease(name, scheduler_factory):
+    """Ejecuta la tarea programada solo mientras esta instancia tenga el lease `name`."""
+    renew_interval = LEASE_TTL_SECONDS / 3
+    while True:
+        if not await try_acquire_lease(name):
+            await asyncio.sleep(renew_interval)
+            continue
+
+        logging.info(f"Instancia {INSTANCE_ID} es líder de '{name}'. Iniciando la tarea.")
+        task = asyncio.create_task(scheduler_factory())
+        last_renewal = time.monotonic()
+        try:
+            while not task.done():
+                await asyncio.wait({task}, timeout=renew_interval)
+                if task.done():
+                    break
+                acquired = await try_acquire_lease(name)
+                if acquired:
+                    last_renewal = time.monotonic()
+                elif acquired is False or time.monotonic() - last_renewal >= LEASE_TTL_SECONDS - renew_interval:
+                    # Otra instancia tiene el lease, o el nuestro está por expirar sin poder renovarlo
+                    logging.warning(f"Instancia {INSTANCE_ID} perdió el liderazgo de '{name}'. Deteniendo la tarea.")
+                    task.cancel()
+                    break
+        except asyncio.CancelledError:
+            task.cancel()
+            await release_lease(name)
+            raise
+
+        try:
+            await task
+        except asyncio.CancelledError:
+            continue
+        except Exception as e:
+            logging.error(f"La tarea '{name}' terminó con un error: {e}")
+            await release_lease(name)
+            await asyncio.sleep(renew_interval)
+            continue
+
+        # La tarea terminó por sí sola (p. ej. sin base de datos): no hay nada que relanzar
+        await release_lease(name)
+        return
+
+
+# WEBHOOK SETUP
+async def handle_home(request):
+    return web.Response(text="Tu bot está activo y funcionando. ¡El webhook está configurado!")
+
+async def on_startup(app):
+    # Usar variable de entorno si está configurada, sino, asumir el entorno local/dev
+    RENDER_EXTERNAL_URL = os.environ.get('RENDER_EXTERNAL_URL') 
+    if WORKER_INDEX != 0:
+        return  # Con varios workers solo el 0 registra el webhook
+    if RENDER_EXTERNAL_URL:
+        WEBHOOK_URL = RENDER_EXTERNAL_URL + '/webhook'
+        await bot.set_webhook(WEBHOOK_URL)
+        logging.info(f"Webhook establecido con éxito: {WEBHOOK_URL}")
+    else:
+        logging.warning("RENDER_EXTERNAL_URL no está configurada. El bot podría estar corriendo en modo polling o debe configurarse manualmente.")
+
+# --- Grabación anonimizada de updates (para reproducir tráfico real en pruebas de carga) ---
+RECORD_DROPPED_FIELDS = {"last_name", "username", "phone_number", "bio", "contact", "location", "venue", "language_code"}
+# Mismo buffer y volcado en un hilo que el registro de solicitudes, para no escribir en disco desde el
+# webhook. Todos los workers añaden lotes completos al mismo fichero, que no se rota.
+update_recorder = RequestLog(UPDATE_RECORD_PATH, float("inf"), 0)
+
+def anonymize_id(value):
+    digest = hashlib.sha256(f"{UPDATE_RECORD_SALT}:{abs(value)}".encode()).hexdigest()
+    anonymized = int(digest[:12], 16) % 10**10 + 1
+    return -anonymized if value < 0 else anonymized
+
+def collect_update_ids(node, ids):
+    # Usuarios y chats: cualquier objeto con "id" y "first_name" o "type"
+    if isinstance(node, dict):
+        if isinstance(node.get("id"), int) and ("first_name" in node or "type" in node):
+            ids[node["id"]] = anonymize_id(node["id"])
+        for value in node.values():
+            collect_update_ids(value, ids)
+    elif isinstance(node, list):
+        for value in node:
+            collect_update_ids(value, ids)
+
+def anonymize_node(node, ids, key=None):
+    if isinstance(node, dict):
+        result = {k: anonymize_node(v, ids, k) for k, v in node.items() if k not in RECORD_DROPPED_FIELDS}
+        if "first_name" in result:
+            result["first_name"] = "Usuario"
+        if "title" in result and "type" in result and result["type"] != "private":
+            result["title"] = "Chat"
+        return result
+    if isinstance(node, list):
+        return [anonymize_node(v, ids, key) for v in node]
+    if isinstance(node, int) and not isinstance(node, bool) and key in ("id", "chat_id", "user_id") and node in ids:
+        return ids[node]
+    if isinstance(node, str) and key in ("text", "data", "caption", "query"):
+        # Los callback_data como request_movie:<tmdb_id>:<user_id> llevan IDs de usuario
+        for raw_id, anonymized in ids.items():
+            node = node.replace(str(raw_id), str(anonymized))
+        return node
+    return node
+
+def record_update(data):
+    """Añade el update anonimizado al buffer de UPDATE_RECORD_PATH. Los IDs se sustituyen de forma estable."""
+    try:
+        ids = {}
+        collect_update_ids(data, ids)
+        admin_ids = [anonymized for raw_id, anonymized in ids.items() if str(raw_id) == ADMIN_ID]
+        record = {
+            "t": round(time.time(), 3),
+            "admin_id": admin_ids[0] if admin_ids else None,
+            "update": anonymize_node(data, ids),
+        }
+        update_recorder.append(record)
+    except Exception as e:
+        logging.error(f"Error al grabar el update: {e}")
+
+async def handle_telegram_webhook(request):
+    try:
+        data = await request.json()
+        if UPDATE_RECORD_PATH:
+            record_update(data)
+        update = Update.model_validate(data)
+        await dp.feed_update(bot, update)
+    except Exception as e:
+        logging.error(f"Error al procesar el webhook de Telegram: {e}")
+    finally:
+        return web.Response(text="OK")
+
+async def handle_metrics(request):
+    if METRICS_TOKEN and request.query.get("token") != METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        return web.Response(status=401, text="Unauthorized")
+    return web.Response(body=render_metrics().encode(), headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+async def handle_ready(request):
+    status = 200 if warmup_done.is_set() else 503
+    return web.json_response(
+        {"ready": warmup_done.is_set(), "instance": INSTANCE_ID, "startup_timings": startup_timings},
+        status=status
+    )
+
+async def start_webhook_server():
+    app = web.Application()
+    app.router.add_post('/webhook', handle_telegram_webhook)
+    app.router.add_get('/', handle_home)
+    app.router.add_get('/ready', handle_ready)
+    app.router.add_get('/metrics', handle_metrics)
+    
+    # Obtener puerto de las variables de entorno, por defecto 8080.
+    port = int(os.environ.get('PORT', 8080))
+    
+    runner = web.AppRunner(app)
+    await runner.setup()
+    # Con varios workers todos abren el mismo puerto y el kernel reparte las conexiones
+    site = web.TCPSite(runner, '0.0.0.0', port, reuse_port=WEB_WORKERS > 1 or None, shutdown_timeout=WORKER_SHUTDOWN_TIMEOUT_SECONDS)
+    await site.start()
+    # El webhook se registra después de abrir el puerto, para que Telegram no encuentre el servidor caído
+    await on_startup(app)
+    return runner
+
+# --- Arranque: webhook primero, precalentamiento después ---
+startup_timings = {}
+warmup_done = asyncio.Event()
+
+async def timed_startup_step(name, coroutine):
+    started = time.perf_counter()
+    try:
+        await coroutine
+    except Exception as e:
+        logging.error(f"Error en el paso de arranque '{name}': {e}")
+    startup_timings[name] = round(time.perf_counter() - started, 3)
+
+async def warm_mongo_pool():
+    db = get_mongo_database()
+    if db is not None:
+        await db.command("ping")
+
+async def warm_up():
+    """Abre conexiones y llena las cachés en segundo plano mientras el webhook ya atiende."""
+    started = time.perf_counter()
+    get_http_session()
+    await asyncio.gather(
+        timed_startup_step("warmup_mongo", warm_mongo_pool()),
+        timed_startup_step("warmup_news_pool", news_pool.refresh()),
+        timed_startup_step("warmup_meme_pool", meme_pool.ensure_refill()),
+        timed_startup_step("warmup_catalog_index", catalog_index.reload()),
+        timed_startup_step("warmup_spam_blocklist", spam_filter.reload()),
+    )
+    startup_timings["warmup_total"] = round(time.perf_counter() - started, 3)
+    warmup_done.set()
+    logging.info(f"Precalentamiento completado: {startup_timings}")
+
+def notify_worker_ready():
+    """Avisa al supervisor (si lo hay) de que este worker ya escucha en el puerto."""
+    ready_fd = os.getenv("WORKER_READY_FD")
+    if ready_fd:
+        with contextlib.suppress(OSError):
+            os.write(int(ready_fd), b"1")
+            os.close(int(ready_fd))
+
+# --- Añadir la nueva tarea de limpieza al main ---
+async def main():
+    logging.info(f"Módulo importado en {startup_timings['import']:.3f}s.")
+    if IS_WORKER_PROCESS and (FSM_STORAGE != "mongo" or COUNTER_BACKEND != "mongo"):
+        logging.warning("Varios workers sin FSM_STORAGE/COUNTER_BACKEND=mongo: los estados y contadores no se comparten entre procesos.")
+
+    # SIGTERM (supervisor, plataforma o docker stop) cancela main y pasa por el cierre ordenado
+    main_task = asyncio.current_task()
+    with contextlib.suppress(NotImplementedError):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, main_task.cancel)
+
+    # 1. Abrir el puerto y registrar el webhook antes que nada
+    started = time.perf_counter()
+    runner = await start_webhook_server()
+    notify_worker_ready()
+    startup_timings["webhook"] = round(time.perf_counter() - started, 3)
+    logging.info(f"Webhook disponible en {startup_timings['webhook']:.3f}s.")
+
+    try:
+        # 2. Precalentar conexiones y cachés; /ready responde 200 cuando termina
+        await warm_up()
+
+        # 3. Iniciar las tareas en segundo plano. Cachés y buffers son de cada proceso.
+        tasks = [
+            asyncio.create_task(counter_flush_scheduler()),
+            asyncio.create_task(request_log.run()),
+            asyncio.create_task(update_recorder.run()),
+            asyncio.create_task(catalog_index.run()),
+            asyncio.create_task(spam_filter.run()),
+        ]
+        # Las tareas programadas solo corren en el worker 0. Cada réplica atiende el webhook, pero
+        # solo la instancia líder de cada lease ejecuta la tarea programada correspondiente.
+        if WORKER_INDEX == 0:
+            tasks += [
+                asyncio.create_task(run_with_leader_lease("auto_post", auto_post_scheduler)),
+                # Las publicaciones programadas no usan lease: corren en el worker 0 de cada réplica
+                # y cada publicación se reclama de forma atómica, así que nunca sale dos veces
+                asyncio.create_task(scheduled_post_timer.run()),
+                asyncio.create_task(run_with_leader_lease("channel_content", channel_content_scheduler)),
+                asyncio.create_task(run_with_leader_lease("movie_cleanup", movie_cleanup_scheduler)),
+                asyncio.create_task(run_with_leader_lease("content_expiry", expired_content_sweeper)),
+                asyncio.create_task(run_with_leader_lease("metadata_backfill", metadata_backfill_scheduler)),
+                asyncio.create_task(run_with_leader_lease("metadata_changes", metadata_changes_scheduler)),
+                asyncio.create_task(run_with_leader_lease("link_check", link_check_scheduler)),
+            ]
+
+        await asyncio.gather(*tasks)
+    except asyncio.CancelledError:
+        logging.info("Las tareas automáticas han sido canceladas.")
+    except Exception as e:
+        logging.error(f"Error general en la ejecución del bot: {e}")
+    finally:
+        # Deja de aceptar conexiones y espera a los updates en curso antes de vaciar buffers
+        await runner.cleanup()
+        await request_log.close()
+        await update_recorder.close()
+        await spam_filter.flush_hits()
+        if shared_http_session is not None and not shared_http_session.closed:
+            await shared_http_session.close()
+        await bot.session.close()
+
+
+# --- Supervisor de workers (WEB_WORKERS > 1) ---
+
+class WorkerSupervisor:
+    """
+    Lanza WEB_WORKERS copias de este script con WORKER_INDEX = 0..N-1 y las relanza si terminan.
+    SIGHUP hace una recarga escalonada: arranca el sustituto de cada worker, espera a que avise
+    por una tubería de que ya escucha en el puerto y solo entonces para el antiguo, de modo que
+    siempre hay procesos atendiendo. SIGTERM/SIGINT paran todos los workers de forma ordenada.
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self.workers = {}  # índice -> proceso actual
+        self._stopping = asyncio.Event()
+        self._reload_lock = asyncio.Lock()
+
+    async def _spawn(self, index):
+        """Lanza el worker y espera su aviso de arranque. Devuelve el proceso y si llegó a escuchar."""
+        ready_read, ready_write = os.pipe()
+        try:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, os.path.abspath(__file__),
+                env={**os.environ, "WORKER_INDEX": str(index), "WORKER_READY_FD": str(ready_write)},
+                pass_fds=(ready_write,),
+            )
+        finally:
+            os.close(ready_write)
+        # Se lee b"1" cuando el worker abre el puerto, o b"" si termina antes de avisar. La lectura
+        # va en el propio event loop (add_reader): al cerrar el descriptor no queda nada leyéndolo.
+        loop = asyncio.get_running_loop()
+        ready_signal = loop.create_future()
+
+        def on_readable():
+            if not ready_signal.done():
+                ready_signal.set_result(os.read(ready_read, 1))
+
+        loop.add_reader(ready_read, on_readable)
+        try:
+            ready = await asyncio.wait_for(ready_signal, timeout=WORKER_START_TIMEOUT_SECONDS) == b"1"
+        except asyncio.TimeoutError:
+            ready = False
+        finally:
+            loop.remove_reader(ready_read)
+            os.close(ready_read)
+        logging.info(f"Worker {index} iniciado (pid {process.pid}){'' if ready else ' sin confirmar el arranque'}.")
+        return process, ready
+
+    async def _stop_process(self, index, process):
+        if process.returncode is not None:
+            return
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), timeout=WORKER_SHUTDOWN_TIMEOUT_SECONDS + 10)
+        except asyncio.TimeoutError:
+            logging.warning(f"El worker {index} (pid {process.pid}) no terminó a tiempo; se fuerza la salida.")
+            process.kill()
+            await process.wait()
+
+    async def _keep_alive(self, index):
+        while not self._stopping.is_set():
+            process = self.workers[index]
+            returncode = await process.wait()
+            if self._stopping.is_set() or self.workers[index] is not process:
+                continue  # Parada o recarga: el proceso se sustituyó a propósito
+            logging.warning(f"El worker {index} terminó con código {returncode}; se relanza en {WORKER_RESTART_DELAY_SECONDS}s.")
+            await asyncio.sleep(WORKER_RESTART_DELAY_SECONDS)
+            if not self._stopping.is_set() and self.workers[index] is process:
+                self.workers[index], _ = await self._spawn(index)
+
+    async def reload(self):
+        async with self._reload_lock:
+            logging.info("Recarga escalonada de los workers.")
+            for index in range(self.count):
+                if self._stopping.is_set():
+                    return
+                old = self.workers[index]
+                new, ready = await self._spawn(index)
+                if self._stopping.is_set():
+                    await self._stop_process(index, new)
+                    return
+                if not ready:
+                    # El sustituto no arranca (p. ej. un error en el código nuevo): se conservan los actuales
+                    logging.error(f"El nuevo worker {index} no llegó a arrancar; recarga cancelada.")
+                    await self._stop_process(index, new)
+                    return
+                self.workers[index] = new
+                await self._stop_process(index, old)
+            logging.info("Recarga completada.")
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self._stopping.set)
+        loop.add_signal_handler(signal.SIGHUP, lambda: asyncio.create_task(self.reload()))
+
+        started = await asyncio.gather(*(self._spawn(index) for index in range(self.count)))
+        self.workers = {index: process for index, (process, _) in enumerate(started)}
+        keepers = [asyncio.create_task(self._keep_alive(index)) for index in range(self.count)]
+        logging.info(f"Supervisor {os.getpid()} con {self.count} workers en el puerto {os.environ.get('PORT', 8080)}.")
+
+        await self._stopping.wait()
+        logging.info("Deteniendo los workers...")
+        async with self._reload_lock:  # Una recarga en curso se detiene tras el worker que está lanzando
+            pass
+        await asyncio.gather(*(self._stop_process(index, process) for index, process in self.workers.items()))
+        for keeper in keepers:
+            keeper.cancel()
+        await asyncio.gather(*keepers, return_exceptions=True)
+
+state_size_probes.update({
+    "user_message_ids": lambda: len(user_message_ids),
+    "meme_pool": lambda: len(meme_pool),
+    "news_pool": lambda: len(news_pool),
+    "render_cache": lambda: len(rendered_movies),
+    "request_log_buffer": lambda: len(request_log),
+    "pending_card_edits": lambda: len(pending_request_cards),
+    "catalog_index": lambda: len(catalog_index),
+    "metadata_refresh_tasks": lambda: len(metadata_refresh_tasks),
+    "spam_patterns": lambda: len(spam_filter),
+    "result_sets": lambda: len(result_sets),
+    "throttle_buckets": lambda: len(user_limiter),
+    "scheduled_posts": lambda: len(scheduled_post_timer),
+    "fsm_cache": lambda: len(getattr(dp.storage, "_cache", ())),
+    "counter_cache": lambda: len(getattr(request_counters, "_cache", getattr(request_counters, "_counts", ()))),
+})
+
+startup_timings["import"] = round(time.perf_counter() - IMPORT_STARTED_AT, 3)
+
+if __name__ == "__main__":
+    if WEB_WORKERS > 1 and not IS_WORKER_PROCESS:
+        asyncio.run(WorkerSupervisor(WEB_WORKERS).run())
+    else:
+        asyncio.run(main())
@@ -0,0 +1,49 @@
+"""
+Importa en bloque un catálogo con el formato de movies.json a MongoDB.
+
+Uso:
+
+    DATABASE_URL=... TELEGRAM_BOT_TOKEN=... TMDB_API_KEY=... python import_movies.py movies.json
+
+El fichero se lee en streaming, los nombres se normalizan, las entradas repetidas se descartan
+por ID y las que no traen ID o título se completan con TMDB (con concurrencia limitada).
+Las escrituras van en lotes de upserts con bulk_write.
+"""
+import argparse
+import asyncio
+import time
+
+import bot
+
+
+async def main(args):
+    started = time.perf_counter()
+
+    async def progress(stats):
+        elapsed = time.perf_counter() - started
+        print(f"[{elapsed:7.1f}s] lote {stats['batches']}: {stats['read']} leídas, "
+              f"{stats['inserted']} nuevas, {stats['updated']} actualizadas, {stats['duplicates']} duplicadas, "
+              f"{stats['enriched']} completadas con TMDB, {stats['skipped']} descartadas", flush=True)
+
+    try:
+        stats = await bot.import_movies_file(
+            args.path,
+            progress,
+            batch_size=args.batch_size,
+            tmdb_concurrency=args.tmdb_concurrency,
+        )
+    finally:
+        if bot.shared_http_session is not None and not bot.shared_http_session.closed:
+            await bot.shared_http_session.close()
+        await bot.bot.session.close()
+
+    print(f"Importación completada en {time.perf_counter() - started:.1f}s.")
+    print(bot.format_import_stats(stats))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Importa un fichero tipo movies.json al catálogo.")
+    parser.add_argument("path", help="Ruta del fichero JSON")
+    parser.add_argument("--batch-size", type=int, default=bot.IMPORT_BATCH_SIZE, help="Upserts por bulk_write")
+    parser.add_argument("--tmdb-concurrency", type=int, default=bot.IMPORT_TMDB_CONCURRENCY, help="Peticiones simultáneas a TMDB")
+    asyncio.run(main(parser.parse_args()))
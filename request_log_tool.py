@@ -0,0 +1,119 @@
+"""
+Consultas sobre el registro de solicitudes que escribe el bot (REQUEST_LOG_PATH).
+
+Lee en streaming el fichero activo y los rotados (.jsonl.gz), línea a línea: la memoria depende
+del número de películas y usuarios distintos, no del número de eventos.
+
+Uso:
+
+    python request_log_tool.py top --limit 20
+    python request_log_tool.py users --limit 50 --since 2025-01-01
+    python request_log_tool.py user 123456789
+    python request_log_tool.py summary
+"""
+import argparse
+import glob
+import gzip
+import json
+import os
+import sys
+from collections import Counter
+
+DEFAULT_PATH = os.getenv("REQUEST_LOG_PATH", "request_logs/requests.jsonl")
+
+
+def log_files(path):
+    """
+    Ficheros rotados (del más antiguo al más reciente) y después el activo. Con WEB_WORKERS > 1
+    cada worker escribe su propio <nombre>-w<índice>.jsonl, que también se incluye.
+    """
+    base, extension = os.path.splitext(path)
+    files = sorted(glob.glob(f"{glob.escape(base)}-*{extension}.gz"))
+    if os.path.exists(path):
+        files.append(path)
+    files.extend(sorted(glob.glob(f"{glob.escape(base)}-w[0-9]*{extension}")))
+    return files
+
+
+def iter_events(path, event="request", since=None, until=None):
+    for file_path in log_files(path):
+        opener = gzip.open if file_path.endswith(".gz") else open
+        with opener(file_path, "rt", encoding="utf-8") as f:
+            for line_number, line in enumerate(f, 1):
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    # Una línea cortada al final del fichero activo no invalida el resto
+                    print(f"Aviso: línea {line_number} ilegible en {file_path}", file=sys.stderr)
+                    continue
+                if event and record.get("event") != event:
+                    continue
+                ts = record.get("ts", "")
+                if since and ts < since:
+                    continue
+                if until and ts >= until:
+                    continue
+                yield record
+
+
+def top_titles(events, outcome=None):
+    counts, titles = Counter(), {}
+    for record in events:
+        if outcome and record.get("outcome") != outcome:
+            continue
+        tmdb_id = record.get("tmdb_id")
+        counts[tmdb_id] += 1
+        if record.get("title"):
+            titles[tmdb_id] = record["title"]
+    return counts, titles
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Consultas sobre el registro de solicitudes del bot.")
+    parser.add_argument("--path", default=DEFAULT_PATH, help="Fichero activo del registro")
+    parser.add_argument("--since", help="Solo eventos desde esta fecha (ISO, p. ej. 2025-01-31)")
+    parser.add_argument("--until", help="Solo eventos anteriores a esta fecha (ISO)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    top_parser = subparsers.add_parser("top", help="Películas más pedidas")
+    top_parser.add_argument("--limit", type=int, default=20)
+    top_parser.add_argument("--outcome", help="Filtra por resultado (sent_to_admin, republished, movie_limit...)")
+
+    users_parser = subparsers.add_parser("users", help="Solicitudes por usuario")
+    users_parser.add_argument("--limit", type=int, default=20)
+
+    user_parser = subparsers.add_parser("user", help="Historial de un usuario")
+    user_parser.add_argument("user_id", type=int)
+
+    subparsers.add_parser("summary", help="Totales por resultado y por origen")
+
+    args = parser.parse_args(argv)
+    events = iter_events(args.path, since=args.since, until=args.until)
+
+    if args.command == "top":
+        counts, titles = top_titles(events, args.outcome)
+        for tmdb_id, count in counts.most_common(args.limit):
+            print(f"{count:>7}  {tmdb_id!s:>9}  {titles.get(tmdb_id, '')}")
+    elif args.command == "users":
+        counts = Counter(record.get("user_id") for record in events)
+        for user_id, count in counts.most_common(args.limit):
+            print(f"{count:>7}  {user_id}")
+    elif args.command == "user":
+        for record in events:
+            if record.get("user_id") == args.user_id:
+                print(f"{record.get('ts')}  {record.get('outcome', ''):<14} {record.get('tmdb_id')!s:>9}  {record.get('title') or ''}")
+    elif args.command == "summary":
+        total, outcomes, sources, users = 0, Counter(), Counter(), set()
+        for record in events:
+            total += 1
+            outcomes[record.get("outcome")] += 1
+            sources[record.get("source")] += 1
+            users.add(record.get("user_id"))
+        print(f"Solicitudes: {total} · usuarios distintos: {len(users)}")
+        for outcome, count in outcomes.most_common():
+            print(f"  {outcome}: {count}")
+        print("Por origen: " + ", ".join(f"{source}={count}" for source, count in sources.most_common()))
+
+
+if __name__ == "__main__":
+    main()